@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for awtiCode.fillMissing (run with asv, see asv.conf.json).
+"""
+
+from awtiCode import fillMissing
+
+from . import generators
+
+
+class TimeFillMissing:
+    """AMM, NRM and IDM versus number of stations, length of the record and fraction of missing values."""
+    params = ([5, 50, 200], [3650, 36500], [0.05, 0.3])
+    param_names = ['stations', 'days', 'gapFraction']
+
+    def setup(self, stations, days, gapFraction):
+        self.panel = generators.stationPanel(stations, days, gapFraction)
+        self.distances = [10.0+i for i in range(stations-1)]
+
+    def time_AMM(self, stations, days, gapFraction):
+        fillMissing.AMM(self.panel)
+
+    def time_NRM(self, stations, days, gapFraction):
+        fillMissing.NRM(self.panel)
+
+    def time_IDM(self, stations, days, gapFraction):
+        fillMissing.IDM(self.panel.iloc[:, 1:], self.distances)
+
+    def peakmem_NRM(self, stations, days, gapFraction):
+        fillMissing.NRM(self.panel)
+
+
+class TimeIDMnetwork:
+    """Inverse distance filling of a whole network with the k nearest stations."""
+    params = ([50, 500], [4, 8])
+    param_names = ['stations', 'k']
+
+    def setup(self, stations, k):
+        self.panel = generators.stationPanel(stations, 3650, 0.1)
+        self.coords = generators.stationCoords(stations)
+
+    def time_IDMnetwork(self, stations, k):
+        fillMissing.IDMnetwork(self.panel, self.coords, k=k)
+
+    def peakmem_IDMnetwork(self, stations, k):
+        fillMissing.IDMnetwork(self.panel, self.coords, k=k)
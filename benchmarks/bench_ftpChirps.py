@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for awtiCode.ftpChirps against a local pyftpdlib server (run with asv, see asv.conf.json).
+The files are served from a temporary folder, so transfer times measure the client and the protocol, not the internet connection.
+"""
+
+import asyncio
+import shutil
+import tempfile
+
+from awtiCode import ftpChirps
+
+from . import generators
+
+
+class TimeFtpDownload:
+    """Download 8 files of 1 MB or 8 MB with the bulk (threaded pool) and the async downloader, versus the number of connections."""
+    params = ([2**20, 2**23], [1, 4])
+    param_names = ['fileSize', 'connections']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+    timeout = 300
+
+    def setup(self, fileSize, connections):
+        self.remote = tempfile.mkdtemp()
+        self.local = tempfile.mkdtemp()
+        self.filenames = generators.writeFiles(self.remote, 8, fileSize)
+        self.server = generators.FtpServer(self.remote)
+
+    def teardown(self, fileSize, connections):
+        self.server.close()
+        shutil.rmtree(self.remote, ignore_errors=True)
+        shutil.rmtree(self.local, ignore_errors=True)
+
+    def time_downloadChirpsBulk(self, fileSize, connections):
+        ftpChirps.downloadChirpsBulk('/', self.filenames, local_folder=self.local, connections=connections,
+                                     host=self.server.host, port=self.server.port)
+
+    def time_downloadManyAsync(self, fileSize, connections):
+        asyncio.run(ftpChirps.downloadManyAsync('/', self.filenames, local_folder=self.local, concurrency=connections,
+                                                host=self.server.host, port=self.server.port))
+
+
+class TimeFtpStream:
+    """Streaming download with on-the-fly gzip decompression and checksum (streamChirps)."""
+    params = [2**20, 2**23]
+    param_names = ['fileSize']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+
+    def setup(self, fileSize):
+        self.remote = tempfile.mkdtemp()
+        self.local = tempfile.mkdtemp()
+        self.filename = generators.writeFiles(self.remote, 1, fileSize, compress=True)[0]
+        self.server = generators.FtpServer(self.remote)
+
+    def teardown(self, fileSize):
+        self.server.close()
+        shutil.rmtree(self.remote, ignore_errors=True)
+        shutil.rmtree(self.local, ignore_errors=True)
+
+    def time_streamChirps(self, fileSize):
+        ftpChirps.streamChirps('/', self.filename, local_folder=self.local, host=self.server.host, port=self.server.port)
+
+
+class TimeFtpListing:
+    """Listing a directory of many files, directly and through getFileListAsync."""
+    params = [100, 1000]
+    param_names = ['files']
+
+    def setup(self, files):
+        self.remote = tempfile.mkdtemp()
+        generators.writeFiles(self.remote, files, 16)
+        self.server = generators.FtpServer(self.remote)
+
+    def teardown(self, files):
+        self.server.close()
+        shutil.rmtree(self.remote, ignore_errors=True)
+
+    def time_getFileListAsync(self, files):
+        asyncio.run(ftpChirps.getFileListAsync('/', host=self.server.host, port=self.server.port))
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmarks for awtiCode (run with asv, see asv.conf.json).
+
+Every benchmark imports in a fresh interpreter, so earlier imports do not hide the cost.
+track_importtime reads the cumulative time of the awtiCode entry from python -X importtime,
+and track_heavyModules counts how many heavy packages a plain "import awtiCode" loads (it should stay 0; tests/test_import.py fails when it does not).
+"""
+
+import subprocess
+import sys
+
+HEAVY = ['pandas', 'xarray', 'matplotlib', 'matplotlib.pyplot', 'ortools', 'scipy']
+
+
+def importTime(module):
+    # Cumulative import time of module, in seconds, as reported by python -X importtime.
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import '+module],
+                            capture_output=True, text=True, check=True)
+    for line in reversed(result.stderr.splitlines()):
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])/1e6
+    raise RuntimeError('No import time found for '+module)
+
+
+class ImportTime:
+    params = ['awtiCode', 'awtiCode.fillMissing', 'awtiCode.ftpChirps', 'awtiCode.mixedFileTypes',
+              'awtiCode.optimization', 'awtiCode.tempAnimation', 'awtiCode.pipeline']
+    param_names = ['module']
+
+    def timeraw_import(self, module):
+        return 'import '+module
+
+    def track_importtime(self, module):
+        return importTime(module)
+    track_importtime.unit = 'seconds'
+
+
+def track_heavyModules():
+    code = 'import sys, awtiCode; print(sum(name in sys.modules for name in '+repr(HEAVY)+'))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return int(result.stdout)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for awtiCode.mixedFileTypes (run with asv, see asv.conf.json).
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from awtiCode import mixedFileTypes
+
+from . import generators
+
+
+def legacyUpsample(data1, data2, timestep1='D', timestep2='ME'):
+    # upsampleData before the disaggregate engine, with only the changes needed to run on pandas 2/3
+    # (set_axis without inplace, bfill() instead of fillna(method='bfill'), 'ME' instead of 'm').
+    data1 = data1.set_axis(['data1raw'], axis=1)
+    data1 = data1.resample(rule=timestep1).mean()
+    data2 = data2.resample(rule=timestep2).mean().loc[data1.index.min():data1.index.max()]
+    data2 = data2.fillna(-999)
+    data1['data2res'] = data2.resample(rule=timestep1).mean()
+    data1.loc[:, 'data2res'] = data1.data2res.bfill().replace(-999, np.nan)
+    data1avg = data1.data1raw.resample(rule=timestep2).mean().fillna(-999)
+    data1['avgfilled'] = data1avg
+    data1.loc[:, 'avgfilled'] = data1.avgfilled.bfill().replace(-999, np.nan)
+    data1.loc[:, 'weights'] = data1.data1raw/data1.avgfilled
+    data1['data2upsampled'] = data1.data2res*data1.weights
+    return data1.get(['data1raw', 'data2upsampled'])
+
+
+class TimeDisaggregate:
+    """Daily disaggregation of monthly data for many stations: disaggregate versus the legacy upsampleData per station."""
+    params = ([1, 20, 200], [10, 40])
+    param_names = ['stations', 'years']
+
+    def setup(self, stations, years):
+        self.fine = generators.stationPanel(stations, 365*years)
+        self.coarse = generators.stationPanel(stations, 365*years, gapFraction=0, seed=1).resample('MS').sum()
+
+    def time_disaggregate(self, stations, years):
+        mixedFileTypes.disaggregate(self.fine, self.coarse)
+
+    def time_legacy(self, stations, years):
+        for column in self.fine.columns:
+            legacyUpsample(self.fine[[column]], self.coarse[[column]])
+
+    def peakmem_disaggregate(self, stations, years):
+        mixedFileTypes.disaggregate(self.fine, self.coarse)
+
+
+class TimeUpsampleData:
+    """upsampleData (one station), the documented single-station interface on top of disaggregate."""
+    params = [3650, 36500]
+    param_names = ['days']
+
+    def setup(self, days):
+        self.fine = generators.stationPanel(1, days)
+        self.coarse = generators.stationPanel(1, days, gapFraction=0, seed=1).resample('MS').sum()
+
+    def time_upsampleData(self, days):
+        mixedFileTypes.upsampleData(self.fine, self.coarse)
+
+
+class TimeNcDataSelect:
+    """Extraction of station series from a CHIRPS-like grid versus number of time steps and method."""
+    params = ([365, 3650], ['closest', 'average', 'idw'])
+    param_names = ['days', 'method']
+
+    def setup(self, days, method):
+        self.dataset = generators.chirpsGrid(days)
+        self.coord = tuple(generators.stationCoords(1).iloc[0])
+
+    def time_ncDataSelect(self, days, method):
+        mixedFileTypes.ncDataSelect(self.dataset, self.coord, method, data_var='precip')
+
+    def peakmem_ncDataSelect(self, days, method):
+        mixedFileTypes.ncDataSelect(self.dataset, self.coord, method, data_var='precip')
+
+
+class TimeNcDataSelectMulti:
+    """Extraction of many stations at once: ncDataSelectMulti, and a StationGridIndex that is built once and applied."""
+    params = ([10, 100, 1000], ['closest', 'idw'])
+    param_names = ['stations', 'method']
+
+    def setup(self, stations, method):
+        self.dataset = generators.chirpsGrid(365)
+        self.coords = generators.stationCoords(stations)
+        self.index = mixedFileTypes.StationGridIndex.fromDataset(self.dataset, self.coords, method)
+
+    def time_ncDataSelectMulti(self, stations, method):
+        mixedFileTypes.ncDataSelectMulti(self.dataset, self.coords, method, data_var='precip')
+
+    def time_stationGridIndexApply(self, stations, method):
+        self.index.apply(self.dataset, data_var='precip')
+
+    def peakmem_ncDataSelectMulti(self, stations, method):
+        mixedFileTypes.ncDataSelectMulti(self.dataset, self.coords, method, data_var='precip')
+
+
+class TimeAlign:
+    """Monthly alignment of station and gridded series: alignStationNc per station versus alignStationsNc for all stations."""
+    params = [1, 20, 200]
+    param_names = ['stations']
+
+    def setup(self, stations):
+        self.stations = generators.stationPanel(stations, 3650)
+        self.grid = generators.stationPanel(stations, 3650, gapFraction=0, seed=1)
+
+    def time_alignStationNc(self, stations):
+        for column in self.stations.columns:
+            mixedFileTypes.alignStationNc(self.stations[[column]], self.grid[[column]])
+
+    def time_alignStationsNc(self, stations):
+        mixedFileTypes.alignStationsNc(self.stations, self.grid, stats=True)
+
+    def peakmem_alignStationsNc(self, stations):
+        mixedFileTypes.alignStationsNc(self.stations, self.grid, stats=True)
+
+
+class TimeStore:
+    """Point series from a folder of daily NetCDF files (openNcLazy) versus from the Zarr store made by ingestChirps."""
+    params = [365, 1461]
+    param_names = ['days']
+    timeout = 300
+
+    def setup(self, days):
+        self.folder = tempfile.mkdtemp()
+        grid = generators.chirpsGrid(days)
+        for t in range(days):
+            day = grid.isel(time=[t])
+            day.to_netcdf(os.path.join(self.folder, 'chirps-v2.0.'+str(day['time'].dt.strftime('%Y.%m.%d').values[0])+'.nc'))
+        self.store = mixedFileTypes.ingestChirps(self.folder, os.path.join(self.folder, 'chirps.zarr'))
+        self.coord = tuple(generators.stationCoords(1).iloc[0])
+
+    def teardown(self, days):
+        shutil.rmtree(self.folder)
+
+    def time_dailyFiles(self, days):
+        dataset = mixedFileTypes.openNcLazy(os.path.join(self.folder, '*.nc'))
+        mixedFileTypes.ncDataSelect(dataset, self.coord, data_var='precip', lazy=True)
+
+    def time_store(self, days):
+        mixedFileTypes.ncDataSelect(self.store, self.coord, data_var='precip')
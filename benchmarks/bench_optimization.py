@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for awtiCode.optimization (run with asv, see asv.conf.json).
+"""
+
+from awtiCode import optimization
+
+from . import generators
+
+
+class TimeCropSchedule:
+    """cropSchedule versus number of crops, with model building and solving timed separately (CropScheduleModel builds once)."""
+    params = [2, 4, 8, 16]
+    param_names = ['noCrops']
+    timeout = 300
+
+    def setup(self, noCrops):
+        self.instance = generators.cropInstance(noCrops)
+        self.model = optimization.CropScheduleModel(**self.instance)
+
+    def time_build(self, noCrops):
+        optimization.CropScheduleModel(**self.instance)
+
+    def time_solve(self, noCrops):
+        self.model.solve(maxTime=60, hint=False, threads=1)
+
+    def time_cropSchedule(self, noCrops):
+        optimization.cropSchedule(**self.instance)
+
+    def track_buildTime(self, noCrops):
+        return optimization.cropSchedule(**self.instance).attrs['buildTime']
+    track_buildTime.unit = 'seconds'
+
+    def track_solveTime(self, noCrops):
+        return optimization.cropSchedule(**self.instance).attrs['solveTime']
+    track_solveTime.unit = 'seconds'
+
+    def peakmem_cropSchedule(self, noCrops):
+        optimization.cropSchedule(**self.instance)
+
+
+class TimeCropScheduleFields:
+    """Solve time of cropScheduleFields versus horizon length and number of fields, for both formulations."""
+    params = ([1, 5, 10], [2, 8, 24], ['time', 'interval'])
+    param_names = ['noYears', 'noFields', 'formulation']
+    timeout = 600
+
+    def time_solve(self, noYears, noFields, formulation):
+        optimization.cropScheduleFields(noYears=noYears, fieldAreas=[2000//noFields]*noFields,
+                                        waterAvailable=[100000]*6+[60000]*6, formulation=formulation, maxTime=60)
+
+    def track_status(self, noYears, noFields, formulation):
+        fieldsDf = optimization.cropScheduleFields(noYears=noYears, fieldAreas=[2000//noFields]*noFields,
+                                                   waterAvailable=[100000]*6+[60000]*6, formulation=formulation, maxTime=60)
+        return int(fieldsDf.attrs['status'] == 'OPTIMAL')
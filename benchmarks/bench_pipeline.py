@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for awtiCode.pipeline against a local pyftpdlib server (run with asv, see asv.conf.json).
+"""
+
+import os
+import shutil
+import tempfile
+
+from awtiCode import ftpChirps, mixedFileTypes, pipeline
+
+from . import generators
+
+
+class TimeDailyRun:
+    """
+    Download, open and extract 20 stations from gzipped daily files: the pipelined runner versus the same steps one after another.
+    With latency (seconds per FTP command) the server behaves like a server far away, so there is network time to overlap.
+    """
+    params = ([30, 120], [0, 0.02])
+    param_names = ['days', 'latency']
+    number = 1
+    repeat = 3
+    warmup_time = 0
+    timeout = 300
+
+    def setup(self, days, latency):
+        self.remote = tempfile.mkdtemp()
+        self.filenames = generators.writeChirpsFiles(self.remote, days)
+        self.coords = generators.stationCoords(20)
+        self.server = generators.FtpServer(self.remote, latency)
+
+    def teardown(self, days, latency):
+        self.server.close()
+        shutil.rmtree(self.remote, ignore_errors=True)
+
+    def time_pipeline(self, days, latency):
+        local = tempfile.mkdtemp()
+        pipeline.runPipeline('/', self.coords, os.path.join(local, 'stations.csv'), filenames=self.filenames, local_folder=local,
+                             host=self.server.host, port=self.server.port)
+        shutil.rmtree(local)
+
+    def time_sequential(self, days, latency):
+        local = tempfile.mkdtemp()
+        ftpChirps.downloadChirpsBulk('/', self.filenames, local_folder=local, host=self.server.host, port=self.server.port)
+        index = None
+        for filename in self.filenames:
+            dataset = mixedFileTypes._openChirpsFile(os.path.join(local, filename), 'precip', None, None)
+            if index is None:
+                index = mixedFileTypes.StationGridIndex.fromDataset(dataset, self.coords)
+            index.apply(dataset, 'precip')
+        shutil.rmtree(local)
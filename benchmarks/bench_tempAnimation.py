@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for awtiCode.tempAnimation (run with asv, see asv.conf.json).
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+from awtiCode import tempAnimation
+
+from . import generators
+
+
+class TimeAnimateFrames:
+    """Cost of drawing frames of animateLatLonNC (10 frames per call), for both render modes and several grid sizes."""
+    params = (['contour', 'fast'], [50, 200, 400])
+    param_names = ['render', 'gridSize']
+    frames = 10
+
+    def setup(self, render, gridSize):
+        self.dataset = generators.chirpsGrid(self.frames, gridSize, gridSize)
+        self.anim = tempAnimation.animateLatLonNC(self.dataset, 'precip', lonDim='longitude', latDim='latitude',
+                                                  render=render, vmin=0, vmax=30, prefetch=0)
+        self.fig = self.anim._fig
+
+    def teardown(self, render, gridSize):
+        plt.close(self.fig)
+
+    def time_frames(self, render, gridSize):
+        # FuncAnimation has no public per-frame call: update the artists and draw the canvas like saving a movie does.
+        for i in range(self.frames):
+            self.anim._func(i)
+            self.fig.canvas.draw()
+
+
+class TimeAnimationSetup:
+    """animateLatLonNC up to the first frame, versus the number of time steps (time labels and frame source)."""
+    params = [120, 1200, 12000]
+    param_names = ['timesteps']
+
+    def setup(self, timesteps):
+        self.dataset = generators.chirpsGrid(timesteps, 20, 20)
+
+    def time_setup(self, timesteps):
+        anim = tempAnimation.animateLatLonNC(self.dataset, 'precip', lonDim='longitude', latDim='latitude', render='fast')
+        anim.frameSource.close()
+        plt.close(anim._fig)
+
+    def peakmem_setup(self, timesteps):
+        anim = tempAnimation.animateLatLonNC(self.dataset, 'precip', lonDim='longitude', latDim='latitude', render='fast')
+        anim.frameSource.close()
+        plt.close(anim._fig)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic data for the benchmarks: the same arguments always give the same data.
+
+stationPanel : daily rainfall of many stations, with a fraction of missing values.
+stationCoords : station coordinates inside the grid of chirpsGrid.
+chirpsGrid : an xarray Dataset shaped like daily CHIRPS (0.05 degree, variable 'precip', float32).
+writeChirpsFiles : daily CHIRPS-named NetCDF files of chirpsGrid, optionally gzipped.
+cropInstance : the settings of a cropSchedule problem with a given number of crops.
+FtpServer : a local pyftpdlib server in a background thread, serving a folder of files, optionally with latency.
+"""
+
+import gzip
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# A CHIRPS-like window over southern Ethiopia (the CHIRPS grid has 0.05 degree cells).
+LAT0, LON0, RESOLUTION = 5.025, 36.025, 0.05
+
+
+def _rainfall(rng, shape):
+    # Gamma distributed rain on about 40% of the days, dry otherwise.
+    rain = rng.gamma(0.8, 8.0, shape)
+    rain[rng.random(shape) < 0.6] = 0.0
+    return rain
+
+
+def stationPanel(stations=20, days=3650, gapFraction=0.1, start='1991-01-01', seed=0):
+    """Daily rainfall (mm) of stations 'station0' ... as DataFrame indexed by time, with gapFraction of the values missing."""
+    rng = np.random.default_rng(seed)
+    values = _rainfall(rng, (days, stations))
+    # Stations differ in their climate, so normal ratios are not all 1.
+    values *= rng.uniform(0.5, 1.5, stations)
+    values[rng.random(values.shape) < gapFraction] = np.nan
+    index = pd.date_range(start, periods=days, freq='D', name='time')
+    return pd.DataFrame(values, index=index, columns=['station'+str(i) for i in range(stations)])
+
+
+def stationCoords(stations=20, nlat=100, nlon=100, seed=0):
+    """Coordinates (lat, lon columns, indexed by station name) of stations within the grid of chirpsGrid(nlat=nlat, nlon=nlon)."""
+    rng = np.random.default_rng(seed+1)
+    lats = LAT0+rng.uniform(1, nlat-2, stations)*RESOLUTION
+    lons = LON0+rng.uniform(1, nlon-2, stations)*RESOLUTION
+    return pd.DataFrame({'lat': lats, 'lon': lons}, index=['station'+str(i) for i in range(stations)])
+
+
+def chirpsGrid(days=365, nlat=100, nlon=100, start='1991-01-01', seed=0):
+    """Daily rainfall on a regular 0.05 degree grid, as xarray Dataset with variable 'precip' (time, latitude, longitude)."""
+    import xarray as xr
+    rng = np.random.default_rng(seed)
+    values = _rainfall(rng, (days, nlat, nlon)).astype(np.float32)
+    return xr.Dataset({'precip': (('time', 'latitude', 'longitude'), values)},
+                      coords={'time': pd.date_range(start, periods=days, freq='D'),
+                              'latitude': LAT0+np.arange(nlat)*RESOLUTION,
+                              'longitude': LON0+np.arange(nlon)*RESOLUTION})
+
+
+def cropInstance(noCrops=4, seed=0):
+    """Keyword arguments of cropSchedule/CropScheduleModel for a problem with noCrops crops."""
+    rng = np.random.default_rng(seed)
+    return {'noCrops': noCrops,
+            'cropCycle': [int(c) for c in rng.integers(3, 6, noCrops)],
+            'waterUse': [int(w) for w in rng.integers(20, 45, noCrops)*10],
+            'cropProfit': [int(p) for p in rng.integers(10, 40, noCrops)*1000],
+            'waterAvailable': [100000]*6+[60000]*6,
+            'landAvailable': 2000}
+
+
+def writeFiles(folder, number=8, size=2**20, compress=False, seed=0):
+    """Write number CHIRPS-named files of size bytes (random content) to folder, gzipped if compress; returns the file names."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for i in range(number):
+        name = 'chirps-v2.0.1991.01.'+str(i+1).zfill(2)+'.tif'+('.gz' if compress else '')
+        opener = gzip.open if compress else open
+        with opener(os.path.join(folder, name), 'wb') as file:
+            file.write(rng.bytes(size))
+        names.append(name)
+    return names
+
+
+def writeChirpsFiles(folder, days=30, nlat=100, nlon=100, compress=True, seed=0):
+    """Write chirpsGrid(days, nlat, nlon) as one NetCDF file per day (chirps-v2.0.YYYY.MM.DD.nc, .nc.gz if compress) to folder; returns the file names."""
+    grid = chirpsGrid(days, nlat, nlon, seed=seed)
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for t in range(days):
+        day = grid.isel(time=[t])
+        name = 'chirps-v2.0.'+str(day['time'].dt.strftime('%Y.%m.%d').values[0])+'.nc'
+        data = day.to_netcdf()
+        opener = gzip.open if compress else open
+        with opener(os.path.join(folder, name+('.gz' if compress else '')), 'wb') as file:
+            file.write(bytes(data))
+        names.append(name+('.gz' if compress else ''))
+    return names
+
+
+class FtpServer:
+    """
+    A local anonymous (read-only) pyftpdlib server for folder, on a free port of 127.0.0.1.
+    With latency (seconds), every command is answered that much later, like a server far away; every connection has its own thread, so only that connection waits.
+    """
+    def __init__(self, folder, latency=0):
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+        logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(folder)
+        def process_command(handler, cmd, *args, **kwargs):
+            time.sleep(latency)
+            FTPHandler.process_command(handler, cmd, *args, **kwargs)
+        settings = {'authorizer': authorizer, 'banner': 'benchmark'}
+        if latency > 0:
+            settings['process_command'] = process_command
+        handler = type('BenchmarkHandler', (FTPHandler,), settings)
+        # pyftpdlib changes the working directory of the process while it handles commands; close() restores it.
+        self.cwd = os.getcwd()
+        self.server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+        self.host, self.port = self.server.address[:2]
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'handle_exit': False}, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.close_all()
+        self.thread.join(timeout=5)
+        os.chdir(self.cwd)
@@ -1,6 +1,14 @@
-__all__ = ['fillMissing','ftpChirps','mixedFileTypes','tempAnimation','optimization']
+__all__ = ['fillMissing','ftpChirps','mixedFileTypes','tempAnimation','optimization','instrumentation','pipeline']
 
-from . import fillMissing
-from . import ftpChirps
-from . import mixedFileTypes
-from . import tempAnimation
+import importlib
+
+def __getattr__(name):
+    # Submodules are imported on first use (PEP 562), so importing awtiCode does not load pandas, matplotlib, xarray or OR-Tools.
+    if name in __all__:
+        module = importlib.import_module('.'+name,__name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module '+repr(__name__)+' has no attribute '+repr(name))
+
+def __dir__():
+    return sorted(list(globals())+__all__)
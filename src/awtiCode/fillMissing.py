@@ -1,18 +1,21 @@
 # -*- coding: utf-8 -*-
 """
-This module contains three functions for filling missing data:
+This module contains functions for filling missing data:
     - Arithmetic Mean method (functionname: AMM)
     - Normal Ratio Method (functionname: NRM)
     - Inverse distance method (functionname: IDM)
+    - Inverse distance method for a whole station network (functionname: IDMnetwork)
+and a function to fill CSV/Parquet files that are too large for memory with one of these methods (functionname: fillMissingStream).
 For a working example, see Estimation of Missing Data.py
 @author: Israel
 """
 
 import pandas as pd
 import numpy as np
+from .instrumentation import logger
 
 #1)Arithmetic Mean Method
-def AMM(dataframe):
+def AMM(dataframe,chunkRows=100000):
     """
     The provided dataframe should only have columns that you want filled. They will be filled on the average of the respective columns.
 
@@ -20,30 +23,34 @@ def AMM(dataframe):
     ----------
     dataframe : pandas dataframe
         Dataframe with columns containing data (to use in filling) and missing data (to fill).
+    chunkRows : int, optional
+        Number of rows (timesteps) handled at once; limits the memory used next to the input and output. The default is 100000.
 
     Returns
     -------
     DataFrame with all missing values filled.
 
     """
-    fillvalues = dataframe.mean(axis=1)
-    colnames = dataframe.columns
-    filldict = {}
-    for colname in colnames:
-        filldict[colname] = fillvalues
-    dfFilled = dataframe.fillna(filldict)
+    values = np.array(dataframe,dtype=float)
+    _fillMasked(values,np.ones(values.shape[1]),chunkRows)
+    dfFilled = pd.DataFrame(values,index=dataframe.index,columns=dataframe.columns)
     return dfFilled
 
 
 #2) Normal Ratio Method
-def NRM(dataframe):
+def NRM(dataframe,normals=None,chunkRows=100000):
     """
     The provided dataframe should only have columns that you want filled. Missing data of each column will be filled based on the normal ratio of the other columns.
+    Only the other columns that have data at a timestep are used for that timestep.
 
     Parameters
     ----------
     dataframe : pandas dataframe
         Dataframe with columns containing data (to use in filling) and missing data (to fill).
+    normals : pandas Series, optional
+        The normal of each column (Ni), indexed by column name. The default is None: the mean of each column.
+    chunkRows : int, optional
+        Number of rows (timesteps) handled at once; limits the memory used next to the input and output. The default is 100000.
 
     Returns
     -------
@@ -53,23 +60,24 @@ def NRM(dataframe):
 
     #Normal ratio method requares the normal anual rain fall of each station (Ni) and 
     #the mean annual rain fall of all stations(Nx)
-    Ni = dataframe.mean()
+    if normals is None:
+        Ni = dataframe.mean()
+    else:
+        Ni = pd.Series(normals).reindex(dataframe.columns)
     Nx = Ni.mean()
 
-    # code to calculate the normal ratio of each station    
-    filldict = {}
-    for column in dataframe.columns:
-        othercolumns = dataframe.iloc[:,dataframe.columns!=column]
-        NiOthers = Ni[Ni.index!=column]
-        filldict[column] = (Nx/len(NiOthers))*((othercolumns/NiOthers).sum(axis=1))
-
-    dfFilled = dataframe.fillna(filldict)
+    # A missing value of station i at time t is Nx/n * sum(Pj/Nj) over the n other stations j with data at time t.
+    # Station i itself has no data at time t, so this is the same value for every missing station at time t.
+    values = np.array(dataframe,dtype=float)
+    _fillMasked(values,1/Ni.to_numpy(dtype=float),chunkRows,factor=Nx)
+    dfFilled = pd.DataFrame(values,index=dataframe.index,columns=dataframe.columns)
     return dfFilled
 
 #3) Inverse distance method
-def IDM(fillColumns,distances):
+def IDM(fillColumns,distances,chunkRows=100000):
     """
     Calculate inverse distance weighed values for a certain point, based on provided columns and corresponding distances to that point.
+    At each timestep, only the columns with data are used (and the weights are based on those columns only).
 
     Parameters
     ----------
@@ -77,6 +85,8 @@ def IDM(fillColumns,distances):
         The columns based on which the inverse distance weighted values are calculated.
     distances : collection, array-like
         The distances 
+    chunkRows : int, optional
+        Number of rows (timesteps) handled at once. The default is 100000.
 
     Returns
     -------
@@ -85,16 +95,206 @@ def IDM(fillColumns,distances):
 
     """
     if len(fillColumns.columns)!=len(distances):
-        print('THe number of provided columns is not equal to the number of provided distances. IDW cannot be calculated.')
+        logger.error('THe number of provided columns is not equal to the number of provided distances. IDW cannot be calculated.')
         return
     
-    distances = np.array(distances)
+    distances = np.array(distances,dtype=float)
     invDist = 1/distances**2
-    sumID = np.sum(invDist)
     
-    #To make shure that the correct distance is matched with the correct column,
-    # the array needs to be reshaped from (n,) to (1,n).
-    distSquared = (distances**2).reshape(1,len(distances))
+    values = np.array(fillColumns,dtype=float)
+    fillData = np.empty(len(values))
+    for start in range(0,len(values),chunkRows):
+        block = values[start:start+chunkRows]
+        fillData[start:start+chunkRows] = _maskedMean(block,invDist,normalize='weights')
+    fillData = pd.Series(fillData,index=fillColumns.index)
+    return fillData
+
+#4) Inverse distance method for a whole network of stations
+def IDMnetwork(dataframe,coords,k=4,power=2,maxNeighbours=None,haversine=True,chunkRows=None):
+    """
+    Fill all missing data of a network of stations with the inverse distance method. At every timestep, each missing value is filled from the k nearest stations that have data at that timestep.
+    The nearest stations are found once with a KD-tree (scipy is required), so this also works for thousands of stations.
+
+    Parameters
+    ----------
+    dataframe : pandas dataframe
+        Dataframe with one column per station, containing data and missing data (to fill).
+    coords : pandas dataframe or array-like of shape (N,2)
+        The (lat,lon) coordinates of the stations. A dataframe should have a latitude and a longitude column (column names containing 'lat' and 'lon') and be indexed by the column names of dataframe. An array should be in the same order as the columns of dataframe.
+    k : int, optional
+        The number of stations (with data) used to fill a missing value. The default is 4.
+    power : float, optional
+        The weights are 1/distance**power. The default is 2.
+    maxNeighbours : int, optional
+        The number of nearest stations searched for k stations with data. The default is None: 4*k (at least 16), limited to the number of other stations.
+        If fewer than k of these have data at a timestep, only those are used; if none has data, the value stays missing.
+    haversine : boolean, optional
+        If True (default), distances are great-circle distances (km) on the earth. If False, distances are calculated directly from the coordinates.
+    chunkRows : int, optional
+        Number of rows (timesteps) handled at once. The default is None: chosen such that the temporary arrays stay below about 256MB.
+
+    Returns
+    -------
+    DataFrame with the missing values filled.
+
+    """
+    from scipy.spatial import cKDTree
+    
+    if isinstance(coords,pd.DataFrame):
+        latcol = coords.columns[coords.columns.str.lower().str.find('lat')>-1][0]
+        loncol = coords.columns[coords.columns.str.lower().str.find('lon')>-1][0]
+        coords = coords.loc[dataframe.columns,[latcol,loncol]]
+    coords = np.asarray(coords,dtype=float).reshape(-1,2)
+    if len(coords)!=len(dataframe.columns):
+        logger.error('The number of provided coordinates is not equal to the number of columns. IDW cannot be calculated.')
+        return
     
-    fillData = (fillColumns/distSquared).sum(axis=1)/sumID
-    return fillData
\ No newline at end of file
+    nStations = len(coords)
+    if nStations < 2:
+        logger.warning('IDW needs at least 2 stations; the data is returned without filling.')
+        return dataframe.copy()
+    if maxNeighbours is None:
+        maxNeighbours = max(4*k,16)
+    maxNeighbours = min(maxNeighbours,nStations-1)
+    
+    # Build the tree once; on the sphere, the straight-line (chord) distance between unit vectors has the same order as the great-circle distance.
+    if haversine:
+        lat, lon = np.radians(coords[:,0]), np.radians(coords[:,1])
+        points = np.stack([np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)],axis=1)
+    else:
+        points = coords
+    distances, neighbours = cKDTree(points).query(points,k=maxNeighbours+1)
+    distances, neighbours = distances.reshape(nStations,-1), neighbours.reshape(nStations,-1)
+    # Remove each station itself from its own neighbours (stable sort keeps the distance order).
+    order = np.argsort(neighbours==np.arange(nStations)[:,None],axis=1,kind='stable')[:,:maxNeighbours]
+    distances = np.take_along_axis(distances,order,axis=1)
+    neighbours = np.take_along_axis(neighbours,order,axis=1)
+    if haversine:
+        distances = 2*6371*np.arcsin(np.clip(distances/2,0,1))
+    weights = 1/np.maximum(distances,1e-9)**power
+    
+    values = np.array(dataframe,dtype=float)
+    if chunkRows is None:
+        chunkRows = max(1,256*2**20//(nStations*maxNeighbours*8*4))
+    for start in range(0,len(values),chunkRows):
+        block = values[start:start+chunkRows]
+        missing = np.isnan(block)
+        rows = np.nonzero(missing.any(axis=1))[0]
+        if len(rows) == 0:
+            continue
+        neighbourData = block[rows][:,neighbours]
+        available = ~np.isnan(neighbourData)
+        # Use, per timestep and station, the first k neighbours (in order of distance) that have data.
+        use = available&(np.cumsum(available,axis=2)<=k)
+        useWeights = use*weights
+        with np.errstate(invalid='ignore',divide='ignore'):
+            fill = np.where(use,neighbourData,0)
+            fill = np.einsum('tsn,tsn->ts',fill,useWeights)/useWeights.sum(axis=2)
+        block[rows] = np.where(missing[rows],fill,block[rows])
+    
+    dfFilled = pd.DataFrame(values,index=dataframe.index,columns=dataframe.columns)
+    return dfFilled
+
+#5) Filling files larger than memory
+def fillMissingStream(source,output,method='NRM',normals=None,chunkRows=100000,timeColumn=None,**methodOptions):
+    """
+    Fill the missing data of a CSV or Parquet file that is too large to load into memory at once. The file is read and filled in chunks of rows (timesteps), and the result is written to a Parquet file chunk by chunk.
+
+    Parameters
+    ----------
+    source : str
+        A .csv file or a .parquet file with a time column (or index) and one column per station.
+    output : str
+        The Parquet file to write the filled data to.
+    method : str, optional
+        One of 'AMM', 'NRM' or 'IDMnetwork'. The default is 'NRM'.
+    normals : pandas Series, optional
+        Only used for NRM: the normal of each station (Ni). The default is None: the normals are calculated in a first pass over the file.
+    chunkRows : int, optional
+        Number of rows read and filled at once. The default is 100000.
+    timeColumn : str, optional
+        The name of the time column. The default is None: the first column of a CSV file, or the index stored in a Parquet file.
+    **methodOptions :
+        Other arguments for the method, for example coords (required) and k for IDMnetwork.
+
+    Returns
+    -------
+    normals : pandas Series
+        For NRM, the normals that were used (these can be provided again for the next file); otherwise None.
+
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    if method not in ['AMM','NRM','IDMnetwork']:
+        logger.error('Method '+str(method)+' unknown. Please select from one of "AMM", "NRM", "IDMnetwork".')
+        return
+    
+    # First (cheap) pass: the station normals as sum/count over all chunks.
+    if method == 'NRM' and normals is None:
+        sums, counts = 0, 0
+        for chunk in _readChunks(source,chunkRows,timeColumn):
+            sums = sums+chunk.sum()
+            counts = counts+chunk.count()
+        normals = sums/counts
+    
+    writer = None
+    rows = 0
+    try:
+        for chunk in _readChunks(source,chunkRows,timeColumn):
+            if method == 'AMM':
+                filled = AMM(chunk,chunkRows)
+            elif method == 'NRM':
+                filled = NRM(chunk,normals,chunkRows)
+            else:
+                filled = IDMnetwork(chunk,**methodOptions)
+            table = pa.Table.from_pandas(filled,preserve_index=True)
+            if writer is None:
+                writer = pq.ParquetWriter(output,table.schema)
+            writer.write_table(table.cast(writer.schema))
+            rows += len(filled)
+    finally:
+        if writer is not None:
+            writer.close()
+    logger.info('Filled '+str(rows)+' rows with '+method+'. The result is saved as '+output+'.')
+    return normals if method == 'NRM' else None
+
+def _readChunks(source,chunkRows,timeColumn=None):
+    # Chunks of rows of a CSV or Parquet file as DataFrames indexed by time.
+    if str(source).lower().endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquetFile = pq.ParquetFile(source)
+        indexColumns = [column for column in (parquetFile.schema_arrow.pandas_metadata or {}).get('index_columns',[]) if isinstance(column,str)]
+        for batch in parquetFile.iter_batches(batch_size=chunkRows):
+            chunk = batch.to_pandas()
+            if timeColumn is not None:
+                chunk = chunk.set_index(timeColumn)
+            elif len(indexColumns) > 0 and all(column in chunk.columns for column in indexColumns):
+                chunk = chunk.set_index(indexColumns)
+                chunk.index.names = [None if name.startswith('__index_level_') else name for name in chunk.index.names]
+            yield chunk.astype(float)
+    else:
+        for chunk in pd.read_csv(source,chunksize=chunkRows,index_col=timeColumn if timeColumn is not None else 0,parse_dates=True):
+            yield chunk.astype(float)
+
+def _maskedMean(block,weights,normalize='count'):
+    # Per row sum(w*x)/sum(w) (normalize='weights') or sum(w*x)/n (normalize='count') over the non-missing x only.
+    available = ~np.isnan(block)
+    weightedSum = np.where(available,block,0)@weights
+    if normalize == 'weights':
+        denominator = available@weights
+    else:
+        denominator = available.sum(axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(denominator>0,weightedSum/denominator,np.nan)
+
+def _fillMasked(values,weights,chunkRows,factor=1):
+    # Fill the missing values in values (in place) with factor*_maskedMean of their row, chunkRows rows at a time.
+    for start in range(0,len(values),chunkRows):
+        block = values[start:start+chunkRows]
+        missing = np.isnan(block)
+        rows = np.nonzero(missing.any(axis=1))[0]
+        if len(rows) == 0:
+            continue
+        fill = factor*_maskedMean(block[rows],weights)
+        block[rows] = np.where(missing[rows],fill[:,None],block[rows])
\ No newline at end of file
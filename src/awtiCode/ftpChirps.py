@@ -1,97 +1,901 @@
-# -*- coding: utf-8 -*-
-"""
-Created on Tue Nov 15 08:21:44 2022
-
-@author: Demiso
-"""
-#use this to download data from ftp
-
-from ftplib import FTP
-import os, sys, os.path
-
-def ftpChirpsExplore(directory = '/pub/org/chg/products/'):
-    ftp = FTP("ftp.chc.ucsb.edu")
-    ftp.login()
-    ftp.cwd(directory)
-    answer = 'start'
-    chosen_directory = directory
-    while True:
-        file_list = ftp.nlst()
-        print('Under directory '+chosen_directory+', there are the following directories and/or files: ')
-        print(file_list)
-        answer = input('Type any directory you want to go into. To go back to the original directory, type \'back\'. To stop exploring, type \'quit\'. To go one directory up, type \'up\'.\n>>>')
-        if answer.lower().startswith('q'):
-            print('You are leaving the ftp server.')
-            break
-        elif answer == 'back':
-            print('Going back to directory '+directory)
-            chosen_directory = directory
-            ftp.cwd(directory)
-        elif answer == 'up':
-            bindex = chosen_directory[-2::-1].find('/')
-            chosen_directory = chosen_directory[:-1-bindex]
-            print('Going up to directory '+chosen_directory)
-            ftp.cwd(chosen_directory)
-        elif answer in file_list:
-            try:
-                ftp.cwd(chosen_directory+answer+'/')
-                chosen_directory += answer+'/'               
-            except:
-                print('It was not possible to go into '+chosen_directory+answer+'/. Please select another.')
-        else:
-            print('Input was not clear.')
-    ftp.quit()
-
-def getFileList(directory):
-    #Connecting to the ftp server
-    ftp = FTP('ftp.chc.ucsb.edu')
-    ftp.login()
-    #Changing to the given directory
-    print ('Changing to ' + directory)
-    try:
-        ftp.cwd(directory)
-    except:
-        print('The given directory does not exist. Please provide a valid Chirps ftp directory, under which there is the file with the given filename.')
-        ftp.close()
-        return
-    filelist = ftp.nlst()
-    ftp.close()
-    print('List of '+str(len(filelist))+' files found under directory '+directory+'.')
-    print('You can use the directory in combination with any of the filenames in the function downloadChirps, to download that specific file.')
-    return filelist
-
-def downloadChirps(directory,filename,local_folder=None):
-    
-    #Connecting to the ftp server
-    ftp = FTP('ftp.chc.ucsb.edu')
-    ftp.login()
-    #Changing to the given directory
-    print ('Changing to ' + directory)
-    try:
-        ftp.cwd(directory)
-    except:
-        print('The given directory does not exist. Please provide a valid Chirps ftp directory, under which there is the file with the given filename.')
-        ftp.close()
-        return
-
-    #Setting up local file, requesting (and downloading) file from server, and writing it to local file.
-    if local_folder == None:
-        print('No local folder given. The file will be saved in your current working drectory.')
-        local_filename = filename
-    else:
-        local_filename = os.path.join(local_folder, filename)
-    
-    file = open(local_filename, 'wb')
-    
-    try:
-        print('Starting to download file. This might take a while...')
-        
-        ftp.retrbinary("RETR " + filename, file.write)    
-        file.close()
-    except:
-        print('Something went wrong. Download is not succeeded.')
-        file.close()
-        ftp.quit()
-        return
-    print('Download finished. File saved as '+local_filename+'.')
-    ftp.quit()
\ No newline at end of file
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 15 08:21:44 2022
+
+@author: Demiso
+"""
+#use this to download data from ftp
+
+from ftplib import FTP, all_errors, error_perm, error_reply, error_temp
+from concurrent.futures import ThreadPoolExecutor
+import os, sys, os.path
+import asyncio, calendar, contextlib, fnmatch, hashlib, inspect, io, queue, re, sqlite3, threading, time, zlib
+from .instrumentation import logger, span
+
+CHIRPS_HOST = 'ftp.chc.ucsb.edu'
+
+def ftpChirpsExplore(directory = '/pub/org/chg/products/',cache=None):
+    ftp = FTP("ftp.chc.ucsb.edu")
+    ftp.login()
+    ftp.cwd(directory)
+    answer = 'start'
+    chosen_directory = directory
+    while True:
+        if cache is None:
+            file_list = ftp.nlst()
+        else:
+            file_list = cache.listDirectory(chosen_directory,ftp)
+        print('Under directory '+chosen_directory+', there are the following directories and/or files: ')
+        print(file_list)
+        answer = input('Type any directory you want to go into. To go back to the original directory, type \'back\'. To stop exploring, type \'quit\'. To go one directory up, type \'up\'.\n>>>')
+        if answer.lower().startswith('q'):
+            print('You are leaving the ftp server.')
+            break
+        elif answer == 'back':
+            print('Going back to directory '+directory)
+            chosen_directory = directory
+            ftp.cwd(directory)
+        elif answer == 'up':
+            bindex = chosen_directory[-2::-1].find('/')
+            chosen_directory = chosen_directory[:-1-bindex]
+            print('Going up to directory '+chosen_directory)
+            ftp.cwd(chosen_directory)
+        elif answer in file_list:
+            try:
+                ftp.cwd(chosen_directory+answer+'/')
+                chosen_directory += answer+'/'               
+            except:
+                print('It was not possible to go into '+chosen_directory+answer+'/. Please select another.')
+        else:
+            print('Input was not clear.')
+    ftp.quit()
+
+def getFileList(directory,cache=None):
+    if cache is not None:
+        #The cache only connects to the ftp server if its listing is missing or outdated
+        try:
+            filelist = cache.listDirectory(directory)
+        except all_errors:
+            logger.error('The given directory does not exist. Please provide a valid Chirps ftp directory, under which there is the file with the given filename.')
+            return
+        logger.info('List of '+str(len(filelist))+' files found under directory '+directory+'.')
+        return filelist
+    return _runSync(getFileListAsync(directory))
+
+def downloadChirps(directory,filename,local_folder=None,cache=None):
+    
+    #If the cache knows the file and an identical local copy exists, nothing needs to be downloaded
+    if cache is not None:
+        local_filename = filename if local_folder == None else os.path.join(local_folder, filename)
+        size, modified = cache.fileInfo(directory,filename)
+        if _localIsComplete(local_filename,size,modified):
+            logger.info('File '+local_filename+' is already downloaded and up to date.')
+            return
+    
+    local_filename = _runSync(downloadChirpsAsync(directory,filename,local_folder))
+    if local_filename is not None and cache is not None and modified is not None:
+        # Also when the server does not support MDTM, the file is marked with the modification time of the cached listing.
+        os.utime(local_filename,(modified,modified))
+    return local_filename
+
+def downloadChirpsBulk(directory,filenames=None,pattern='*',local_folder=None,connections=4,host=CHIRPS_HOST,port=21,cache=None,sync=None):
+    """
+    Download many files from one directory of the CHIRPS FTP server, with a pool of connections working in parallel.
+    Files that were already downloaded completely (same size and modification time as on the server) are skipped, partially downloaded files are resumed.
+
+    Parameters
+    ----------
+    directory : str
+        The directory on the FTP server, for example '/pub/org/chg/products/CHIRPS-2.0/africa_daily/tifs/p05/2020/'.
+    filenames : list of str, optional
+        The files to download. If None (default), all files in directory matching pattern are downloaded.
+    pattern : str, optional
+        Only used if filenames is None. A filename pattern with wildcards, for example 'chirps-v2.0.2020.01.*.tif.gz'. The default is '*'.
+    local_folder : str, optional
+        The folder to save the files in. The default is None (current working directory).
+    connections : int, optional
+        The number of FTP connections (and downloads) used in parallel. The default is 4.
+    host : str, optional
+        The FTP server. The default is the CHIRPS server.
+    port : int, optional
+        The port of the FTP server. The default is 21.
+    cache : FtpListingCache, optional
+        If given, the directory listing and the file sizes/modification times are taken from the cache instead of asking the server for every file.
+    sync : str, optional
+        Only used with cache and if filenames is None. Name of a sync: only files that are new or changed since the last run with the same sync name are downloaded. The default is None (all files).
+
+    Returns
+    -------
+    summary : dict
+        Lists of 'downloaded', 'skipped' and 'failed' files, and the total 'bytes', 'seconds' and throughput ('MBps').
+
+    """
+    if local_folder == None:
+        local_folder = os.getcwd()
+    pool = _FtpPool(directory,connections,host,port)
+    try:
+        if filenames is None and cache is not None:
+            if sync is None:
+                filenames = fnmatch.filter(cache.listDirectory(directory),pattern)
+            else:
+                filenames = fnmatch.filter(cache.newSince(directory,sync),pattern)
+        elif filenames is None:
+            with pool.connection() as ftp:
+                filenames = fnmatch.filter(ftp.nlst(),pattern)
+        remoteInfo = {}
+        if cache is not None:
+            remoteInfo = {filename:cache.fileInfo(directory,filename) for filename in filenames}
+        logger.info('Starting to download '+str(len(filenames))+' files with '+str(connections)+' connections. This might take a while...')
+        
+        start = time.perf_counter()
+        def download(filename):
+            local_filename = os.path.join(local_folder,filename)
+            info = remoteInfo.get(filename,(None,None))
+            if info[0] is not None and _localIsComplete(local_filename,*info):
+                return filename, 0
+            return filename, _downloadRetry(pool,filename,local_filename)
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            results = list(executor.map(download,filenames))
+        seconds = time.perf_counter()-start
+    finally:
+        pool.close()
+    
+    summary = {'downloaded':[],'skipped':[],'failed':[],'bytes':0,'seconds':seconds}
+    for filename, nbytes in results:
+        if nbytes is None:
+            summary['failed'].append(filename)
+        elif nbytes == 0:
+            summary['skipped'].append(filename)
+        else:
+            summary['downloaded'].append(filename)
+            summary['bytes'] += nbytes
+    summary['MBps'] = summary['bytes']/2**20/max(seconds,1e-9)
+    if cache is not None and sync is not None and len(summary['failed']) == 0:
+        cache.markSynced(directory,sync)
+    logger.info(f'Downloaded {len(summary["downloaded"])} files ({summary["bytes"]/2**20:.1f} MB) in {seconds:.1f} s ({summary["MBps"]:.2f} MB/s). '
+          f'Skipped {len(summary["skipped"])} files that were already complete, {len(summary["failed"])} files failed.')
+    return summary
+
+def streamChirps(directory,filename,local_folder=None,decompress=None,hashName='sha256',expectedHash=None,
+                 inMemory=False,bbox=None,host=CHIRPS_HOST,port=21):
+    """
+    Download a (compressed) CHIRPS file and decompress it while it is being downloaded, so the compressed file is never written to disk.
+    The checksum of the file as it is on the server is calculated on the fly as well.
+    Optionally, the file is kept in memory and opened as Xarray DataSet, clipped to an area of interest, so only that area is written to disk.
+
+    Parameters
+    ----------
+    directory : str
+        The directory on the FTP server.
+    filename : str
+        The file to download, for example 'chirps-v2.0.2020.01.01.tif.gz'.
+    local_folder : str, optional
+        The folder to save the file in. The default is None (current working directory). With inMemory=True, the (clipped) dataset is only saved if a local_folder is given.
+    decompress : boolean, optional
+        Decompress the gzip stream. The default is None: decompress if filename ends with '.gz'.
+    hashName : str, optional
+        The hash algorithm for the checksum (any of hashlib). The default is 'sha256'.
+    expectedHash : str, optional
+        If given, the download is discarded when the checksum is different. The default is None.
+    inMemory : boolean, optional
+        If True, the file is not saved as it is, but opened in memory as Xarray DataSet (NetCDF files; GeoTIFF files require rioxarray). The default is False.
+    bbox : 4-sized collection (minLat,maxLat,minLon,maxLon), optional
+        Only used with inMemory=True. The area of interest to clip the dataset to. The default is None (no clipping).
+    host : str, optional
+        The FTP server. The default is the CHIRPS server.
+    port : int, optional
+        The port of the FTP server. The default is 21.
+
+    Returns
+    -------
+    result : dict or Xarray DataSet
+        Without inMemory, a dict with the 'path' of the saved file, the 'hash' of the downloaded file and the number of downloaded 'bytes'.
+        With inMemory, the (clipped) dataset, with the hash in its attrs.
+
+    """
+    if decompress is None:
+        decompress = filename.endswith('.gz')
+    outname = filename[:-3] if decompress and filename.endswith('.gz') else filename
+    saveClipped = inMemory and local_folder is not None
+    if local_folder == None:
+        local_folder = os.getcwd()
+    local_filename = os.path.join(local_folder,outname)
+    
+    with span('ftp.connect',host=host):
+        ftp = FTP()
+        ftp.connect(host,port)
+        ftp.login()
+    logger.info('Changing to ' + directory)
+    try:
+        ftp.cwd(directory)
+    except all_errors:
+        logger.error('The given directory does not exist. Please provide a valid Chirps ftp directory, under which there is the file with the given filename.')
+        ftp.close()
+        return
+    
+    #Every chunk from the server goes through the hash and the decompressor straight into the destination.
+    hasher = hashlib.new(hashName)
+    decompressor = zlib.decompressobj(16+zlib.MAX_WBITS) if decompress else None
+    destination = io.BytesIO() if inMemory else open(local_filename+'.part','wb')
+    received = [0]
+    def handleChunk(chunk):
+        received[0] += len(chunk)
+        hasher.update(chunk)
+        destination.write(decompressor.decompress(chunk) if decompress else chunk)
+    
+    try:
+        logger.info('Starting to download and extract file. This might take a while...')
+        with span('ftp.transfer',file=filename,decompress=decompress) as transfer:
+            ftp.retrbinary('RETR '+filename,handleChunk,blocksize=2**16)
+            if decompress:
+                destination.write(decompressor.flush())
+            transfer.set(bytes=received[0])
+        ftp.quit()
+    except (all_errors+(zlib.error,)) as error:
+        logger.error('Something went wrong. Download is not succeeded: '+str(error))
+        ftp.close()
+        destination.close()
+        if not inMemory:
+            os.remove(local_filename+'.part')
+        return
+    
+    checksum = hasher.hexdigest()
+    if expectedHash is not None and checksum != expectedHash.lower():
+        logger.error('The checksum of the downloaded file ('+checksum+') is not equal to the expected checksum. The download is discarded.')
+        destination.close()
+        if not inMemory:
+            os.remove(local_filename+'.part')
+        return
+    
+    if not inMemory:
+        destination.close()
+        os.replace(local_filename+'.part',local_filename)
+        logger.info('Download finished. File saved as '+local_filename+'.')
+        return {'path':local_filename,'hash':checksum,'bytes':received[0]}
+    
+    dataset = _openInMemory(destination.getvalue(),outname)
+    if bbox is not None:
+        dataset = _clipBbox(dataset,bbox)
+    dataset.attrs[hashName] = checksum
+    if saveClipped:
+        local_filename = os.path.splitext(local_filename)[0]+'.nc'
+        dataset.to_netcdf(local_filename)
+        logger.info('Dataset saved as '+local_filename+'.')
+    return dataset
+
+def _openInMemory(data,name):
+    import xarray as xr
+    if name.endswith('.nc'):
+        import netCDF4
+        return xr.open_dataset(xr.backends.NetCDF4DataStore(netCDF4.Dataset(name,memory=data)))
+    import rioxarray
+    return rioxarray.open_rasterio(io.BytesIO(data)).to_dataset(name='precip')
+
+def _clipBbox(dataset,bbox):
+    # Select (minLat,maxLat,minLon,maxLon) on the lat/y and lon/x dimensions; works for ascending and descending axes.
+    minLat, maxLat, minLon, maxLon = bbox
+    selection = {}
+    for dim in dataset.dims:
+        if 'lat' in dim or dim == 'y':
+            low, high = minLat, maxLat
+        elif 'lon' in dim or dim == 'x':
+            low, high = minLon, maxLon
+        else:
+            continue
+        axis = dataset[dim].values
+        selection[dim] = slice(low,high) if axis[0] <= axis[-1] else slice(high,low)
+    return dataset.sel(selection)
+
+class _FtpPool:
+    # A pool of logged-in FTP connections in the same directory, shared by worker threads.
+    def __init__(self,directory,size,host=CHIRPS_HOST,port=21):
+        self.directory = directory
+        self.host = host
+        self.port = port
+        self.idle = queue.LifoQueue()
+        self.slots = threading.Semaphore(size)
+
+    def _connect(self):
+        with span('ftp.connect',host=self.host):
+            ftp = FTP()
+            ftp.connect(self.host,self.port)
+            ftp.login()
+            ftp.cwd(self.directory)
+            ftp.voidcmd('TYPE I')
+        return ftp
+
+    @contextlib.contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            try:
+                ftp = self.idle.get_nowait()
+            except queue.Empty:
+                ftp = self._connect()
+            try:
+                yield ftp
+            except BaseException:
+                # A connection that raised might be broken: do not reuse it.
+                ftp.close()
+                raise
+            self.idle.put(ftp)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        while not self.idle.empty():
+            ftp = self.idle.get_nowait()
+            try:
+                ftp.quit()
+            except all_errors:
+                ftp.close()
+
+def _remoteInfo(ftp,filename):
+    # Size and modification time (unix time) of a file on the server; each is None if SIZE or MDTM is not supported (or refused).
+    try:
+        size = ftp.size(filename)
+    except error_perm:
+        size = None
+    try:
+        modified = _ftpTime(ftp.voidcmd('MDTM '+filename).split()[-1])
+    except all_errors:
+        modified = None
+    return size, modified
+
+def _ftpTime(timestamp):
+    # FTP (MDTM/MLSD) timestamp YYYYMMDDHHMMSS[.sss] in UTC to unix time.
+    return calendar.timegm(time.strptime(timestamp[:14],'%Y%m%d%H%M%S'))
+
+def _localIsComplete(local_filename,size,modified):
+    if size is None or not os.path.exists(local_filename) or os.path.getsize(local_filename) != size:
+        return False
+    return modified is None or abs(os.path.getmtime(local_filename)-modified) < 1
+
+def _downloadResumable(ftp,filename,local_filename):
+    # Download filename, resuming a partial local file. Returns the number of bytes transferred (0 if the file was already complete).
+    size, modified = _remoteInfo(ftp,filename)
+    if _localIsComplete(local_filename,size,modified):
+        return 0
+    # Without the size it is unknown what is missing, so the whole file is downloaded.
+    offset = os.path.getsize(local_filename) if size is not None and os.path.exists(local_filename) else 0
+    if size is not None and offset >= size:
+        offset = 0
+    written = [0]
+    with open(local_filename,'ab' if offset > 0 else 'wb') as file, \
+         span('ftp.transfer',file=filename,**({} if size is None else {'bytes':size-offset})) as current:
+        def write(block):
+            file.write(block)
+            written[0] += len(block)
+        ftp.retrbinary('RETR '+filename,write,blocksize=2**16,rest=offset or None)
+        current.set(bytes=written[0])
+    if modified is not None:
+        os.utime(local_filename,(modified,modified))
+    return written[0]
+
+def _downloadRetry(pool,filename,local_filename,attempts=2):
+    # Download (or resume) filename with a connection of pool, retrying on FTP errors; returns the number of bytes transferred, or None if it did not succeed.
+    for attempt in range(attempts):
+        try:
+            with pool.connection() as ftp:
+                return _downloadResumable(ftp,filename,local_filename)
+        except all_errors as error:
+            lastError = error
+    logger.error('Download of '+filename+' did not succeed: '+str(lastError))
+    return None
+
+class FtpListingCache:
+    """
+    A persistent (SQLite) cache of directory listings of the CHIRPS FTP server, so that scheduled jobs do not need to list the same directories over and over.
+    Listings are stored with their MLSD facts (type, size, modification time). A listing older than ttl seconds is listed again when it is used.
+    The cache can be given to ftpChirpsExplore, getFileList, downloadChirps and downloadChirpsBulk.
+
+    Parameters
+    ----------
+    path : str, optional
+        The SQLite file. The default is 'chirpsListing.sqlite' in the current working directory.
+    ttl : float, optional
+        Number of seconds a directory listing is considered up to date. The default is 86400 (one day).
+    host : str, optional
+        The FTP server. The default is the CHIRPS server.
+    port : int, optional
+        The port of the FTP server. The default is 21.
+
+    Example
+    -------
+    cache = FtpListingCache()
+    cache.refresh('/pub/org/chg/products/CHIRPS-2.0/africa_daily/tifs/p05/')
+    newFiles = cache.newSince('/pub/org/chg/products/CHIRPS-2.0/africa_daily/tifs/p05/2023/','nightly')
+
+    """
+    def __init__(self,path='chirpsListing.sqlite',ttl=24*3600,host=CHIRPS_HOST,port=21):
+        self.path = path
+        self.ttl = ttl
+        self.host = host
+        self.port = port
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (directory TEXT, name TEXT, type TEXT, size INTEGER, modify TEXT,
+                                                firstSeen REAL, changed REAL, PRIMARY KEY (directory,name));
+            CREATE TABLE IF NOT EXISTS directories (directory TEXT PRIMARY KEY, listed REAL, modify TEXT);
+            CREATE TABLE IF NOT EXISTS syncs (directory TEXT, sync TEXT, synced REAL, PRIMARY KEY (directory,sync));
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def listDirectory(self,directory,ftp=None,refresh=False):
+        """
+        The names in directory, from the cache if the listing is up to date, otherwise listed on the server (with ftp if given, else with a new connection).
+        """
+        directory = _dirPath(directory)
+        row = self.db.execute('SELECT listed FROM directories WHERE directory=?',(directory,)).fetchone()
+        if refresh or row is None or time.time()-row[0] > self.ttl:
+            self._update(directory,ftp)
+        return [name for name, in self.db.execute('SELECT name FROM entries WHERE directory=? ORDER BY name',(directory,))]
+
+    def entries(self,directory,ftp=None):
+        """The cached listing of directory as a list of dicts with name, type, size and modify."""
+        self.listDirectory(directory,ftp)
+        rows = self.db.execute('SELECT name,type,size,modify FROM entries WHERE directory=? ORDER BY name',(_dirPath(directory),))
+        return [dict(zip(['name','type','size','modify'],row)) for row in rows]
+
+    def fileInfo(self,directory,filename):
+        """Size and modification time (unix time) of a file according to the cache; (None,None) if unknown."""
+        row = self.db.execute('SELECT size,modify FROM entries WHERE directory=? AND name=?',(_dirPath(directory),filename)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], (None if row[1] is None else _ftpTime(row[1]))
+
+    def refresh(self,directory,depth=1,ftp=None):
+        """
+        List directory again and, up to depth levels deep, its subdirectories whose modification time changed since they were last listed (or that were never listed).
+        """
+        directory = _dirPath(directory)
+        with self._connection(ftp) as ftp:
+            self._update(directory,ftp)
+            if depth > 0:
+                subdirs = self.db.execute("""SELECT e.name FROM entries e LEFT JOIN directories d ON d.directory=e.directory||e.name||'/'
+                                             WHERE e.directory=? AND e.type='dir' AND (d.modify IS NULL OR d.modify!=e.modify)""",(directory,)).fetchall()
+                for name, in subdirs:
+                    self.refresh(directory+name+'/',depth-1,ftp)
+
+    def newSince(self,directory,sync='default',ftp=None):
+        """The files in directory that are new or changed since the last markSynced(directory,sync)."""
+        self.listDirectory(directory,ftp)
+        directory = _dirPath(directory)
+        row = self.db.execute('SELECT synced FROM syncs WHERE directory=? AND sync=?',(directory,sync)).fetchone()
+        synced = -1 if row is None else row[0]
+        rows = self.db.execute("SELECT name FROM entries WHERE directory=? AND type!='dir' AND changed>? ORDER BY name",(directory,synced))
+        return [name for name, in rows]
+
+    def markSynced(self,directory,sync='default'):
+        """Remember that everything in the current listing of directory has been handled by sync."""
+        directory = _dirPath(directory)
+        row = self.db.execute('SELECT listed FROM directories WHERE directory=?',(directory,)).fetchone()
+        if row is not None:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO syncs VALUES (?,?,?)',(directory,sync,row[0]))
+
+    def evict(self):
+        """Remove all listings older than ttl from the cache file."""
+        limit = time.time()-self.ttl
+        with self.db:
+            self.db.execute('DELETE FROM entries WHERE directory IN (SELECT directory FROM directories WHERE listed<?)',(limit,))
+            self.db.execute('DELETE FROM directories WHERE listed<?',(limit,))
+
+    @contextlib.contextmanager
+    def _connection(self,ftp):
+        if ftp is not None:
+            yield ftp
+            return
+        ftp = FTP()
+        ftp.connect(self.host,self.port)
+        ftp.login()
+        try:
+            yield ftp
+        finally:
+            ftp.quit()
+
+    def _update(self,directory,ftp=None):
+        # List directory on the server and store the differences with the cached listing.
+        with self._connection(ftp) as ftp:
+            listing = _listRemote(ftp,directory)
+        now = time.time()
+        old = {row[0]:row[1:] for row in self.db.execute('SELECT name,size,modify FROM entries WHERE directory=?',(directory,))}
+        parent, name = directory[:-1].rsplit('/',1) if directory != '/' else ('',None)
+        with self.db:
+            for entry, facts in listing:
+                size = None if facts.get('size') is None else int(facts['size'])
+                if entry not in old:
+                    self.db.execute('INSERT INTO entries VALUES (?,?,?,?,?,?,?)',(directory,entry,facts.get('type'),size,facts.get('modify'),now,now))
+                elif old[entry] != (size,facts.get('modify')):
+                    self.db.execute('UPDATE entries SET type=?,size=?,modify=?,changed=? WHERE directory=? AND name=?',
+                                    (facts.get('type'),size,facts.get('modify'),now,directory,entry))
+            removed = set(old)-set(entry for entry,facts in listing)
+            self.db.executemany('DELETE FROM entries WHERE directory=? AND name=?',[(directory,entry) for entry in removed])
+            # The modification time of directory itself, as known in the listing of its parent.
+            modify = None
+            if name is not None:
+                row = self.db.execute('SELECT modify FROM entries WHERE directory=? AND name=?',(parent+'/',name)).fetchone()
+                modify = None if row is None else row[0]
+            self.db.execute('INSERT OR REPLACE INTO directories VALUES (?,?,?)',(directory,now,modify))
+
+def _dirPath(directory):
+    return directory if directory.endswith('/') else directory+'/'
+
+def _listRemote(ftp,directory):
+    # (name,facts) of everything in directory; MLSD if the server supports it, otherwise NLST without facts.
+    with span('ftp.list',directory=directory):
+        return _listFacts(ftp,directory)
+
+def _listFacts(ftp,directory):
+    try:
+        listing = [(name,facts) for name,facts in ftp.mlsd(directory,facts=['type','size','modify'])
+                   if facts.get('type') not in ('cdir','pdir')]
+    except all_errors:
+        listing = [(os.path.basename(name.rstrip('/')),{}) for name in ftp.nlst(directory)]
+    return listing
+
+########################## asyncio FTP client ###############################
+
+class AsyncFtp:
+    """
+    A small asyncio FTP client (passive mode, anonymous login by default), so listings and downloads can run concurrently with other work in one event loop.
+    Errors are raised as the ftplib exceptions (ftplib.all_errors), every reply is awaited with the given timeout.
+
+    Example
+    -------
+    async with AsyncFtp() as ftp:
+        await ftp.connect()
+        await ftp.login()
+        await ftp.cwd('/pub/org/chg/products/')
+        names = await ftp.nlst()
+
+    """
+    def __init__(self,timeout=30):
+        self.timeout = timeout
+        self.host = None
+        self.reader = None
+        self.writer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self,excType,exc,tb):
+        await self.quit()
+
+    async def connect(self,host=CHIRPS_HOST,port=21):
+        self.host = host
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host,port),self.timeout)
+        code, text = await self._response()
+        _checkReply(code,text,'2')
+        return text
+
+    async def login(self,user='anonymous',passwd='anonymous@'):
+        text = await self.command('USER '+user,expect='23')
+        if text.startswith('3'):
+            text = await self.command('PASS '+passwd,expect='23')
+        return text
+
+    async def command(self,cmd,expect='2'):
+        self.writer.write((cmd+'\r\n').encode('utf-8'))
+        await self.writer.drain()
+        code, text = await self._response()
+        _checkReply(code,text,expect)
+        return text
+
+    async def cwd(self,directory):
+        return await self.command('CWD '+directory)
+
+    async def size(self,filename):
+        await self.command('TYPE I')
+        return int((await self.command('SIZE '+filename)).split()[-1])
+
+    async def mdtm(self,filename):
+        return _ftpTime((await self.command('MDTM '+filename)).split()[-1])
+
+    async def nlst(self,directory=None):
+        lines = await self._lines('NLST' if directory is None else 'NLST '+directory)
+        return [line for line in lines if line]
+
+    async def mlsd(self,directory=None):
+        # Like ftplib.FTP.mlsd: a list of (name,facts), with the fact names in lower case.
+        listing = []
+        for line in await self._lines('MLSD' if directory is None else 'MLSD '+directory):
+            factsFound, _, name = line.partition(' ')
+            facts = {}
+            for fact in factsFound[:-1].split(';'):
+                key, _, value = fact.partition('=')
+                facts[key.lower()] = value
+            listing.append((name,facts))
+        return listing
+
+    async def retrbinary(self,filename,callback,rest=None,blocksize=2**16):
+        """Download filename; callback (a function or coroutine function) is called with every chunk of data."""
+        await self.command('TYPE I')
+        await self._transfer('RETR '+filename,callback,rest,blocksize)
+
+    async def quit(self):
+        if self.writer is None:
+            return
+        try:
+            await self.command('QUIT')
+        except (all_errors+(asyncio.TimeoutError,)):
+            pass
+        self.writer.close()
+        self.writer = None
+
+    async def _readline(self):
+        line = await asyncio.wait_for(self.reader.readline(),self.timeout)
+        if not line:
+            raise EOFError('The FTP server closed the connection.')
+        return line.decode('utf-8',errors='replace').rstrip('\r\n')
+
+    async def _response(self):
+        line = await self._readline()
+        code, lines = line[:3], [line]
+        if line[3:4] == '-':
+            while True:
+                line = await self._readline()
+                lines.append(line)
+                if line[:3] == code and line[3:4] == ' ':
+                    break
+        return code, '\n'.join(lines)
+
+    async def _passive(self):
+        # Data connection address: EPSV if supported, otherwise PASV (on the host of the control connection, like ftplib).
+        try:
+            text = await self.command('EPSV')
+            port = int(re.search(r'\(\|\|\|(\d+)\|\)',text).group(1))
+        except error_perm:
+            text = await self.command('PASV')
+            numbers = re.search(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)',text).groups()
+            port = int(numbers[4])*256+int(numbers[5])
+        return self.host, port
+
+    async def _transfer(self,cmd,callback,rest=None,blocksize=2**16):
+        host, port = await self._passive()
+        dataReader, dataWriter = await asyncio.wait_for(asyncio.open_connection(host,port),self.timeout)
+        try:
+            if rest:
+                await self.command('REST '+str(rest),expect='3')
+            await self.command(cmd,expect='1')
+            while True:
+                chunk = await asyncio.wait_for(dataReader.read(blocksize),self.timeout)
+                if not chunk:
+                    break
+                result = callback(chunk)
+                if inspect.isawaitable(result):
+                    await result
+        finally:
+            dataWriter.close()
+        code, text = await self._response()
+        _checkReply(code,text,'2')
+
+    async def _lines(self,cmd):
+        await self.command('TYPE A')
+        chunks = []
+        await self._transfer(cmd,chunks.append)
+        return b''.join(chunks).decode('utf-8',errors='replace').splitlines()
+
+def _checkReply(code,text,expect):
+    if code[:1] in expect:
+        return
+    if code[:1] == '4':
+        raise error_temp(text)
+    if code[:1] == '5':
+        raise error_perm(text)
+    raise error_reply(text)
+
+async def _retry(function,retries=3,backoff=1):
+    # Await function() again after temporary errors and timeouts, waiting backoff*2**attempt seconds; permanent (5xx) errors are not retried.
+    for attempt in range(retries+1):
+        try:
+            return await function()
+        except error_perm:
+            raise
+        except (all_errors+(asyncio.TimeoutError,)):
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff*2**attempt)
+
+async def _connectAsync(directory,host=CHIRPS_HOST,port=21,timeout=30):
+    ftp = AsyncFtp(timeout)
+    try:
+        with span('ftp.connect',host=host):
+            await ftp.connect(host,port)
+            await ftp.login()
+            await ftp.cwd(directory)
+    except BaseException:
+        await ftp.quit()
+        raise
+    return ftp
+
+def _runSync(coroutine):
+    # Run a coroutine from synchronous code, also when an event loop is already running (like in Jupyter Notebook).
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run,coroutine).result()
+
+async def getFileListAsync(directory,host=CHIRPS_HOST,port=21,timeout=30,retries=3):
+    """
+    Async version of getFileList: the names of the files under directory on the CHIRPS FTP server.
+    timeout is the maximum number of seconds to wait for any reply of the server, temporary errors are retried up to retries times.
+    """
+    logger.info('Changing to ' + directory)
+    async def listFiles():
+        async with await _connectAsync(directory,host,port,timeout) as ftp:
+            with span('ftp.list',directory=directory):
+                return await ftp.nlst()
+    try:
+        filelist = await _retry(listFiles,retries)
+    except error_perm:
+        logger.error('The given directory does not exist. Please provide a valid Chirps ftp directory, under which there is the file with the given filename.')
+        return
+    logger.info('List of '+str(len(filelist))+' files found under directory '+directory+'.')
+    logger.info('You can use the directory in combination with any of the filenames in the function downloadChirps, to download that specific file.')
+    return filelist
+
+async def downloadChirpsAsync(directory,filename,local_folder=None,host=CHIRPS_HOST,port=21,timeout=30,retries=3,ftp=None):
+    """
+    Async version of downloadChirps. Returns the local filename, or None if the download did not succeed.
+    After a temporary error the download is retried (up to retries times) and resumed where it stopped. An open AsyncFtp connection (in directory) can be given as ftp;
+    if it breaks, it is closed and the download continues on a new connection.
+    """
+    if local_folder == None:
+        logger.warning('No local folder given. The file will be saved in your current working drectory.')
+        local_filename = filename
+    else:
+        local_filename = os.path.join(local_folder, filename)
+    
+    connection = [ftp]
+    try:
+        logger.info('Starting to download file. This might take a while...')
+        await _downloadAsync(connection,directory,filename,local_filename,host,port,timeout,retries)
+    except (all_errors+(asyncio.TimeoutError,)) as error:
+        logger.error('Something went wrong. Download is not succeeded: '+str(error))
+        return
+    finally:
+        if connection[0] is not None and connection[0] is not ftp:
+            await connection[0].quit()
+    logger.info('Download finished. File saved as '+local_filename+'.')
+    return local_filename
+
+async def _downloadAsync(connection,directory,filename,local_filename,host,port,timeout,retries):
+    # Download filename with connection[0] (an AsyncFtp in directory, or None), retrying and resuming after temporary errors.
+    # A broken connection is closed and replaced; the connection that is left in connection[0] works and can be used for the next file.
+    async def download():
+        if connection[0] is None:
+            logger.info('Changing to ' + directory)
+            connection[0] = await _connectAsync(directory,host,port,timeout)
+        offset = os.path.getsize(local_filename) if os.path.exists(local_filename) else 0
+        try:
+            with open(local_filename,'ab' if offset > 0 else 'wb') as file, span('ftp.transfer',file=filename) as transfer:
+                await connection[0].retrbinary(filename,file.write,rest=offset or None)
+                transfer.set(bytes=file.tell()-offset)
+            # The local file gets the modification time of the server, so a listing cache can recognise it as up to date.
+            try:
+                modified = await connection[0].mdtm(filename)
+            except all_errors:
+                modified = None
+            if modified is not None:
+                os.utime(local_filename,(modified,modified))
+        except BaseException:
+            # The connection might be broken: reconnect for the next attempt.
+            await connection[0].quit()
+            connection[0] = None
+            raise
+    
+    if os.path.exists(local_filename):
+        os.remove(local_filename)
+    await _retry(download,retries)
+
+async def downloadManyAsync(directory,filenames,local_folder=None,concurrency=8,host=CHIRPS_HOST,port=21,timeout=30,retries=3):
+    """
+    Download many files from directory concurrently, with at most concurrency connections (and transfers) at the same time.
+    Cancelling the task that awaits this coroutine cancels all transfers.
+
+    Returns
+    -------
+    summary : dict
+        Lists of 'downloaded' and 'failed' files, the total 'bytes', 'seconds' and throughput ('MBps').
+    """
+    if local_folder == None:
+        local_folder = os.getcwd()
+    todo = asyncio.Queue()
+    for filename in filenames:
+        todo.put_nowait(filename)
+    summary = {'downloaded':[],'failed':[],'bytes':0}
+    
+    async def worker():
+        # Every worker keeps one connection; _downloadAsync replaces it when it breaks.
+        connection = [None]
+        try:
+            while not todo.empty():
+                filename = todo.get_nowait()
+                local_filename = os.path.join(local_folder,filename)
+                try:
+                    await _downloadAsync(connection,directory,filename,local_filename,host,port,timeout,retries)
+                except (all_errors+(asyncio.TimeoutError,)) as error:
+                    logger.error('Download of '+filename+' did not succeed: '+str(error))
+                    summary['failed'].append(filename)
+                    continue
+                summary['downloaded'].append(filename)
+                summary['bytes'] += os.path.getsize(local_filename)
+        finally:
+            if connection[0] is not None:
+                await connection[0].quit()
+    
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for i in range(min(concurrency,max(len(filenames),1)))])
+    summary['seconds'] = time.perf_counter()-start
+    summary['MBps'] = summary['bytes']/2**20/max(summary['seconds'],1e-9)
+    return summary
+
+async def walkChirpsAsync(directory,maxDepth=None,concurrency=4,host=CHIRPS_HOST,port=21,timeout=30,retries=3):
+    """
+    Walk the directory tree under directory, like os.walk: an async generator of (dirpath, dirnames, filenames).
+    Up to concurrency directories are listed at the same time. Requires MLSD support on the server.
+
+    Example
+    -------
+    async for dirpath, dirnames, filenames in walkChirpsAsync('/pub/org/chg/products/CHIRPS-2.0/',maxDepth=1):
+        print(dirpath, len(filenames))
+    """
+    pending = asyncio.Queue()
+    results = asyncio.Queue()
+    pending.put_nowait((_dirPath(directory),0))
+    
+    async def worker():
+        connection = [None]
+        async def listPath(path):
+            if connection[0] is None:
+                connection[0] = await _connectAsync('/',host,port,timeout)
+            try:
+                return await connection[0].mlsd(path)
+            except BaseException:
+                # The connection might be broken or out of sync: reconnect for the next attempt and the next directory.
+                await connection[0].quit()
+                connection[0] = None
+                raise
+        try:
+            while True:
+                path, depth = await pending.get()
+                try:
+                    listing = await _retry(lambda: listPath(path),retries)
+                except (all_errors+(asyncio.TimeoutError,)) as error:
+                    results.put_nowait(error)
+                    pending.task_done()
+                    continue
+                dirnames = sorted(name for name,facts in listing if facts.get('type') == 'dir')
+                filenames = sorted(name for name,facts in listing if facts.get('type') == 'file')
+                if maxDepth is None or depth < maxDepth:
+                    for name in dirnames:
+                        pending.put_nowait((path+name+'/',depth+1))
+                results.put_nowait((path,dirnames,filenames))
+                pending.task_done()
+        finally:
+            if connection[0] is not None:
+                await connection[0].quit()
+    
+    async def finish():
+        await pending.join()
+        results.put_nowait(None)
+    
+    tasks = [asyncio.ensure_future(worker()) for i in range(concurrency)]
+    tasks.append(asyncio.ensure_future(finish()))
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            if isinstance(result,BaseException):
+                raise result
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks,return_exceptions=True)
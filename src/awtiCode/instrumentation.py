@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Messages and timing of awtiCode.
+
+All modules report through the logger 'awtiCode' (Python logging), which only has a NullHandler. If logging is not
+configured at all when awtiCode is imported, INFO messages and up are printed to stdout, like before, until logging is
+configured; otherwise the messages follow the configuration. To silence awtiCode, for example in worker logs:
+    logging.getLogger('awtiCode').setLevel(logging.WARNING)
+
+Timing spans mark the phases of the slow operations (FTP connect/list/transfer, NetCDF neighbour search and read,
+CP-SAT build and solve, frame rendering). They are only recorded after enable(); disabled, a span costs one function call.
+
+Example
+-------
+from awtiCode import instrumentation
+instrumentation.enable()
+... (use awtiCode functions)
+instrumentation.stats()
+instrumentation.exportChromeTrace('trace.json')   # open in chrome://tracing or https://ui.perfetto.dev
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger('awtiCode')
+logger.addHandler(logging.NullHandler())
+
+class _DefaultHandler(logging.StreamHandler):
+    # Prints messages to stdout while logging is not configured, like the print calls did before.
+    def __init__(self):
+        super().__init__(sys.stdout)
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    def emit(self,record):
+        self.stream = sys.stdout
+        super().emit(record)
+
+class _DefaultFilter(logging.Filter):
+    # Removes the default as soon as logging is configured, so the records follow that configuration only.
+    def filter(self,record):
+        if not logging.getLogger().handlers:
+            return True
+        _removeDefault()
+        return record.levelno >= logger.getEffectiveLevel()
+
+def _removeDefault():
+    for handler in list(logger.handlers):
+        if isinstance(handler,_DefaultHandler):
+            logger.removeHandler(handler)
+    for default in [item for item in logger.filters if isinstance(item,_DefaultFilter)]:
+        logger.removeFilter(default)
+        if logger.level == logging.INFO:
+            logger.setLevel(logging.NOTSET)
+
+# The default only applies when nothing is configured: no root handlers and no level or handlers of awtiCode's own.
+if not logging.getLogger().handlers and logger.level == logging.NOTSET and len(logger.handlers) == 1:
+    logger.setLevel(logging.INFO)
+    logger.addHandler(_DefaultHandler())
+    logger.addFilter(_DefaultFilter())
+
+_spans = []
+_lock = threading.Lock()
+_enabled = False
+_origin = time.perf_counter()
+
+class Span:
+    """A timed phase; the keyword arguments (and those given to set) are recorded with it, for example bytes or status."""
+    __slots__ = ('name','args','start','duration')
+
+    def __init__(self,name,args):
+        self.name = name
+        self.args = args
+        self.start = None
+        self.duration = None
+
+    def set(self,**args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exception):
+        self.duration = time.perf_counter()-self.start
+        record = (self.name,self.start-_origin,self.duration,os.getpid(),threading.get_ident(),self.args)
+        with _lock:
+            _spans.append(record)
+        return False
+
+class _NoSpan:
+    # Returned by span() while disabled: does nothing.
+    __slots__ = ()
+    def set(self,**args):
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self,*exception):
+        return False
+
+_noSpan = _NoSpan()
+
+def span(name,**args):
+    """
+    Time a phase, as context manager:
+        with span('ftp.transfer',file=filename) as s:
+            ...
+            s.set(bytes=size)
+    Nothing is recorded unless enable() was called.
+    """
+    if not _enabled:
+        return _noSpan
+    return Span(name,args)
+
+def enable(reset=True):
+    """Start recording spans. With reset (default), spans recorded before are removed."""
+    global _enabled
+    if reset:
+        clear()
+    _enabled = True
+
+def disable():
+    """Stop recording spans. Recorded spans are kept until clear() or the next enable()."""
+    global _enabled
+    _enabled = False
+
+def isEnabled():
+    return _enabled
+
+def clear():
+    """Remove all recorded spans."""
+    with _lock:
+        _spans.clear()
+
+def stats():
+    """
+    Summary of the recorded spans, per span name: count, total, mean and max duration (seconds),
+    and the sum of every numeric argument (for example bytes), with the rate per second of total time for 'bytes'.
+    """
+    with _lock:
+        spans = list(_spans)
+    summary = {}
+    for name, start, duration, pid, tid, args in spans:
+        entry = summary.setdefault(name,{'count':0,'total':0.0,'max':0.0})
+        entry['count'] += 1
+        entry['total'] += duration
+        entry['max'] = max(entry['max'],duration)
+        for key, value in args.items():
+            if isinstance(value,(int,float)) and not isinstance(value,bool):
+                entry[key] = entry.get(key,0)+value
+    for entry in summary.values():
+        entry['mean'] = entry['total']/entry['count']
+        if 'bytes' in entry and entry['total'] > 0:
+            entry['bytesPerSecond'] = entry['bytes']/entry['total']
+    return summary
+
+def exportChromeTrace(path):
+    """Save the recorded spans as Chrome trace (JSON) file, for chrome://tracing or Perfetto. Returns the path."""
+    with _lock:
+        spans = list(_spans)
+    events = [{'name':name,'ph':'X','ts':start*1e6,'dur':duration*1e6,'pid':pid,'tid':tid,
+               'args':{key:(value if isinstance(value,(int,float,str,bool)) else str(value)) for key, value in args.items()}}
+              for name, start, duration, pid, tid, args in spans]
+    with open(path,'w') as file:
+        json.dump({'traceEvents':events,'displayTimeUnit':'ms'},file)
+    return path
@@ -8,15 +8,21 @@ Created on Tue Nov 15 10:29:13 2022
 import pandas as pd
 import numpy as np
 import math
+import os
+import glob
+import hashlib
+import warnings
+from .instrumentation import logger, span
 
-def ncDataSelect(dataset,coord,method='closest',timeperiod=None,data_var=None):
+def ncDataSelect(dataset,coord,method='closest',timeperiod=None,data_var=None,lazy=False,scheduler='threads',memoryLimit=None,cache=None):
     """
     This function selects data from a NetCDF file based on the provided coordinates.
 
     Parameters
     ----------
-    dataset : Xarray DataSet
+    dataset : Xarray DataSet, or str
         This should be a dataset (typically the result of a NetCDF file) with at least one data_var, and this data_var should have three dimensions: time, latitude and longitude.
+        This can also be the path of a Zarr store made with ingestChirps (or of a NetCDF file); the store is then read lazily, so only the chunks around coord are read.
     coord : 2-sized collection of lat,lon coordinate.
         Provide the coordinate as (lat,lon) for which you want to select data from the provided DataSet.
     method : str, optional
@@ -26,9 +32,18 @@ def ncDataSelect(dataset,coord,method='closest',timeperiod=None,data_var=None):
         m2/average: take the average of the 4 surrounding coordinates.
         m3/idw: take the inverse distance weighted average of the 4 surrounding coordinates.
     timeperiod : 2-sized collection of datetimes (starttime,endtime), optional
-        NOT YET IMPLEMENTED. The default is None.
+        Only select data between starttime and endtime (both included). The default is None (all data).
     data_var : str, optional
         If the provided DataSet has multiple data_vars, you can select a specific one here. The default is None. If None, automatically the first of dataset.data_vars is selected.
+    lazy : boolean, optional
+        If True, the dataset is handled out-of-core: it is chunked (if it is not chunked yet, for example by openNcLazy), the selection is kept lazy and only the final series is computed. Use this for datasets that do not fit in memory. The default is False.
+    scheduler : str, optional
+        Only used if lazy=True. The dask scheduler used to compute the final series: 'threads', 'processes' or 'synchronous'. The default is 'threads'.
+    memoryLimit : int or str, optional
+        Only used if lazy=True. Approximate ceiling for the memory used by all workers together, in bytes or as a string like '2GB'. The default is None (256MB per worker).
+        Data that is not chunked yet is chunked along time to fit; chunks of data that is chunked already (for example a Zarr store) are split along time if they are larger.
+    cache : ResultCache, optional
+        If given, the result is stored in (and next time read from) this on-disk cache. The default is None (no cache).
 
     Returns
     -------
@@ -36,36 +51,38 @@ def ncDataSelect(dataset,coord,method='closest',timeperiod=None,data_var=None):
         A single column DataFrame, indexed by time, with as column the selected data.
 
     """
+    import xarray as xr
     coord = np.array(coord)
-    latdim = np.array(dataset.dims)[pd.Series(dataset.dims.keys()).str.find('at')>-1][0]
-    londim = np.array(dataset.dims)[pd.Series(dataset.dims.keys()).str.find('on')>-1][0]
-    timedim = np.array(dataset.dims)[pd.Series(dataset.dims.keys()).str.find('im')>-1][0]
+    if isinstance(dataset,str):
+        dataset = openStore(dataset)
+        lazy = True
+    if cache is not None:
+        key = cache.key('ncDataSelect',dataset,coord=coord,method=method,timeperiod=timeperiod,data_var=data_var)
+        dfOut = cache.get(key)
+        if dfOut is not None:
+            return dfOut
+    latdim, londim, timedim = _ncDims(dataset)
+    dataset = _timeWindow(dataset,timedim,timeperiod)
+    data_var = _selectDataVar(dataset,data_var)
+    if lazy:
+        dataset = _lazyChunk(dataset,data_var,memoryLimit)
     
-    lats = dataset[latdim]
-    lons = dataset[londim]
-    minLat = np.max(lats[lats<coord[0]])
-    maxLat = np.min(lats[lats>coord[0]])
-    minLon = np.max(lons[lons<coord[1]])
-    maxLon = np.min(lons[lons>coord[1]])
+    with span('nc.neighbours',method=method):
+        lats = dataset[latdim]
+        lons = dataset[londim]
+        minLat = np.max(lats[lats<coord[0]])
+        maxLat = np.min(lats[lats>coord[0]])
+        minLon = np.max(lons[lons<coord[1]])
+        maxLon = np.min(lons[lons>coord[1]])
     
-    coords = np.array([coord,[minLat,minLon],[minLat,maxLon],[maxLat,minLon],[maxLat,maxLon]])
+        coords = np.array([coord,[minLat,minLon],[minLat,maxLon],[maxLat,minLon],[maxLat,maxLon]])
 
-    data_vars = np.array(dataset.data_vars)
-    if data_var == None:
-        data_var = data_vars[0]
-        print('data variable not selected. This dataset has '+str(data_vars)+'. Using '+data_var+'.')
-    elif data_var not in data_vars:
-        print(data_var+' not found in dataset. This dataset has '+str(data_vars)+'. Using '+str(data_vars[0])+'.')
-        data_var = data_vars[0]
-    else:
-        print(data_var+' selected to use.')
-
-    # Calculate distances to the four points
-    distances = []
-    for coord in coords[1:]:
-        dist = math.dist(coords[0],coord)
-        distances.append(dist)
-    distances = np.array(distances)
+        # Calculate distances to the four points
+        distances = []
+        for coord in coords[1:]:
+            dist = math.dist(coords[0],coord)
+            distances.append(dist)
+        distances = np.array(distances)
 
     if method in ['m1','closest']:
         iClose = list(distances).index(min(distances))
@@ -76,40 +93,927 @@ def ncDataSelect(dataset,coord,method='closest',timeperiod=None,data_var=None):
         dataOut = selData.mean(dim=(latdim,londim))[data_var]
     elif method in ['m3','idw']:
         selData = dataset.sel({latdim:[minLat,maxLat],londim:[minLon,maxLon]})
-        reshape = selData[data_var].shape[:1]+(selData[data_var].shape[1]*selData[data_var].shape[2],)
-        arrayData = np.array(selData[data_var]).reshape(reshape)
-        weights = []
-        for i in range(len(distances)):
-            weight = (1/distances[i])/np.sum(1/distances)
-            weights.append(weight)
-        weights=np.array(weights).reshape((1,4))
-        dataOut = np.sum(arrayData*weights,axis=1)
+        weights = (1/distances)/np.sum(1/distances)
+        # Weights as (lat,lon) DataArray, so the weighted sum also stays lazy for chunked datasets.
+        weights = xr.DataArray(weights.reshape((2,2)),dims=(latdim,londim))
+        dataOut = (selData[data_var]*weights).sum(dim=(latdim,londim),skipna=False)
     else:
-        print('Method '+str(method)+' unknown. Please select from one of "m1", "closest", "m2", "average", "m3", "idw".')
+        logger.error('Method '+str(method)+' unknown. Please select from one of "m1", "closest", "m2", "average", "m3", "idw".')
         return
+    
+    with span('nc.read',method=method,lazy=lazy):
+        if lazy:
+            dataOut = _computeLazy(dataOut,scheduler,memoryLimit)
+        dfOut = pd.DataFrame({data_var:dataOut},index=dataset[timedim])
+    if cache is not None:
+        cache.put(key,dfOut)
+    return dfOut
 
-    dfOut = pd.DataFrame({data_var:dataOut},index=dataset[timedim])
+def ncDataSelectMulti(dataset,coords,method='closest',timeperiod=None,data_var=None,names=None,lazy=False,scheduler='threads',memoryLimit=None,cache=None):
+    """
+    This function selects data from a NetCDF file for many coordinates (for example rain gauge stations) at once.
+    It gives the same values as calling ncDataSelect per coordinate, but the surrounding grid cells of all coordinates are found in one go and read from the DataSet with a single (pointwise) selection.
+
+    Parameters
+    ----------
+    dataset : Xarray DataSet, or str
+        This should be a dataset (typically the result of a NetCDF file) with at least one data_var, and this data_var should have three dimensions: time, latitude and longitude.
+        This can also be the path of a Zarr store made with ingestChirps; see ncDataSelect.
+    coords : array-like of shape (N,2), or Pandas DataFrame
+        The (lat,lon) coordinates for which you want to select data.
+        If a DataFrame is provided, it should have a latitude and a longitude column (column names containing 'lat' and 'lon'); the index of the DataFrame is used as station names.
+    method : str, optional
+        One of {'m1','closest','m2','average','m3','idw'}. The default is 'closest'. See ncDataSelect.
+    timeperiod : 2-sized collection of datetimes (starttime,endtime), optional
+        Only select data between starttime and endtime (both included). The default is None (all data).
+    data_var : str, optional
+        If the provided DataSet has multiple data_vars, you can select a specific one here. The default is None. If None, automatically the first of dataset.data_vars is selected.
+    names : list of str, optional
+        Names of the stations, used as column names in the output. If None, the index of a provided DataFrame is used, or 'station1' to 'stationN'.
+    lazy, scheduler, memoryLimit : optional
+        Settings for out-of-core selection, see ncDataSelect.
+    cache : ResultCache, optional
+        See ncDataSelect.
+
+    Returns
+    -------
+    dfOut : Pandas DataFrame
+        A DataFrame indexed by time, with one column per coordinate.
+
+    """
+    import xarray as xr
+    coords, names = _stationCoords(coords,names)
+    
+    if method not in ['m1','closest','m2','average','m3','idw']:
+        logger.error('Method '+str(method)+' unknown. Please select from one of "m1", "closest", "m2", "average", "m3", "idw".')
+        return
+    if isinstance(dataset,str):
+        dataset = openStore(dataset)
+        lazy = True
+    if cache is not None:
+        key = cache.key('ncDataSelectMulti',dataset,coords=coords,method=method,timeperiod=timeperiod,data_var=data_var,names=names)
+        dfOut = cache.get(key)
+        if dfOut is not None:
+            return dfOut
+    
+    latdim, londim, timedim = _ncDims(dataset)
+    dataset = _timeWindow(dataset,timedim,timeperiod)
+    data_var = _selectDataVar(dataset,data_var)
+    if lazy:
+        dataset = _lazyChunk(dataset,data_var,memoryLimit)
+    
+    with span('nc.neighbours',method=method,stations=len(coords)):
+        latIdx, lonIdx, weights = _gridNeighbours(np.asarray(dataset[latdim]),np.asarray(dataset[londim]),coords,method)
+    if latIdx is None:
+        return
+    
+    # For 'closest' only the cell with weight 1 is needed, otherwise all 4 surrounding cells.
+    if method in ['m1','closest']:
+        pick = weights.argmax(axis=1)
+        latIdx = latIdx[np.arange(len(coords)),pick][:,None]
+        lonIdx = lonIdx[np.arange(len(coords)),pick][:,None]
+        weights = np.ones((len(coords),1))
+    
+    # Stations close to each other share cells: read every needed cell only once.
+    nlon = dataset.sizes[londim]
+    cells, inverse = np.unique((latIdx*nlon+lonIdx).ravel(),return_inverse=True)
+    with span('nc.read',method=method,cells=len(cells),lazy=lazy):
+        points = dataset[data_var].isel({latdim:xr.DataArray(cells//nlon,dims='cell'),
+                                         londim:xr.DataArray(cells%nlon,dims='cell')})
+        if lazy:
+            points = _computeLazy(points,scheduler,memoryLimit)
+        cellData = np.asarray(points.transpose(timedim,'cell'))
+    stationData = cellData[:,inverse].reshape((cellData.shape[0],)+latIdx.shape)
+    
+    if method in ['m2','average']:
+        # Like the mean in ncDataSelect, missing cells are skipped.
+        with np.errstate(invalid='ignore'):
+            dataOut = np.nansum(stationData,axis=2)/np.sum(~np.isnan(stationData),axis=2)
+    else:
+        dataOut = np.sum(stationData*weights[None,:,:],axis=2)
+    
+    dfOut = pd.DataFrame(dataOut,index=pd.Index(dataset[timedim].values,name=timedim),columns=names)
+    if cache is not None:
+        cache.put(key,dfOut)
     return dfOut
 
-def alignStationNc(stationdata,ncdata,resample='m'):
+def openNcLazy(paths,timeperiod=None,data_var=None,memoryLimit=None):
+    """
+    This function opens one or more NetCDF files (for example a folder of daily CHIRPS files) as a single lazy, chunked Xarray DataSet. No data is read until it is computed, so the files do not need to fit in memory.
+
+    Parameters
+    ----------
+    paths : str or list of str
+        A path with wildcards (for example 'chirps/*.nc') or a list of paths.
+    timeperiod : 2-sized collection of datetimes (starttime,endtime), optional
+        Only keep data between starttime and endtime (both included). The default is None (all data).
+    data_var : str, optional
+        The data variable used to determine the chunk size. The default is None (the first of dataset.data_vars).
+    memoryLimit : int or str, optional
+        Approximate ceiling for the memory used by all workers together, in bytes or as a string like '2GB'. The chunks along time are sized accordingly. The default is None (256MB per worker).
+
+    Returns
+    -------
+    dataset : Xarray DataSet
+        The lazy dataset, which can be used in ncDataSelect and ncDataSelectMulti with lazy=True.
+
+    """
+    import xarray as xr
+    dataset = xr.open_mfdataset(paths,combine='by_coords',chunks={})
+    # The files are remembered, so ResultCache can fingerprint the dataset without reading it.
+    dataset.encoding['sources'] = sorted(glob.glob(paths)) if isinstance(paths,str) else [str(path) for path in paths]
+    latdim, londim, timedim = _ncDims(dataset)
+    dataset = _timeWindow(dataset,timedim,timeperiod)
+    if data_var == None:
+        data_var = list(dataset.data_vars)[0]
+    return _lazyChunk(dataset,data_var,memoryLimit,rechunk=True)
+
+def ingestChirps(source,store,data_var='precip',bbox=None,timeChunk=365,spaceChunk=25):
+    """
+    This function converts downloaded CHIRPS files (for example a folder filled by downloadChirps or downloadChirpsBulk) into one Zarr store, in which long time series of a few grid cells can be read quickly.
+    Daily CHIRPS files hold one day for a large area, so reading a 40-year series of one station from them means opening every file. The store keeps the data in compressed chunks of timeChunk days by spaceChunk x spaceChunk grid cells,
+    so a point series only reads the chunks of its own grid cells, and an animation reads whole chunks of consecutive days.
+    If the store exists already, only days after its last day are appended, so the same folder can be ingested again after new files were downloaded.
+
+    Parameters
+    ----------
+    source : str or list of str
+        A folder, a path with wildcards (for example 'chirps/*.tif.gz') or a list of paths. NetCDF (.nc) and GeoTIFF (.tif) files are read, also when gzipped (.gz);
+        GeoTIFF files require rioxarray and get their date from the file name (chirps-v2.0.YYYY.MM.DD.tif).
+    store : str
+        The path of the Zarr store (a folder), for example 'chirps.zarr'.
+    data_var : str, optional
+        The data variable to store. The default is 'precip'.
+    bbox : 4-sized collection (minLat,maxLat,minLon,maxLon), optional
+        Only store this area. The default is None (the whole grid of the files).
+    timeChunk : int, optional
+        The number of days per chunk. The default is 365.
+    spaceChunk : int, optional
+        The number of grid cells per chunk along latitude and longitude. The default is 25.
+        Smaller chunks make point series faster to read and maps slower to read.
+        When appending to an existing store, the chunks of that store are used instead.
+
+    Returns
+    -------
+    store : str
+        The path of the store, which can be given to ncDataSelect, ncDataSelectMulti and animateLatLonNC, or opened with openStore.
+        None if no files were found.
+
+    """
+    if isinstance(source,str):
+        paths = glob.glob(os.path.join(source,'*')) if os.path.isdir(source) else glob.glob(source)
+    else:
+        paths = list(source)
+    paths = sorted(path for path in paths if path.endswith(('.nc','.nc.gz','.tif','.tif.gz')))
+    if len(paths) == 0:
+        logger.error('ERROR: no NetCDF or GeoTIFF files found in '+str(source)+'.')
+        return None
+    
+    length, lastTime, timeChunk, spaceChunk = _storeState(store,data_var,timeChunk,spaceChunk)
+    
+    # Files are combined until they reach the next chunk boundary, so every write fills whole chunks.
+    batch, appended = [], 0
+    for path in paths:
+        date = _chirpsDate(path)
+        if lastTime is not None and date is not None and date <= lastTime:
+            continue
+        with span('ingest.read',file=os.path.basename(path)):
+            dataset = _openChirpsFile(path,data_var,bbox,spaceChunk)
+        if lastTime is not None:
+            dataset = dataset.sel(time=dataset['time'] > lastTime)
+        if dataset.sizes['time'] > 0:
+            batch.append(dataset)
+        if sum(part.sizes['time'] for part in batch) >= timeChunk-length%timeChunk:
+            length, lastTime = _appendBatch(batch,store,data_var,length,timeChunk,spaceChunk)
+            appended += sum(part.sizes['time'] for part in batch)
+            batch = []
+    if batch:
+        length, lastTime = _appendBatch(batch,store,data_var,length,timeChunk,spaceChunk)
+        appended += sum(part.sizes['time'] for part in batch)
+    logger.info(str(appended)+' days added to '+store+' ('+str(length)+' days in total).')
+    return store
+
+def openStore(path,timeperiod=None):
+    """
+    This function opens a Zarr store made with ingestChirps (or a NetCDF file) as a lazy Xarray DataSet, chunked like it is stored. No data is read until it is computed.
+
+    Parameters
+    ----------
+    path : str
+        The path of the Zarr store (a folder, or a path ending in .zarr) or of a NetCDF file.
+    timeperiod : 2-sized collection of datetimes (starttime,endtime), optional
+        Only keep data between starttime and endtime (both included). The default is None (all data).
+
+    Returns
+    -------
+    dataset : Xarray DataSet
+        The lazy dataset, which can be used in ncDataSelect and ncDataSelectMulti with lazy=True.
+
+    """
+    import xarray as xr
+    if os.path.isdir(path) or path.rstrip('/').endswith('.zarr'):
+        dataset = _openZarr(path)
+    else:
+        dataset = xr.open_dataset(path,chunks={})
+    # The source lets ResultCache recognise the store without reading it.
+    dataset.encoding['source'] = path
+    for variable in dataset.data_vars.values():
+        variable.encoding['source'] = path
+    latdim, londim, timedim = _ncDims(dataset)
+    return _timeWindow(dataset,timedim,timeperiod)
+
+def alignStationNc(stationdata,ncdata,resample='m',scheduler='threads',cache=None):
+    """
+    Resample station data and NetCDF-based data to the same time step and put them next to each other.
+
+    Parameters
+    ----------
+    stationdata : Pandas DataFrame
+        Station data, indexed by time.
+    ncdata : Pandas DataFrame or Xarray DataArray
+        The NetCDF-based data (for example the result of ncDataSelect), indexed by time. A lazy (dask-backed) DataArray is resampled before it is computed, so only the resampled series is loaded into memory.
+    resample : str, optional
+        The time step to resample to. The default is 'm'.
+    scheduler : str, optional
+        The dask scheduler used if ncdata is lazy. The default is 'threads'.
+    cache : ResultCache, optional
+        See ncDataSelect. Most useful if ncdata is lazy (dask-backed).
+
+    Returns
+    -------
+    aligned : Pandas DataFrame
+        The resampled station data, with the resampled NetCDF-based data as column 'ncdata'.
+
+    """
+    import xarray as xr
+    if cache is not None:
+        key = cache.key('alignStationNc',(stationdata,ncdata),resample=resample)
+        aligned = cache.get(key)
+        if aligned is not None:
+            return aligned
+    resample = _freqAlias(resample)
     stationresampled = stationdata.resample(rule=resample).mean()
-    aligned = stationresampled.copy()
+    aligned = stationresampled
+    if isinstance(ncdata,(xr.DataArray,xr.Dataset)):
+        timedim = [dim for dim in ncdata.dims if 'im' in dim][0]
+        ncdata = ncdata.resample({timedim:resample}).mean().compute(scheduler=scheduler).reset_coords(drop=True)
+        if isinstance(ncdata,xr.Dataset):
+            ncdata = ncdata.to_dataframe()
+        else:
+            ncdata = ncdata.to_series().to_frame()
     ncresampled = ncdata.resample(rule=resample).mean()
     aligned.loc[:,'ncdata'] = ncresampled.iloc[:,0]
+    if cache is not None:
+        cache.put(key,aligned)
     return aligned
    
+def alignStationsNc(stationdata,ncdata,resample='m',stats=False,scheduler='threads'):
+    """
+    Resample the data of many stations and the NetCDF-based data at the same stations to the same time step, in one pass, and put them next to each other in a long (tidy) table.
+
+    Parameters
+    ----------
+    stationdata : Pandas DataFrame
+        Station data, indexed by time, one column per station.
+    ncdata : Pandas DataFrame or Xarray DataArray
+        The NetCDF-based data at the stations (for example the result of ncDataSelectMulti or StationGridIndex.apply), indexed by time, one column per station.
+        Columns are matched to stationdata by name. A DataArray should have a time dimension and one station dimension; a lazy (dask-backed) one is resampled before it is computed.
+    resample : str, optional
+        The time step to resample to. The default is 'm'.
+    stats : boolean, optional
+        If True, also return per station summary statistics of the resampled data, computed in the same pass. The default is False.
+    scheduler : str, optional
+        The dask scheduler used if ncdata is lazy. The default is 'threads'.
+
+    Returns
+    -------
+    aligned : Pandas DataFrame
+        Columns time, station (categorical), stationdata and ncdata (float32); one row per station and resampled time step.
+    statsDf : Pandas DataFrame (only if stats=True)
+        Per station (index): n (number of time steps with both values), stationMean, ncMean, bias (ncMean - stationMean), rmse and correlation (Pearson).
+
+    """
+    import xarray as xr
+    resample = _freqAlias(resample)
+    if isinstance(ncdata,(xr.DataArray,xr.Dataset)):
+        if isinstance(ncdata,xr.Dataset):
+            ncdata = ncdata[_selectDataVar(ncdata,None)]
+        timedim = [dim for dim in ncdata.dims if 'im' in dim][0]
+        stationdim = [dim for dim in ncdata.dims if dim != timedim][0]
+        ncdata = ncdata.resample({timedim:resample}).mean().compute(scheduler=scheduler)
+        ncdata = ncdata.transpose(timedim,stationdim).to_pandas()
+        ncdata.columns = ncdata.columns.astype(str)
+    
+    stations = [station for station in stationdata.columns if station in ncdata.columns]
+    if len(stations) == 0:
+        logger.error('ERROR: no station of stationdata is a column of ncdata.')
+        return None
+    if len(stations) < stationdata.shape[1]:
+        logger.warning('Stations without NetCDF-based data are left out: '+str([station for station in stationdata.columns if station not in stations])+'.')
+    
+    # Both sources on one time index, as one (time, station, source) array, so a single grouping resamples both.
+    index = stationdata.index.union(ncdata.index)
+    values = np.empty((len(index),len(stations),2))
+    values[:,:,0] = stationdata[stations].reindex(index).to_numpy(dtype=float)
+    values[:,:,1] = ncdata[stations].reindex(index).to_numpy(dtype=float)
+    periods, starts = _periodStarts(index,resample)
+    present = ~np.isnan(values)
+    np.nan_to_num(values,copy=False)
+    counts = np.add.reduceat(present,starts,axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        means = np.add.reduceat(values,starts,axis=0)/counts
+    
+    timename = index.name if index.name is not None else 'time'
+    aligned = pd.DataFrame({timename:np.repeat(periods.values,len(stations)),
+                            'station':pd.Categorical.from_codes(np.tile(np.arange(len(stations)),len(periods)),categories=[str(station) for station in stations]),
+                            'stationdata':means[:,:,0].ravel().astype(np.float32),
+                            'ncdata':means[:,:,1].ravel().astype(np.float32)})
+    if not stats:
+        return aligned
+    
+    both = ~np.isnan(means).any(axis=2)
+    n = both.sum(axis=0)
+    x = np.where(both,means[:,:,0],0.0)
+    y = np.where(both,means[:,:,1],0.0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        xMean = x.sum(axis=0)/n
+        yMean = y.sum(axis=0)/n
+        dx = np.where(both,x-xMean,0.0)
+        dy = np.where(both,y-yMean,0.0)
+        statsDf = pd.DataFrame({'n':n,'stationMean':xMean,'ncMean':yMean,'bias':yMean-xMean,
+                                'rmse':np.sqrt(((y-x)**2).sum(axis=0)/n),
+                                'correlation':(dx*dy).sum(axis=0)/np.sqrt((dx**2).sum(axis=0)*(dy**2).sum(axis=0))},
+                               index=pd.Index([str(station) for station in stations],name='station'))
+    return aligned, statsDf
+
+def disaggregate(fine,coarse,fineStep='D',coarseStep='m'):
+    """
+    Distribute coarse data (for example monthly satellite rainfall) over fine time steps, following the pattern of fine data (for example daily station rainfall).
+    Every fine value of the coarse period gets coarse * fine / mean(fine over the coarse period). Works for many stations (columns) at once.
+
+    Parameters
+    ----------
+    fine : Pandas DataFrame or Series
+        The fine data, indexed by time, one column per station. It is resampled to fineStep (mean) if it is not yet on that time step.
+    coarse : Pandas DataFrame or Series
+        The coarse data, indexed by time, with the same columns as fine (or, for one station, any single column). It is resampled to coarseStep (mean).
+    fineStep : str, optional
+        The fine time step. The default is 'D'.
+    coarseStep : str, optional
+        The coarse time step. The default is 'm' (month).
+
+    Returns
+    -------
+    dfOut : Pandas DataFrame
+        The disaggregated coarse data on the fine time index, with the columns of fine.
+        Missing values (NaN) stay missing: a coarse period without coarse data, or without any fine data, gives NaN for that period;
+        a missing fine value gives NaN for that time step only.
+
+    """
+    fineStep, coarseStep = _freqAlias(fineStep), _freqAlias(coarseStep)
+    if isinstance(fine,pd.Series):
+        fine = fine.to_frame()
+    if isinstance(coarse,pd.Series):
+        coarse = coarse.to_frame()
+    if coarse.shape[1] == 1 and fine.shape[1] == 1:
+        coarse = coarse.set_axis(fine.columns,axis=1)
+    elif not fine.columns.isin(coarse.columns).all():
+        logger.error('ERROR: not all columns of fine are in coarse: '+str(list(fine.columns[~fine.columns.isin(coarse.columns)]))+'.')
+        return None
+    
+    regular = pd.date_range(fine.index.min(),fine.index.max(),freq=fineStep)
+    if not fine.index.equals(regular):
+        fine = fine.resample(fineStep).mean()
+    fineIndex = fine.index
+    
+    # Group code of every fine time step: the position of its coarse period.
+    periods, starts = _periodStarts(fineIndex,coarseStep)
+    codes = np.repeat(np.arange(len(starts)),np.diff(np.append(starts,len(fineIndex))))
+    
+    values = fine.to_numpy(dtype=float)
+    present = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(present,values,0.0),starts,axis=0)
+    counts = np.add.reduceat(present,starts,axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        fineMean = sums/counts
+        coarseValues = coarse.resample(coarseStep).mean().reindex(index=periods,columns=fine.columns).to_numpy(dtype=float)
+        # One array for the result: ratio of fine to its period mean, scaled by the coarse value of the period.
+        out = np.divide(values,fineMean[codes])
+        out *= coarseValues[codes]
+    return pd.DataFrame(out,index=fineIndex,columns=fine.columns)
+
 def upsampleData(data1,data2,timestep1='D',timestep2='m'):
-    data1.set_axis(['data1raw'],axis=1,inplace=True)
-    data1 = data1.resample(rule=timestep1).mean()
-    data2 = data2.resample(rule=timestep2).mean().loc[data1.index.min():data1.index.max()]
-    data2 = data2.fillna(-999)
-    data1['data2res'] = data2.resample(rule=timestep1).mean()
-    data1.loc[:,'data2res']=data1.data2res.fillna(method='bfill').replace(-999,np.nan)
-    data1avg = data1.data1raw.resample(rule=timestep2).mean().fillna(-999)
-    data1['avgfilled'] = data1avg
-    data1.loc[:,'avgfilled'] = data1.avgfilled.fillna(method='bfill').replace(-999,np.nan)
-    data1.loc[:,'weights'] = data1.data1raw/data1.avgfilled
-    data1['data2upsampled'] = data1.data2res*data1.weights
-    
-    dataOut = data1.get(['data1raw','data2upsampled'])
-    return dataOut
\ No newline at end of file
+    """
+    Upsample (disaggregate) data2 to the time step of data1, following the pattern of data1. See disaggregate.
+
+    Parameters
+    ----------
+    data1 : Pandas DataFrame
+        Fine data of one station (one column), indexed by time.
+    data2 : Pandas DataFrame or Series
+        Coarse data (one column), indexed by time.
+    timestep1 : str, optional
+        The time step of data1. The default is 'D'.
+    timestep2 : str, optional
+        The time step of data2. The default is 'm'.
+
+    Returns
+    -------
+    dataOut : Pandas DataFrame
+        Columns 'data1raw' (data1 resampled to timestep1) and 'data2upsampled'.
+
+    """
+    if isinstance(data1,pd.DataFrame):
+        data1 = data1.iloc[:,0]
+    data1raw = data1.resample(_freqAlias(timestep1)).mean().rename('data1raw')
+    upsampled = disaggregate(data1raw,data2,timestep1,timestep2)
+    dataOut = pd.DataFrame({'data1raw':data1raw,'data2upsampled':upsampled.iloc[:,0]})
+    return dataOut
+
+class ResultCache:
+    """
+    An on-disk cache of results of ncDataSelect, ncDataSelectMulti and alignStationNc, so repeated calls on the same files and coordinates do not read the NetCDF data again.
+    A result is stored as .npz file, keyed by the function, a fingerprint of the data and the arguments (coordinates, method, time window, data_var, ...).
+    The fingerprint of a dataset opened from files is their paths, modification times and sizes, plus its variables and coordinates;
+    data without a source file (for example a DataFrame, a dataset created in memory or a variable changed by arithmetic or reassignment) is fingerprinted by hashing its content.
+    Lazy (dask) data of which the source files are unknown is not cached, because hashing it would read it all; open such files with openNcLazy or openStore.
+    Writing in place into the values of a loaded dataset (for example dataset.precip.values[0] = 0) keeps its source and is not detected; use a copy of the dataset (or no cache) for that.
+    If the cache grows beyond maxBytes, the least recently used results are removed.
+
+    Parameters
+    ----------
+    directory : str, optional
+        The folder for the cached results. The default is 'awtiCache' in the current working directory.
+    maxBytes : int, optional
+        The maximum total size of the cached results, in bytes. The default is 1e9 (1 GB).
+
+    Example
+    -------
+    cache = ResultCache()
+    dfOut = ncDataSelect(ds,(6.05,37.55),cache=cache)
+    cache.stats()
+
+    """
+    def __init__(self,directory='awtiCache',maxBytes=1e9):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory,exist_ok=True)
+
+    def key(self,function,data,**arguments):
+        """The key of a function call on data (a dataset, DataFrame, or tuple of those) with the given arguments; None if the data cannot be fingerprinted without reading it."""
+        if not isinstance(data,tuple):
+            data = (data,)
+        digest = hashlib.sha1(function.encode())
+        for item in data:
+            fingerprint = _fingerprint(item)
+            if fingerprint is None:
+                logger.error('The result is not cached: the data is lazy (dask) and its source files are unknown or it was changed in memory. Open the files with openNcLazy or openStore to cache results.')
+                return None
+            digest.update(fingerprint)
+        for name in sorted(arguments):
+            value = arguments[name]
+            if isinstance(value,np.ndarray):
+                value = np.round(value.astype(float),8).tolist()
+            digest.update((name+'='+repr(value)+';').encode())
+        return digest.hexdigest()
+
+    def get(self,key):
+        """The cached DataFrame of key, or None if it is not in the cache."""
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path,allow_pickle=False) as saved:
+                columns = list(saved['columns'])
+                dfOut = pd.DataFrame({column:saved['column'+str(i)] for i, column in enumerate(columns)},
+                                     index=pd.Index(saved['index'],name=str(saved['indexName']) or None),columns=columns)
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        # The modification time of a result is its last use, for least-recently-used eviction.
+        os.utime(path)
+        self.hits += 1
+        return dfOut
+
+    def put(self,key,dfOut):
+        """Store a DataFrame with numeric columns (as returned by the selection functions) under key."""
+        if key is None:
+            return
+        path = self._path(key)
+        temporary = path+'.tmp.npz'
+        columns = {'column'+str(i):dfOut.iloc[:,i].to_numpy() for i in range(dfOut.shape[1])}
+        np.savez(temporary,index=dfOut.index.to_numpy(),indexName=str(dfOut.index.name or ''),
+                 columns=np.array([str(column) for column in dfOut.columns]),**columns)
+        os.replace(temporary,path)
+        self._evict()
+
+    def stats(self):
+        """Hits and misses of this session, and the number and total size of cached results."""
+        files = glob.glob(os.path.join(self.directory,'*.npz'))
+        calls = self.hits+self.misses
+        return {'hits':self.hits,'misses':self.misses,'hitRate':self.hits/calls if calls else 0.0,
+                'entries':len(files),'bytes':sum(os.path.getsize(file) for file in files)}
+
+    def clear(self):
+        """Remove all cached results."""
+        for file in glob.glob(os.path.join(self.directory,'*.npz')):
+            os.remove(file)
+
+    def _path(self,key):
+        return os.path.join(self.directory,key+'.npz')
+
+    def _evict(self):
+        files = [(os.path.getmtime(file),os.path.getsize(file),file) for file in glob.glob(os.path.join(self.directory,'*.npz'))]
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.maxBytes:
+                break
+            os.remove(file)
+            total -= size
+
+class StationGridIndex:
+    """
+    A reusable index of the grid cells and weights needed to extract a fixed list of stations from datasets on a fixed grid (for example daily CHIRPS files).
+    The neighbour search and the weights are calculated once; applying the index to a new dataset reads only the cells the stations use, followed by one sparse matrix product.
+
+    Parameters
+    ----------
+    lats, lons : array-like
+        The latitude and longitude axes of the grid.
+    coords : array-like of shape (N,2), or Pandas DataFrame
+        The (lat,lon) coordinates of the stations, see ncDataSelectMulti.
+    method : str, optional
+        One of {'m1','closest','m2','average','m3','idw'}. The default is 'closest'. See ncDataSelect.
+    names : list of str, optional
+        Names of the stations, see ncDataSelectMulti.
+
+    Example
+    -------
+    index = StationGridIndex.fromDataset(ds,stations,method='idw')
+    index.save('stations.npz')
+    ...
+    index = StationGridIndex.load('stations.npz')
+    dfOut = index.apply(newds)
+
+    """
+    def __init__(self,lats,lons,coords,method='closest',names=None):
+        if method not in ['m1','closest','m2','average','m3','idw']:
+            raise ValueError('Method '+str(method)+' unknown. Please select from one of "m1", "closest", "m2", "average", "m3", "idw".')
+        coords, names = _stationCoords(coords,names)
+        self.lats = np.asarray(lats,dtype=float)
+        self.lons = np.asarray(lons,dtype=float)
+        self.method = method
+        self.names = [str(name) for name in names]
+        latIdx, lonIdx, weights = _gridNeighbours(self.lats,self.lons,coords,method)
+        if latIdx is None:
+            raise ValueError('Not all coordinates are within the grid.')
+        # Per station the 4 surrounding cells as flat (lat*nlon+lon) index, with their weights.
+        self.cells = (latIdx*len(self.lons)+lonIdx).astype(np.int32)
+        self.weights = weights
+        self.signature = _gridSignature(self.lats,self.lons)
+        self._matrix = None
+
+    @classmethod
+    def fromDataset(cls,dataset,coords,method='closest',names=None):
+        """Create the index from the lat/lon axes of an Xarray DataSet."""
+        latdim, londim, timedim = _ncDims(dataset)
+        return cls(dataset[latdim].values,dataset[londim].values,coords,method,names)
+
+    def save(self,path):
+        """Save the index to a .npz file."""
+        np.savez_compressed(path,lats=self.lats,lons=self.lons,cells=self.cells,weights=self.weights,
+                            method=self.method,names=np.array(self.names),signature=self.signature)
+
+    @classmethod
+    def load(cls,path):
+        """Load an index that was saved with save()."""
+        with np.load(path) as saved:
+            index = cls.__new__(cls)
+            index.lats = saved['lats']
+            index.lons = saved['lons']
+            index.cells = saved['cells']
+            index.weights = saved['weights']
+            index.method = str(saved['method'])
+            index.names = list(saved['names'].astype(str))
+            index.signature = str(saved['signature'])
+        index._matrix = None
+        return index
+
+    def matches(self,dataset):
+        """Check if dataset has the same grid as the index."""
+        latdim, londim, timedim = _ncDims(dataset)
+        return _gridSignature(dataset[latdim].values,dataset[londim].values) == self.signature
+
+    def apply(self,dataset,data_var=None):
+        """
+        Extract the station data from dataset.
+
+        Parameters
+        ----------
+        dataset : Xarray DataSet
+            A dataset on the same grid as the index, with a data_var with dimensions time, latitude and longitude.
+        data_var : str, optional
+            See ncDataSelect. The default is None.
+
+        Returns
+        -------
+        dfOut : Pandas DataFrame
+            A DataFrame indexed by time, with one column per station. None if the grid of dataset does not match the index.
+
+        """
+        if not self.matches(dataset):
+            logger.error('The grid of the dataset does not match the grid of this StationGridIndex. Please create a new index for this grid.')
+            return
+        import xarray as xr
+        latdim, londim, timedim = _ncDims(dataset)
+        data_var = _selectDataVar(dataset,data_var)
+        
+        # Only the cells the stations use are read, with one pointwise selection (like ncDataSelectMulti).
+        matrix, columns = self._weightMatrix()
+        nlon = len(self.lons)
+        with span('nc.read',method=self.method,cells=len(columns)):
+            points = dataset[data_var].isel({latdim:xr.DataArray(columns//nlon,dims='cell'),
+                                             londim:xr.DataArray(columns%nlon,dims='cell')})
+            data = np.asarray(points.transpose('cell',timedim))
+        if self.method in ['m2','average']:
+            # Like ncDataSelect, missing cells are skipped in the average.
+            available = ~np.isnan(data)
+            with np.errstate(invalid='ignore'):
+                dataOut = (matrix@np.where(available,data,0))/(matrix@available)
+        else:
+            dataOut = matrix@data
+        
+        dfOut = pd.DataFrame(dataOut.T,index=pd.Index(dataset[timedim].values,name=timedim),columns=self.names)
+        return dfOut
+
+    def _weightMatrix(self):
+        # The sparse (station x cell) weights over the used cells only, and the flat index of those cells.
+        if self._matrix is None:
+            from scipy import sparse
+            rows = np.repeat(np.arange(len(self.cells)),self.cells.shape[1])
+            used = self.weights.ravel() != 0
+            columns, inverse = np.unique(self.cells.ravel()[used],return_inverse=True)
+            matrix = sparse.csr_matrix((self.weights.ravel()[used],(rows[used],inverse)),shape=(len(self.cells),len(columns)))
+            self._matrix = (matrix,columns)
+        return self._matrix
+
+def _fingerprint(data):
+    # Bytes identifying data for ResultCache: source files (path, mtime, size) and structure for file-backed xarray data whose variables
+    # still come from those files, otherwise a hash of the content. None for lazy data that is not (or no longer) file-backed.
+    import xarray as xr
+    if isinstance(data,(xr.Dataset,xr.DataArray)):
+        parts = [repr(dict(data.sizes)),repr(sorted(data.data_vars) if isinstance(data,xr.Dataset) else data.name)]
+        for coord in data.coords:
+            parts.append(coord+':'+hashlib.sha1(np.ascontiguousarray(data[coord].values).tobytes()).hexdigest())
+        source = data.encoding.get('source')
+        sources = [os.path.abspath(source) for source in data.encoding.get('sources',[source] if source is not None else [])]
+        variables = list(data.data_vars.values()) if isinstance(data,xr.Dataset) else [data]
+        # Arithmetic and reassignment drop the source of a variable, so data changed in memory is hashed by content instead.
+        unchanged = all(variable.encoding.get('source') is not None and os.path.abspath(variable.encoding['source']) in sources for variable in variables)
+        if len(sources) > 0 and unchanged and all(os.path.exists(source) for source in sources):
+            for source in sources:
+                parts.append(source+':'+_sourceStamp(source))
+        else:
+            # Hashing lazy (dask) data would read all of it, also for a cache hit.
+            if any(variable.chunks is not None for variable in variables):
+                return None
+            for variable in variables:
+                parts.append(hashlib.sha1(np.ascontiguousarray(variable.values).tobytes()).hexdigest())
+        return '|'.join(parts).encode()
+    if isinstance(data,(pd.DataFrame,pd.Series)):
+        names = list(data.columns) if isinstance(data,pd.DataFrame) else [data.name]
+        return repr(names).encode()+pd.util.hash_pandas_object(data).values.tobytes()
+    return repr(data).encode()
+
+def _openChirpsFile(path,data_var,bbox,spaceChunk):
+    # One downloaded CHIRPS file as float32 Dataset with dims (time, latitude, longitude), lazy and chunked unless spaceChunk is None.
+    import xarray as xr
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        import gzip
+        with gzip.open(path,'rb') as file:
+            from .ftpChirps import _openInMemory
+            opened = _openInMemory(file.read(),name[:-3])
+        name = name[:-3]
+    elif name.endswith('.nc'):
+        opened = xr.open_dataset(path,chunks=None if spaceChunk is None else {})
+    else:
+        import rioxarray
+        opened = rioxarray.open_rasterio(path,masked=True,chunks=None if spaceChunk is None else {})
+    dataset = opened if isinstance(opened,xr.Dataset) else opened.to_dataset(name=data_var)
+    if name.endswith('.tif'):
+        # A GeoTIFF holds one day, whose date is only in the file name.
+        date = _chirpsDate(path)
+        dataset = dataset[[data_var]].squeeze('band',drop=True).expand_dims(time=[date])
+        dataset = dataset.rename({'y':'latitude','x':'longitude'}).drop_vars('spatial_ref',errors='ignore')
+    else:
+        latdim, londim, timedim = _ncDims(dataset)
+        dataset = dataset[[data_var]].rename({latdim:'latitude',londim:'longitude',timedim:'time'})
+    if bbox is not None:
+        from .ftpChirps import _clipBbox
+        dataset = _clipBbox(dataset,bbox)
+    dataset[data_var] = dataset[data_var].astype(np.float32)
+    # Gzipped files are decompressed in memory anyway; those, and all files when spaceChunk is None, are loaded and closed at once,
+    # so no (netCDF/HDF5) file stays open to be closed later by another thread.
+    if spaceChunk is None or path.endswith('.gz'):
+        dataset = dataset.load()
+        opened.close()
+    if spaceChunk is None:
+        return dataset
+    return dataset.chunk({'time':-1,'latitude':spaceChunk,'longitude':spaceChunk})
+
+def _chirpsDate(path):
+    # The day of a daily CHIRPS file name (chirps-v2.0.YYYY.MM.DD.tif.gz), or None for other names (for example yearly files).
+    parts = os.path.basename(path).split('.')
+    if parts[-1] == 'gz':
+        parts = parts[:-1]
+    try:
+        return np.datetime64('-'.join(parts[-4:-1]),'ns')
+    except ValueError:
+        return None
+
+def _storeState(store,data_var,timeChunk,spaceChunk):
+    # Number of days, last day and chunks of a store; new days are stored like the days already in the store.
+    if not os.path.exists(store):
+        return 0, None, timeChunk, spaceChunk
+    existing = _openZarr(store)
+    length, lastTime = existing.sizes['time'], existing['time'].values[-1]
+    timeChunk, spaceChunk = existing[data_var].encoding['chunks'][:2]
+    existing.close()
+    return length, lastTime, timeChunk, spaceChunk
+
+def _appendBatch(batch,store,data_var,length,timeChunk,spaceChunk):
+    # Write a batch of opened files to the store; returns the new number of days and the last day in the store.
+    import xarray as xr
+    combined = xr.concat(batch,dim='time').sortby('time')
+    with span('ingest.write',days=combined.sizes['time']):
+        _writeStore(combined,store,data_var,length,timeChunk,spaceChunk)
+    return length+combined.sizes['time'], combined['time'].values[-1]
+
+def _writeStore(dataset,store,data_var,length,timeChunk,spaceChunk):
+    # Write to a new store, or append along time; the first dask chunk fills up the last (partial) chunk of the store.
+    days = dataset.sizes['time']
+    first = min(days,timeChunk-length%timeChunk)
+    timeChunks = (first,)+(timeChunk,)*((days-first)//timeChunk)
+    if sum(timeChunks) < days:
+        timeChunks += (days-sum(timeChunks),)
+    dataset = dataset.chunk({'time':timeChunks,'latitude':spaceChunk,'longitude':spaceChunk})
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore',message='Consolidated metadata')
+        if length == 0:
+            encoding = {data_var:{'chunks':(timeChunk,spaceChunk,spaceChunk)}}
+            dataset.to_zarr(store,mode='w-',encoding=encoding,consolidated=True)
+        else:
+            dataset.to_zarr(store,append_dim='time',consolidated=True)
+
+def _openZarr(store):
+    # Consolidated metadata (all metadata in one file, so opening takes one read) works, but Zarr 3 warns that it is not in its specification yet.
+    import xarray as xr
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore',message='Consolidated metadata')
+        return xr.open_zarr(store)
+
+def _sourceStamp(source):
+    # Modification time and size of a source file, or of the files directly under a store folder (their metadata changes when data is appended).
+    if os.path.isdir(source):
+        stats = [os.stat(os.path.join(source,name)) for name in sorted(os.listdir(source))]
+    else:
+        stats = [os.stat(source)]
+    return ','.join(str(status.st_mtime_ns)+':'+str(status.st_size) for status in stats)
+
+def _periodStarts(index,rule):
+    """
+    The periods (resample labels) of a sorted time index, and the row where each period starts.
+    Periods are contiguous in a sorted index, so they are described by their first row; resampling the row numbers uses the same labels as resampling the data.
+    Periods without rows are left out.
+    """
+    firstRow = pd.Series(np.arange(len(index)),index=index).resample(rule).min().dropna()
+    return firstRow.index, firstRow.values.astype(np.int64)
+
+def _freqAlias(step):
+    # Pandas 2.2 renamed period-end aliases ('m' -> 'ME'); pandas 3 no longer accepts the old ones.
+    newAlias = {'m':'ME','M':'ME','q':'QE','Q':'QE','y':'YE','Y':'YE','a':'YE','A':'YE'}.get(step)
+    if newAlias is not None:
+        try:
+            pd.tseries.frequencies.to_offset(newAlias)
+            return newAlias
+        except ValueError:
+            pass
+    return step
+
+def _ncDims(dataset):
+    # Detect the names of the latitude, longitude and time dimensions.
+    dims = pd.Series(list(dataset.dims))
+    latdim = dims[dims.str.find('at')>-1].iloc[0]
+    londim = dims[dims.str.find('on')>-1].iloc[0]
+    timedim = dims[dims.str.find('im')>-1].iloc[0]
+    return latdim, londim, timedim
+
+def _selectDataVar(dataset,data_var):
+    data_vars = np.array(dataset.data_vars)
+    if data_var == None:
+        data_var = data_vars[0]
+        logger.warning('data variable not selected. This dataset has '+str(data_vars)+'. Using '+data_var+'.')
+    elif data_var not in data_vars:
+        logger.warning(data_var+' not found in dataset. This dataset has '+str(data_vars)+'. Using '+str(data_vars[0])+'.')
+        data_var = data_vars[0]
+    else:
+        logger.debug(data_var+' selected to use.')
+    return data_var
+
+def _stationCoords(coords,names):
+    # Coordinates as (N,2) float array and station names, from an array-like or a DataFrame with lat/lon columns.
+    if isinstance(coords,pd.DataFrame):
+        latcol = coords.columns[coords.columns.str.lower().str.find('lat')>-1][0]
+        loncol = coords.columns[coords.columns.str.lower().str.find('lon')>-1][0]
+        if names is None:
+            names = list(coords.index)
+        coords = coords[[latcol,loncol]].to_numpy(dtype=float)
+    else:
+        coords = np.asarray(coords,dtype=float).reshape(-1,2)
+    if names is None:
+        names = ['station'+str(i) for i in range(1,len(coords)+1)]
+    return coords, names
+
+def _gridSignature(lats,lons):
+    # Fingerprint of a grid; coordinates are rounded so float32 and float64 axes of the same grid match.
+    axes = [np.round(np.asarray(axis,dtype=float),6) for axis in (lats,lons)]
+    return hashlib.sha1(b''.join(axis.tobytes() for axis in axes)).hexdigest()
+
+def _gridNeighbours(lats,lons,coords,method):
+    """
+    Find, for N (lat,lon) coordinates, the 4 surrounding grid cells and their weights.
+
+    Returns
+    -------
+    latIdx, lonIdx : arrays of shape (N,4)
+        Index positions on the lat and lon axes, ordered as (minLat,minLon), (minLat,maxLon), (maxLat,minLon), (maxLat,maxLon).
+    weights : array of shape (N,4)
+        Per cell the weight according to method (one-hot for closest, 1/4 for average, normalized 1/distance for idw).
+    """
+    minLat, maxLat, validLat = _bracket(lats,coords[:,0])
+    minLon, maxLon, validLon = _bracket(lons,coords[:,1])
+    invalid = ~(validLat&validLon)
+    if invalid.any():
+        logger.error('Coordinate(s) '+str(coords[invalid].tolist())+' not within the grid of the dataset. Data cannot be selected.')
+        return None, None, None
+    
+    latIdx = np.stack([minLat,minLat,maxLat,maxLat],axis=1)
+    lonIdx = np.stack([minLon,maxLon,minLon,maxLon],axis=1)
+    distances = np.hypot(lats[latIdx]-coords[:,:1],lons[lonIdx]-coords[:,1:])
+    
+    if method in ['m1','closest']:
+        weights = np.zeros(distances.shape)
+        weights[np.arange(len(coords)),distances.argmin(axis=1)] = 1
+    elif method in ['m2','average']:
+        weights = np.full(distances.shape,0.25)
+    else:
+        invDist = 1/distances
+        weights = invDist/invDist.sum(axis=1,keepdims=True)
+    return latIdx, lonIdx, weights
+
+def _timeWindow(dataset,timedim,timeperiod):
+    # Select the time window before anything is read, so lazy datasets only read the needed time steps.
+    if timeperiod is None:
+        return dataset
+    return dataset.sel({timedim:slice(timeperiod[0],timeperiod[1])})
+
+def _memoryPerWorker(memoryLimit,scheduler=None):
+    workers = 1 if scheduler == 'synchronous' else (os.cpu_count() or 1)
+    if memoryLimit is None:
+        return 256*2**20, workers
+    from dask.utils import parse_bytes
+    return max(parse_bytes(memoryLimit)//workers,1), workers
+
+def _lazyChunk(dataset,data_var,memoryLimit,rechunk=False):
+    # Chunk the dataset along time so that one chunk of data_var fits within the memory per worker.
+    # Data that is chunked already keeps its chunks if they fit; larger chunks are split along time only, so the spatial chunks of a store stay.
+    latdim, londim, timedim = _ncDims(dataset)
+    chunkBytes = _memoryPerWorker(memoryLimit)[0]
+    chunks = dataset[data_var].chunksizes
+    if chunks and not rechunk:
+        stepBytes = dataset[data_var].dtype.itemsize*max(chunks[latdim])*max(chunks[londim])
+        if stepBytes*max(chunks[timedim]) <= chunkBytes:
+            return dataset
+        timeChunk = int(max(1,chunkBytes//max(stepBytes,1)))
+        return dataset.chunk({timedim:timeChunk})
+    stepBytes = dataset[data_var].dtype.itemsize*dataset.sizes[latdim]*dataset.sizes[londim]
+    timeChunk = int(max(1,min(chunkBytes//max(stepBytes,1),dataset.sizes[timedim])))
+    return dataset.chunk({timedim:timeChunk,latdim:-1,londim:-1})
+
+def _computeLazy(data,scheduler,memoryLimit):
+    workers = _memoryPerWorker(memoryLimit,scheduler)[1]
+    return data.compute(scheduler=scheduler,num_workers=workers)
+
+def _bracket(axis,values):
+    # Per value the positions of the largest axis value below and the smallest axis value above it (the axis may be descending).
+    order = np.argsort(axis,kind='stable')
+    sortedAxis = axis[order]
+    below = np.searchsorted(sortedAxis,values,side='left')-1
+    above = np.searchsorted(sortedAxis,values,side='right')
+    valid = (below>=0)&(above<len(sortedAxis))
+    below = order[np.clip(below,0,len(order)-1)]
+    above = order[np.clip(above,0,len(order)-1)]
+    return below, above, valid
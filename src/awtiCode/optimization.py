@@ -3,9 +3,11 @@
 # -*- coding: utf-8 -*-
 
 # Import packages
-from ortools.sat.python import cp_model
 import pandas as pd
 import numpy as np
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .instrumentation import logger, span
 
 def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
                  cropCycle=[3,4,5,4],waterUse=[300,200,350,400],
@@ -58,16 +60,493 @@ def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
         A summary of settings and results for all month/crop combinations.
 
     """
+    from ortools.sat.python import cp_model
     
     
     ############################## SETTINGS ########################################
-    if type(waterAvailable) == int:    
+    settings = _settings(waterAvailable,landAvailable,noCrops,cropCycle,waterUse,cropProfit,moreOptions)
+    if settings is None:
+        return
+    crops, cropNames, cropCycle = settings['crops'], settings['cropNames'], settings['cropCycle']
+    waterconstraint, profit, yrsToProfit = settings['waterconstraint'], settings['profit'], settings['yrsToProfit']
+    maxTime = settings['maxTime']
+       
+    ######################### FROM HERE: DO NOT CHANGE ############################
+    
+    var_upper_bound = 100000
+    
+    buildStart = time.perf_counter()
+    with span('cpsat.build',crops=len(crops)):
+        model, cropvars, sowvars, waterCons, landCons = _buildModel(crops,cropCycle,waterconstraint,settings['profitweight'],
+                                                                    settings['available_water_per_month'],settings['available_land'],
+                                                                    settings['offSeason'],var_upper_bound)
+    buildTime = time.perf_counter()-buildStart
+    
+    # solve it
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = maxTime
+    solveStart = time.perf_counter()
+    status = _solve(solver,model)
+    solveTime = time.perf_counter()-solveStart
+    
+    cropsDf = _resultFrame(solver,crops,cropNames,cropvars,sowvars,waterconstraint,profit,cropCycle,yrsToProfit)
+    cropsDf.attrs.update({'buildTime':buildTime,'solveTime':solveTime,'status':solver.StatusName(status)})
+    
+    cropsResult = cropsDf.pivot(index='monthInt',columns='cropname',values='result').get(cropNames)
+    objVal = solver.ObjectiveValue()/1000000
+    logger.info(f'\nModel built in {buildTime:.3f} s, solved in {solveTime:.3f} s (status: {solver.StatusName(status)}).')
+    logger.info('Total profit: '+str(int(objVal))+' million.')
+    logger.info('Monthly per crop: (sowing,hectare), with sowing 0 (no) or 1 (yes).\n'+str(cropsResult))
+    
+    return cropsDf
+
+class CropScheduleModel:
+    """
+    A crop schedule model (see cropSchedule) that is kept in memory, for interactive planning: parameters can be changed in place and the model is solved again, starting from the previous solution.
+
+    Parameters
+    ----------
+    waterAvailable, landAvailable, noCrops, cropCycle, waterUse, cropProfit, **moreOptions :
+        The settings, see cropSchedule.
+
+    Attributes
+    ----------
+    status : str
+        The solver status of the last solve ('OPTIMAL', 'FEASIBLE', 'INFEASIBLE', ...).
+    objective : float
+        The total profit of the last solution.
+    bound : float
+        The best proven upper bound of the total profit.
+    gap : float
+        The relative gap (bound-objective)/objective; 0 if the solution is proven optimal.
+    solveTime : float
+        The duration of the last solve, in seconds.
+
+    Example
+    -------
+    scheduleModel = CropScheduleModel(waterAvailable=100000,landAvailable=2000)
+    cropsDf = scheduleModel.solve()
+    scheduleModel.update(waterAvailable=[100000]*6+[60000]*6)
+    cropsDf = scheduleModel.solve(maxTime=1)
+
+    """
+    def __init__(self,waterAvailable=100000,landAvailable=2000,noCrops=4,cropCycle=[3,4,5,4],
+                 waterUse=[300,200,350,400],cropProfit=[75000,60000,100000,150000],**moreOptions):
+        self.settings = _settings(waterAvailable,landAvailable,noCrops,cropCycle,waterUse,cropProfit,moreOptions)
+        if self.settings is None:
+            raise ValueError('The settings are not correct, see the message above.')
+        self.noCrops = noCrops
+        self.moreOptions = moreOptions
+        settings = self.settings
+        with span('cpsat.build',crops=len(settings['crops'])):
+            self.model, self.cropvars, self.sowvars, self.waterCons, self.landCons = _buildModel(
+                settings['crops'],settings['cropCycle'],settings['waterconstraint'],settings['profitweight'],
+                settings['available_water_per_month'],settings['available_land'],settings['offSeason'],100000)
+        self.status = None
+        self.objective = None
+        self.bound = None
+        self.gap = None
+        self.solveTime = None
+        self._solution = None
+
+    def update(self,waterAvailable=None,landAvailable=None,cropProfit=None):
+        """
+        Change the available water (int or list of 12 ints), the available land and/or the profit per crop, without rebuilding the model.
+        """
+        from ortools.sat.python import cp_model
+        updated = _settings(self.settings['available_water_per_month'] if waterAvailable is None else waterAvailable,
+                            self.settings['available_land'] if landAvailable is None else landAvailable,
+                            self.noCrops,self.settings['cropCycle'],self.settings['waterconstraint'],
+                            self.settings['profit'] if cropProfit is None else cropProfit,self.moreOptions)
+        if updated is None:
+            return
+        for constraint, limit in zip(self.waterCons,updated['available_water_per_month']):
+            _setUpperBound(self.model,constraint.Index(),limit)
+        for constraint in self.landCons:
+            _setUpperBound(self.model,constraint.Index(),updated['available_land'])
+        if cropProfit is not None:
+            self.model.Maximize(cp_model.LinearExpr.WeightedSum(list(self.cropvars.ravel()),
+                                                                [int(p) for p in np.repeat(updated['profitweight'],12)]))
+        self.settings = updated
+
+    def solve(self,maxTime=None,hint=True,threads=None):
+        """
+        Solve the model. The solver stops as soon as the solution is proven optimal, or after maxTime seconds.
+
+        Parameters
+        ----------
+        maxTime : float, optional
+            The maximum calculation time in seconds. The default is None (maxTime of the settings, 10 seconds if not set).
+        hint : boolean, optional
+            If True (default), the previous solution is given to the solver as starting point.
+        threads : int, optional
+            The number of solver threads. The default is None (the solver default).
+
+        Returns
+        -------
+        cropsDf : Pandas DataFrame
+            A summary of settings and results for all month/crop combinations, like cropSchedule.
+
+        """
+        from ortools.sat.python import cp_model
+        self.model.ClearHints()
+        if hint and self._solution is not None:
+            for variable, value in zip(self.cropvars.ravel(),self._solution[0]):
+                self.model.AddHint(variable,int(value))
+            for variable, value in zip(self.sowvars.ravel(),self._solution[1]):
+                self.model.AddHint(variable,int(value))
+        
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = self.settings['maxTime'] if maxTime is None else maxTime
+        if threads is not None:
+            solver.parameters.num_workers = threads
+        start = time.perf_counter()
+        status = _solve(solver,self.model,hint=hint and self._solution is not None)
+        self.solveTime = time.perf_counter()-start
+        
+        self.status = solver.StatusName(status)
+        if status not in (cp_model.OPTIMAL,cp_model.FEASIBLE):
+            self.objective, self.bound, self.gap = None, None, None
+            logger.error(f'No solution found (status: {self.status}).')
+            return
+        self.objective = solver.ObjectiveValue()
+        self.bound = solver.BestObjectiveBound()
+        self.gap = (self.bound-self.objective)/max(abs(self.objective),1)
+        self._solution = ([solver.Value(variable) for variable in self.cropvars.ravel()],
+                          [solver.Value(variable) for variable in self.sowvars.ravel()])
+        
+        settings = self.settings
+        cropsDf = _resultFrame(solver,settings['crops'],settings['cropNames'],self.cropvars,self.sowvars,settings['waterconstraint'],
+                               settings['profit'],settings['cropCycle'],settings['yrsToProfit'])
+        cropsDf.attrs.update({'solveTime':self.solveTime,'status':self.status,'objective':self.objective,'bound':self.bound,'gap':self.gap})
+        return cropsDf
+
+def cropScenarios(scenarios,processes=None,threadsPerSolve=1,waterAvailable=100000,landAvailable=2000,noCrops=4,
+                  cropCycle=[3,4,5,4],waterUse=[300,200,350,400],cropProfit=[75000,60000,100000,150000],**moreOptions):
+    """
+    This function solves cropSchedule for many scenarios (for example water availability from climate projections, price sets or land limits) in parallel.
+    The model is built once from the base settings; per scenario only the water and land limits and the profits are changed.
+
+    Parameters
+    ----------
+    scenarios : Pandas DataFrame
+        One row per scenario (the index is used as scenario name), with one or more of the columns:
+            waterAvailable : int or list of 12 ints, the available water (per month)
+            landAvailable : int, the available area of land
+            cropProfit : list of ints (one per crop), the profit per unit of land area per harvest
+        Settings that are not in the DataFrame (or are NaN/None) are taken from the base settings.
+    processes : int, optional
+        The number of scenarios solved at the same time, each in its own process. The default is None (the number of CPUs).
+    threadsPerSolve : int, optional
+        The number of solver threads per scenario. The default is 1.
+    waterAvailable, landAvailable, noCrops, cropCycle, waterUse, cropProfit, **moreOptions :
+        The base settings, see cropSchedule. maxTime is the maximum calculation time per scenario.
+
+    Returns
+    -------
+    resultsDf : Pandas DataFrame
+        A tidy DataFrame with per scenario, crop and month the sowing (0/1) and hectare, and per scenario the objective (total profit) and solver status.
+
+    """
+    settings = _settings(waterAvailable,landAvailable,noCrops,cropCycle,waterUse,cropProfit,moreOptions)
+    if settings is None:
+        return
+    
+    # Per scenario the values to change in the template: water and land limit per month, and the profit weights.
+    changes = []
+    for name, row in scenarios.iterrows():
+        scenarioSettings = dict(waterAvailable=waterAvailable,landAvailable=landAvailable,cropProfit=cropProfit)
+        for key in scenarioSettings:
+            if key in row.index and np.all(pd.notna(row[key])):
+                scenarioSettings[key] = row[key]
+        scenario = _settings(noCrops=noCrops,cropCycle=cropCycle,waterUse=waterUse,moreOptions=moreOptions,**scenarioSettings)
+        if scenario is None:
+            logger.error(f'ERROR: settings of scenario {name} are not correct.')
+            return
+        changes.append((name,scenario['available_water_per_month'],[scenario['available_land']]*12,scenario['profitweight']))
+    
+    model, cropvars, sowvars, waterCons, landCons = _buildModel(settings['crops'],settings['cropCycle'],settings['waterconstraint'],
+                                                                settings['profitweight'],settings['available_water_per_month'],
+                                                                settings['available_land'],settings['offSeason'],100000)
+    template = {'model':str(model.Proto()),
+                'cropvars':[variable.Index() for variable in cropvars.ravel()],
+                'sowvars':[variable.Index() for variable in sowvars.ravel()],
+                'waterCons':[constraint.Index() for constraint in waterCons],
+                'landCons':[constraint.Index() for constraint in landCons],
+                'maxTime':settings['maxTime'],'threads':threadsPerSolve}
+    
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes,initializer=_initScenarioWorker,initargs=(template,)) as executor:
+        results = list(executor.map(_solveScenario,changes))
+    logger.info(f'Solved {len(results)} scenarios in {time.perf_counter()-start:.1f} s.')
+    
+    noMonths = 12
+    resultsDf = pd.DataFrame({'scenario':np.repeat([result[0] for result in results],noCrops*noMonths),
+                              'cropname':np.tile(np.repeat(np.array(settings['cropNames']),noMonths),len(results)),
+                              'monthInt':np.tile(np.arange(1,noMonths+1),noCrops*len(results)),
+                              'sowing':np.concatenate([result[4] for result in results]),
+                              'hectare':np.concatenate([result[3] for result in results]),
+                              'objective':np.repeat([result[2] for result in results],noCrops*noMonths),
+                              'status':np.repeat([result[1] for result in results],noCrops*noMonths)})
+    return resultsDf
+
+def cropScheduleFields(noYears=5,fieldAreas=[500,500,500,500],waterAvailable=100000,noCrops=4,
+                       cropCycle=[3,4,5,4],waterUse=[300,200,350,400],cropProfit=[75000,60000,100000,150000],
+                       formulation='time',symmetryBreaking=True,relativeGap=0.001,**moreOptions):
+    """
+    This function calculates the crop schedule with the most profit over a horizon of several years, for several fields (for example irrigation blocks).
+    Unlike cropSchedule, the schedule is not one repeating year: crops are sown and harvested within the horizon, and crops with a cycle longer than 12 months are modelled directly (no noYrs/yrsToProfit needed).
+
+    Parameters
+    ----------
+    noYears : int
+        The number of years of the horizon. The default is 5.
+    fieldAreas : list of ints
+        The area of land of each field. The default is 4 fields of 500.
+    waterAvailable : int or list of ints
+        The available water per month for all fields together: one value for all months, 12 values (repeated every year) or 12*noYears values. The default is 100000.
+    noCrops, cropCycle, waterUse, cropProfit :
+        See cropSchedule. cropCycle is the number of months from sowing to harvest (it can be more than 12); cropProfit is the profit per unit of land area per harvest.
+    formulation : str, optional
+        'time' (default): per field, crop and month the area sown is a variable; the area occupied in a month is the sum of the areas sown in the preceding cropcycle.
+        'interval': per field and crop, a number of sequential plantings, each with a start month and an area (CP-SAT interval variables with cumulative land and water constraints).
+        This model has far fewer variables for long horizons, but every field can only have one planting of a crop at the same time.
+        In practice the 'time' formulation proves (near-)optimality much faster; see benchmarks/bench_optimization.py.
+    symmetryBreaking : boolean, optional
+        If True (default), fields with the same area are ordered by their profit, so the solver does not need to try all permutations of identical fields.
+    relativeGap : float, optional
+        The solver stops when the profit is proven to be within this fraction of the optimum. The default is 0.001 (0.1%); use 0 to search for the proven optimum.
+    **moreOptions : Other options that can be set (ALL optional):
+        cropNames : see cropSchedule.
+        cropOffSeason : see cropSchedule; the months (1-12) apply to every year.
+        maxTime : the maximum calculation time of the solver, in seconds. If unused, this is set to 10 seconds.
+
+    Returns
+    -------
+    fieldsDf : Pandas DataFrame
+        Per field, crop and month (1 to 12*noYears) the area sown and the area occupied by the crop.
+
+    """
+    from ortools.sat.python import cp_model
+    if formulation not in ['time','interval']:
+        logger.error('ERROR: formulation '+str(formulation)+' unknown. Please select "time" or "interval".')
+        return
+    noMonths = 12*noYears
+    if np.ndim(waterAvailable) == 0:
+        waterAvailable = [waterAvailable]
+    water = np.array(waterAvailable,dtype=int)
+    if len(water) in [1,12]:
+        water = np.resize(water,noMonths)
+    elif len(water) != noMonths:
+        logger.error(f'ERROR: waterAvailable did not get 1, 12 or {noMonths} values.')
+        return
+    settings = _settings(100000,0,noCrops,cropCycle,waterUse,cropProfit,moreOptions)
+    if settings is None:
+        return
+    crops, cropNames, cycle = settings['crops'], settings['cropNames'], settings['cropCycle'].astype(int)
+    waterUse, profit = settings['waterconstraint'].astype(int), settings['profit'].astype(int)
+    offSeason = np.tile(settings['offSeason'],(1,noYears))
+    fieldAreas = np.array(fieldAreas,dtype=int)
+    noFields = len(fieldAreas)
+    
+    # Possible sowing months per crop: the crop must be harvested within the horizon and cannot grow in its off-season months.
+    starts = [[t for t in range(noMonths-cycle[c]+1) if not offSeason[c,t:t+cycle[c]].any()] for c in range(noCrops)]
+    # Tight upper bound for the area of a crop sown in month t: the field area, and the water available during the crop cycle.
+    def areaBound(f,c,t):
+        if waterUse[c] <= 0:
+            return int(fieldAreas[f])
+        return int(min(fieldAreas[f],water[t:t+cycle[c]].min()//waterUse[c]))
+    
+    buildStart = time.perf_counter()
+    with span('cpsat.build',formulation=formulation,fields=noFields,months=noMonths):
+        model = cp_model.CpModel()
+        if formulation == 'time':
+            plantings, fieldProfit = _buildFieldsTime(model,noMonths,fieldAreas,water,cycle,waterUse,profit,starts,areaBound)
+        else:
+            plantings, fieldProfit = _buildFieldsInterval(model,noMonths,fieldAreas,water,cycle,waterUse,profit,starts,areaBound)
+        if symmetryBreaking:
+            # Fields are identical when their areas (and so the limits of their plantings) are equal, also when they are not next to each other.
+            # Ordering each field after the previous identical one orders every pair of the group.
+            for area in np.unique(fieldAreas):
+                group = np.flatnonzero(fieldAreas == area)
+                for f, g in zip(group[:-1],group[1:]):
+                    model.Add(fieldProfit[f] >= fieldProfit[g])
+        model.Maximize(sum(fieldProfit))
+    buildTime = time.perf_counter()-buildStart
+    
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = settings['maxTime']
+    solver.parameters.relative_gap_limit = relativeGap
+    solveStart = time.perf_counter()
+    status = _solve(solver,model)
+    solveTime = time.perf_counter()-solveStart
+    logger.info(f'\nModel built in {buildTime:.3f} s, solved in {solveTime:.3f} s (status: {solver.StatusName(status)}).')
+    if status not in (cp_model.OPTIMAL,cp_model.FEASIBLE):
+        return
+    
+    # Area sown per (field,crop,month), and the area occupied following from the crop cycles.
+    sownArea = np.zeros((noFields,noCrops,noMonths))
+    for f, c, start, area, present in plantings:
+        if present is None or solver.BooleanValue(present):
+            sownArea[f,c,solver.Value(start)] += solver.Value(area)
+    occupied = np.zeros_like(sownArea)
+    for c in range(noCrops):
+        for i in range(cycle[c]):
+            occupied[:,c,i:] += sownArea[:,c,:noMonths-i]
+    
+    field, crop, month = [a.ravel() for a in np.meshgrid(np.arange(1,noFields+1),np.arange(noCrops),np.arange(1,noMonths+1),indexing='ij')]
+    fieldsDf = pd.DataFrame({'field':field,'crop':crops[crop],'cropname':np.array(cropNames)[crop],'month':month,
+                             'year':(month-1)//12+1,'sown':sownArea.ravel(),'occupied':occupied.ravel()})
+    fieldsDf.attrs.update({'buildTime':buildTime,'solveTime':solveTime,'status':solver.StatusName(status),
+                           'objective':solver.ObjectiveValue(),'bound':solver.BestObjectiveBound()})
+    logger.info('Total profit over '+str(noYears)+' years: '+str(int(solver.ObjectiveValue()/1000000))+' million.')
+    return fieldsDf
+
+def _buildFieldsTime(model,noMonths,fieldAreas,water,cycle,waterUse,profit,starts,areaBound):
+    # Time-indexed formulation: an integer area variable per field, crop and possible sowing month.
+    # Returns the plantings as (field,crop,sowing month,area,presence) and the profit expression per field.
+    from ortools.sat.python import cp_model
+    noFields, noCrops = len(fieldAreas), len(cycle)
+    plantings = []
+    occupation = [[[] for m in range(noMonths)] for f in range(noFields)]
+    waterMonth = [[] for m in range(noMonths)]
+    fieldProfit = []
+    for f in range(noFields):
+        variables, weights = [], []
+        for c in range(noCrops):
+            for t in starts[c]:
+                bound = areaBound(f,c,t)
+                if bound <= 0:
+                    continue
+                area = model.NewIntVar(0,bound,f'f{f+1}c{c+1}t{t+1}')
+                plantings.append((f,c,t,area,None))
+                variables.append(area)
+                weights.append(int(profit[c]))
+                for m in range(t,t+cycle[c]):
+                    occupation[f][m].append(area)
+                    waterMonth[m].append((area,int(waterUse[c])))
+        fieldProfit.append(cp_model.LinearExpr.WeightedSum(variables,weights))
+        for m in range(noMonths):
+            if occupation[f][m]:
+                model.Add(cp_model.LinearExpr.Sum(occupation[f][m]) <= int(fieldAreas[f]))
+    for m in range(noMonths):
+        if waterMonth[m]:
+            model.Add(cp_model.LinearExpr.WeightedSum([v for v,w in waterMonth[m]],[w for v,w in waterMonth[m]]) <= int(water[m]))
+    return plantings, fieldProfit
+
+def _buildFieldsInterval(model,noMonths,fieldAreas,water,cycle,waterUse,profit,starts,areaBound):
+    # Interval formulation: per field and crop up to noMonths//cycle sequential plantings, each an optional
+    # interval with a start month and an area. Land per field and water are cumulative constraints.
+    from ortools.sat.python import cp_model
+    noFields, noCrops = len(fieldAreas), len(cycle)
+    plantings = []
+    waterIntervals, waterDemands, waterEnergy = [], [], []
+    fieldProfit = []
+    for f in range(noFields):
+        intervals, areas, energy, variables, weights = [], [], [], [], []
+        for c in range(noCrops):
+            if len(starts[c]) == 0:
+                continue
+            bound = max(areaBound(f,c,t) for t in starts[c])
+            if bound <= 0:
+                continue
+            previous = None
+            for k in range(noMonths//cycle[c]):
+                name = f'f{f+1}c{c+1}k{k+1}'
+                present = model.NewBoolVar(name+'present')
+                start = model.NewIntVarFromDomain(cp_model.Domain.FromValues(starts[c]),name+'start')
+                area = model.NewIntVar(0,bound,name+'area')
+                model.Add(area >= 1).OnlyEnforceIf(present)
+                model.Add(area == 0).OnlyEnforceIf(present.Not())
+                interval = model.NewOptionalFixedSizeIntervalVar(start,int(cycle[c]),present,name)
+                # Not planting at all is always feasible: a first solution for the solver to start from
+                model.AddHint(present,False)
+                model.AddHint(area,0)
+                if previous is not None:
+                    # Plantings are used in order, one after the other
+                    model.AddImplication(present,previous[0])
+                    model.Add(start >= previous[1]+int(cycle[c])).OnlyEnforceIf(present)
+                previous = (present,start)
+                plantings.append((f,c,start,area,present))
+                intervals.append(interval)
+                areas.append(area)
+                energy.append(int(cycle[c]))
+                variables.append(area)
+                weights.append(int(profit[c]))
+                waterIntervals.append(interval)
+                waterDemands.append(int(waterUse[c])*area)
+                waterEnergy.append(int(waterUse[c])*int(cycle[c])*area)
+        model.AddCumulative(intervals,areas,int(fieldAreas[f]))
+        # Redundant energy constraint (area*months of all plantings within the field capacity), for a stronger bound
+        model.Add(cp_model.LinearExpr.WeightedSum(areas,energy) <= int(fieldAreas[f])*noMonths)
+        fieldProfit.append(cp_model.LinearExpr.WeightedSum(variables,weights))
+    # Months with less water than the maximum get a fixed interval using the difference.
+    maxWater = int(water.max())
+    for m in range(noMonths):
+        if water[m] < maxWater:
+            waterIntervals.append(model.NewFixedSizeIntervalVar(m,1,f'water{m+1}'))
+            waterDemands.append(maxWater-int(water[m]))
+    model.AddCumulative(waterIntervals,waterDemands,maxWater)
+    model.Add(sum(waterEnergy) <= int(water.sum()))
+    return plantings, fieldProfit
+
+_scenarioTemplate = {}
+
+def _initScenarioWorker(template):
+    # Parse the model template once per worker process.
+    from ortools.sat.python import cp_model
+    model = cp_model.CpModel()
+    model.Proto().parse_text_format(template['model'])
+    _scenarioTemplate.update(template)
+    _scenarioTemplate['model'] = model
+
+def _solveScenario(change):
+    from ortools.sat.python import cp_model
+    name, water, land, profitweight = change
+    model = _scenarioTemplate['model'].Clone()
+    for index, limit in zip(_scenarioTemplate['waterCons'],water):
+        _setUpperBound(model,index,limit)
+    for index, limit in zip(_scenarioTemplate['landCons'],land):
+        _setUpperBound(model,index,limit)
+    cropvars = [model.GetIntVarFromProtoIndex(index) for index in _scenarioTemplate['cropvars']]
+    model.Maximize(cp_model.LinearExpr.WeightedSum(cropvars,[int(p) for p in np.repeat(profitweight,12)]))
+    
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = _scenarioTemplate['maxTime']
+    solver.parameters.num_workers = _scenarioTemplate['threads']
+    status = solver.Solve(model)
+    if status not in (cp_model.OPTIMAL,cp_model.FEASIBLE):
+        noValues = np.full(len(cropvars),np.nan)
+        return name, solver.StatusName(status), np.nan, noValues, noValues
+    hectare = np.array([solver.Value(variable) for variable in cropvars],dtype=float)
+    sowing = np.array([solver.Value(model.GetBoolVarFromProtoIndex(index)) for index in _scenarioTemplate['sowvars']],dtype=float)
+    return name, solver.StatusName(status), solver.ObjectiveValue(), hectare, sowing
+
+def _solve(solver,model,**args):
+    # solver.Solve(model) in a 'cpsat.solve' span, with the solver statistics.
+    with span('cpsat.solve',**args) as solveSpan:
+        status = solver.Solve(model)
+        solveSpan.set(status=solver.StatusName(status),objective=solver.ObjectiveValue(),bound=solver.BestObjectiveBound(),
+                      conflicts=solver.NumConflicts(),branches=solver.NumBranches(),wallTime=solver.WallTime())
+    return status
+
+def _setUpperBound(model,constraintIndex,upperBound):
+    # Change the upper bound of a linear constraint (<= upperBound) in the model proto.
+    domain = model.Proto().constraints[constraintIndex].linear.domain
+    bounds = list(domain)
+    bounds[-1] = int(upperBound)
+    domain.clear()
+    domain.extend(bounds)
+
+def _settings(waterAvailable,landAvailable,noCrops,cropCycle,waterUse,cropProfit,moreOptions):
+    # Check and convert the settings of cropSchedule. Returns a dict with the settings, or None if a setting is not correct.
+    if np.ndim(waterAvailable) == 0:    
         waterAvailable = [waterAvailable]
     if len(waterAvailable) == 1:
         waterAvailable=list(waterAvailable)*12
     available_water_per_month = np.array(waterAvailable)
     if _lenCheck(available_water_per_month,'waterAvailable'):
-        return
+        return None
     
     available_land = landAvailable
     
@@ -79,7 +558,7 @@ def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
     else:
         cropNames = moreOptions['cropNames']
         if _lenCheck(cropNames,'cropNames','perCrop',noCrops):
-            return
+            return None
         else:
             cropNames = cropNames
     
@@ -87,20 +566,20 @@ def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
     
     cropCycle = np.array(cropCycle)
     if _lenCheck(cropCycle,'cropCycle','perCrop',noCrops):
-        return
+        return None
     
     waterconstraint = np.array(waterUse)
     if _lenCheck(waterconstraint,'waterUse','perCrop',noCrops):
-        return
+        return None
     
     profit = np.array(cropProfit)
     if _lenCheck(profit,'cropProfit','perCrop',noCrops):
-        return
+        return None
     
     moreOptions_options = ['cropNames','cropOffSeason','noYrs','yrsToProfit','maxTime']
     for key in moreOptions.keys():
         if key not in moreOptions_options:
-            print(f'WARNING: The argument {key} is not recognized. The only additional arguments are {str(moreOptions_options)}.')
+            logger.warning(f'WARNING: The argument {key} is not recognized. The only additional arguments are {str(moreOptions_options)}.')
     
     if 'cropOffSeason' not in moreOptions.keys():
         cropOffSeason = {}
@@ -114,10 +593,10 @@ def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
             if newkey in crops:
                 monthsOff = cropOffSeason[key]
                 newDict[newkey] = monthsOff
-                print(f'Crop {cropNdict[newkey]} will not be grown in months {",".join(str(i) for i in monthsOff)}.')
+                logger.info(f'Crop {cropNdict[newkey]} will not be grown in months {",".join(str(i) for i in monthsOff)}.')
             else:
-                print(f'ERROR: Given cropOffSeason key \'{key}\' not correct. Please give a number representing the crop you want to exclude for certain months.')
-                return
+                logger.error(f'ERROR: Given cropOffSeason key \'{key}\' not correct. Please give a number representing the crop you want to exclude for certain months.')
+                return None
         cropOffSeason = newDict
     
     # Settings for crops that take more than a year
@@ -132,7 +611,7 @@ def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
     else:
         yrsToProfit = np.array(moreOptions['yrsToProfit'])
         if _lenCheck(yrsToProfit,'yrsToProfit','perCrop',noCrops):
-            return
+            return None
     
     # Solver settings
     if 'maxTime' not in moreOptions.keys():
@@ -140,133 +619,93 @@ def cropSchedule(waterAvailable=100000,landAvailable=2000,noCrops=4,
     else:
         maxTime = moreOptions['maxTime']
        
-    ######################### FROM HERE: DO NOT CHANGE ############################
+    no_months = 12
+    
+    # Months in which a crop cannot grow, as (crop,month) boolean array
+    offSeason = np.zeros((noCrops,no_months),dtype=bool)
+    for crop, monthsOff in cropOffSeason.items():
+        offSeason[list(crops).index(crop),np.array(monthsOff).astype(int)-1] = True
     
-    # from ortools.sat.python import cp_model
+    ### to take crop cycles into account (per cycle, only one yield), //cropcycle
+    profitweight = np.array(profit)*(noYrs-np.array(yrsToProfit))//cropCycle
+    
+    return {'available_water_per_month':available_water_per_month,'available_land':available_land,'crops':crops,
+            'cropNames':cropNames,'cropCycle':cropCycle,'waterconstraint':waterconstraint,'profit':profit,
+            'offSeason':offSeason,'noYrs':noYrs,'yrsToProfit':yrsToProfit,'profitweight':profitweight,'maxTime':maxTime}
+
+def _buildModel(crops,cropCycle,waterconstraint,profitweight,available_water_per_month,available_land,offSeason,var_upper_bound):
+    # Build the CP-SAT model, with the variables in (crop,month) object arrays. Returns the model, the
+    # variables and the water and land constraints (one per month), so their bounds can be changed later.
+    from ortools.sat.python import cp_model
     model = cp_model.CpModel()
+    noCrops, no_months = offSeason.shape
     
     # Create the variables
-    no_months = 12
+    cropvars = np.empty((noCrops,no_months),dtype=object)
+    sowvars = np.empty((noCrops,no_months),dtype=object)
+    for c, crop in enumerate(crops):
+        for m in range(no_months):
+            cropvars[c,m] = model.NewIntVar(0,var_upper_bound,crop+'m'+str(m+1))
+            sowvars[c,m] = model.NewBoolVar(crop+'m'+str(m+1)+'sow')
     
-    var_upper_bound = 100000
-    months = str(list(range(1,no_months+1)))[1:-1].split(', ')
-    cropvars = {}
-    sowvars = {}
-    croplist = []
-    monthlist = []
-    for crop in crops:
-        for month in months:
-            cropvar = crop+'m'+month
-            sowvar = crop+'m'+month+'sow'
-            cropvars[cropvar] = model.NewIntVar(0, var_upper_bound ,cropvar)
-            sowvars[cropvar] = model.NewBoolVar(sowvar)
-            croplist.append(crop)
-            monthlist.append('m'+month)
-    
-    cropsDf = pd.DataFrame({'names':cropvars.keys(),'variables':cropvars.values()}).set_index('names')
-    
-    cropsDf['crop'] = croplist
-    cropsDf['cropname'] = cropsDf.crop.replace(crops,cropNames)
-    cropsDf['month'] = monthlist
-    cropsDf['waterconstraint'] = cropsDf.crop.replace(crops,waterconstraint)
-    cropsDf['profit'] = cropsDf.crop.replace(crops,profit)
-    cropsDf['cropcycle'] = cropsDf.crop.replace(crops,cropCycle)
-    cropsDf['monthInt'] = cropsDf.month.str.slice(1).astype(int)
-    cropsDf['yrsNoProfit'] = cropsDf.crop.replace(crops,yrsToProfit)
-    
-    # Create water constraints
-    for i, month in enumerate(months):
-        monthname = 'm'+month
-        multiply = cropsDf.variables*cropsDf.waterconstraint
-        monthmultiply = multiply[cropsDf.index.str.slice(2)==monthname]
-        model.Add(sum(monthmultiply)<= available_water_per_month[i])
-    
-    # Create land constraints
-    for month in months:
-        monthname = 'm'+month
-        monthvars = cropsDf.variables[cropsDf.month==monthname]
-        model.Add(monthvars.sum() <= available_land)    
+    # Create water and land constraints
+    waterCons = [model.Add(cp_model.LinearExpr.WeightedSum(list(cropvars[:,m]),[int(w) for w in waterconstraint])
+                           <= int(available_water_per_month[m])) for m in range(no_months)]
+    landCons = [model.Add(cp_model.LinearExpr.Sum(list(cropvars[:,m])) <= int(available_land)) for m in range(no_months)]
     
     # Certain crops cannot grow during certain months (cropOffSeason)
-    if len(cropOffSeason)>0:
-        for crop in cropOffSeason.keys():
-            yrmonths = np.array(cropOffSeason[crop])
-            monthsOff = yrmonths.astype(int)
-            for month in monthsOff:
-                variable = cropsDf.variables[(cropsDf.monthInt==month)&(cropsDf.crop==crop)][0]
-                model.Add(variable==0)
-    
-    # Sowing constraints
-    #### Depending on cropcycle: if crop is sown (sowvar[crop]==True), the following cropvars should be equal
-    #### Also, then all next sowvar[crop] should be false
-    for cropvar,sowvar in sowvars.items():          # Take all cropvars and sowvars one by one
-        crop = cropvar[:cropvar.find('m')]                          # Take cropname
-        cycle = cropCycle[list(crops).index(crop)]                     # Take cycle that matches cropname
-        month = cropvar[cropvar.find('m'):]                         # Take month from cropvar
-        monthno = int(month[1:])                    # Take month as integer
-        for i in range(monthno+1,monthno+cycle):    # Go over all months succeeding the cropvar month 
-            if i > no_months:                             # Break if outside of 12 month range
-                i -= 12
-            varname = crop+'m'+str(i)               # Create cropvar names succeeding the cropvar 
-            model.Add(cropvars[cropvar]==cropvars[varname]).OnlyEnforceIf(sowvar)   # Succeeding months must be                                                                     
-                                                                                    # equal to cropvar month when
-                                                                                    # sowvar of original month 
-                                                                                    # is true.
-            model.Add(sowvars[varname]==0).OnlyEnforceIf(sowvar)    # Succeeding sowvars must be False because 
-                                                                    # you cannot sow again on same ground until
-                                                                    # cropcycle is finished.
-    
-    #### A month must be zero, if within it's preceding cropcycle all sowvariables are zero or own sowvar is zero
-    for cropvar, sowvar in sowvars.items():         # Go over all cropvars
-        crop = cropvar[:cropvar.find('m')]                           # Take cropname
-        cycle = cropCycle[list(crops).index(crop)]                      # Take cycle that matches cropname
-        month = cropvar[cropvar.find('m'):]                         # Take month from cropvar
-        monthno = int(month[1:])                    # Take month as integer
-        
-        constraint = f'model.Add(cropvars[\'{cropvar}\']==0)'       # Start basic constraint string
-    
-        for i in list(range(monthno-cycle+1, monthno+1))[::-1]:   # For the length of cropcycle, go over all preceding cropvars (limited by size of year) 
-            if i <= 0: 
-                i += 12
-            varname = crop + 'm' + str(i)
-            constraint = constraint + f'.OnlyEnforceIf(sowvars[\'{varname}\'].Not())'   
-                    # Add OnlyEnforceIf(sowvars[preceding_cropvar].Not()) to constraint string
-        exec(constraint)    # Execute constraint string
+    for c, m in zip(*np.nonzero(offSeason)):
+        model.Add(cropvars[c,m]==0)
     
-    #### A month cannot be zero, if the corresponding sowvariable is one
-    for cropvar, sowvar in sowvars.items():
-        model.Add(cropvars[cropvar]>0).OnlyEnforceIf(sowvar)
+    for c in range(noCrops):
+        cycle = int(cropCycle[c])
+        for m in range(no_months):
+            sow = sowvars[c,m]
+            # Sowing constraints: if crop is sown in month m, the cropvars of the following months of
+            # the cropcycle are equal to it and their sowvars are False (no sowing again on the same ground).
+            for i in range(1,cycle):
+                following = (m+i)%no_months
+                model.Add(cropvars[c,m]==cropvars[c,following]).OnlyEnforceIf(sow)
+                model.Add(sowvars[c,following]==0).OnlyEnforceIf(sow)
+            # A month must be zero, if within its preceding cropcycle all sowvariables are zero (including its own)
+            model.Add(cropvars[c,m]==0).OnlyEnforceIf([sowvars[c,(m-i)%no_months].Not() for i in range(cycle)])
+            # A month cannot be zero, if the corresponding sowvariable is one
+            model.Add(cropvars[c,m]>0).OnlyEnforceIf(sow)
     
-    # solve it
-    ### to take crop cycles into account (per cycle, only one yield), //cropcycle
-    profitweight = cropsDf.profit*(noYrs-cropsDf.yrsNoProfit)//cropsDf.cropcycle
-    model.Maximize(sum(cropsDf.variables*profitweight))
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = maxTime
+    model.Maximize(cp_model.LinearExpr.WeightedSum(list(cropvars.ravel()),[int(p) for p in np.repeat(profitweight,no_months)]))
+    return model, cropvars, sowvars, waterCons, landCons
 
-    status = solver.Solve(model)
-    
-    for name,variable in zip(cropsDf.index,cropsDf.variables):
-        cropsDf.loc[name,'hectare'] = solver.Value(variable)
-        cropsDf.loc[name,'result'] = str((solver.Value(sowvars[name]),solver.Value(variable)))
-    
-    cropsResult = cropsDf.pivot(index='monthInt',columns='cropname',values='result').get(cropNames)
-    objVal = solver.ObjectiveValue()/1000000
-    print('\nTotal profit: '+str(int(objVal))+' million.')
-    print('Monthly per crop: (sowing,hectare), with sowing 0 (no) or 1 (yes).\n',cropsResult)
-    
+def _resultFrame(solver,crops,cropNames,cropvars,sowvars,waterconstraint,profit,cropCycle,yrsToProfit):
+    # Summary of settings and results for all crop/month combinations (crop by crop, month 1 to 12).
+    noCrops, no_months = cropvars.shape
+    monthInt = np.tile(np.arange(1,no_months+1),noCrops)
+    crop = np.repeat(crops,no_months)
+    cropsDf = pd.DataFrame({'variables':cropvars.ravel(),
+                            'crop':crop,
+                            'cropname':np.repeat(np.array(cropNames),no_months),
+                            'month':['m'+str(m) for m in monthInt],
+                            'waterconstraint':np.repeat(waterconstraint,no_months),
+                            'profit':np.repeat(profit,no_months),
+                            'cropcycle':np.repeat(cropCycle,no_months),
+                            'monthInt':monthInt,
+                            'yrsNoProfit':np.repeat(yrsToProfit,no_months)},
+                           index=pd.Index([c+'m'+str(m) for c,m in zip(crop,monthInt)],name='names'))
+    hectare = np.array([solver.Value(variable) for variable in cropvars.ravel()])
+    sowing = np.array([solver.Value(variable) for variable in sowvars.ravel()])
+    cropsDf['hectare'] = hectare.astype(float)
+    cropsDf['result'] = [str((int(s),int(h))) for s,h in zip(sowing,hectare)]
     return cropsDf
 
 def _lenCheck(collection,name,colType = 'monthly',noCrops=None):
     if colType == 'monthly':
         if len(collection)!=12:
-            print(f'ERROR: {name} did not get a collection of 12 values. Please provide 12 values, representing the monthly value.')
+            logger.error(f'ERROR: {name} did not get a collection of 12 values. Please provide 12 values, representing the monthly value.')
             return True
         else:
             return False
     if colType == 'perCrop':
         if len(collection)!=noCrops:
-            print(f'ERROR: {name} did not get a collection of with the same number of values as the number of crops. Please provide '+str(noCrops)+' values, representing the different crops.')
+            logger.error(f'ERROR: {name} did not get a collection of with the same number of values as the number of crops. Please provide '+str(noCrops)+' values, representing the different crops.')
             return True
         else:
             return False
\ No newline at end of file
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+The daily run as a pipeline: CHIRPS files are downloaded, ingested and extracted for stations by stages that work at the same time.
+
+The stages are connected by bounded queues, so a slow stage makes the stages before it wait (backpressure) instead of filling memory.
+Every file that is completely handled is written to a checkpoint file; a new run (after a crash, or the next day) only handles the other files.
+"""
+
+import fnmatch
+import os
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from .ftpChirps import CHIRPS_HOST, _FtpPool, _downloadRetry
+from .instrumentation import logger, span
+from . import mixedFileTypes
+
+_DONE = object()
+
+def runPipeline(directory,coords,output,pattern='*',filenames=None,local_folder=None,store=None,method='closest',names=None,
+                data_var='precip',bbox=None,connections=4,queueSize=8,checkpoint=None,stationdata=None,resample='m',
+                stats=False,host=CHIRPS_HOST,port=21,cache=None):
+    """
+    This function runs the daily CHIRPS workflow (list, download, ingest, extract stations, align) as a pipeline.
+    Files are downloaded with several connections; meanwhile downloaded files are opened (decompressed, clipped to bbox) and, if a store is given,
+    appended to the Zarr store, and meanwhile the stations are extracted from opened files and written to output.
+    So the network, the disk and the CPU work at the same time, instead of one after another.
+    If a stage fails unexpectedly, all stages are stopped and its error is raised; the files handled until then are kept in output and the checkpoint.
+
+    Parameters
+    ----------
+    directory : str
+        The directory on the FTP server, for example '/pub/org/chg/products/CHIRPS-2.0/africa_daily/tifs/p05/2020/'.
+    coords : array-like of shape (N,2), or Pandas DataFrame
+        The (lat,lon) coordinates of the stations, see ncDataSelectMulti.
+    output : str
+        The CSV file that collects the station series (time as first column, one column per station). Rows of new files are appended to it.
+    pattern : str, optional
+        Only used if filenames is None. A filename pattern with wildcards, for example 'chirps-v2.0.2020.*.tif.gz'. The default is '*'.
+    filenames : list of str, optional
+        The files to handle. If None (default), all files in directory matching pattern.
+    local_folder : str, optional
+        The folder to save the downloaded files in. The default is None (current working directory).
+    store : str, optional
+        If given, the opened files are also appended to this Zarr store, see ingestChirps. The default is None (no store).
+    method : str, optional
+        One of {'m1','closest','m2','average','m3','idw'}. The default is 'closest'. See ncDataSelect.
+    names : list of str, optional
+        Names of the stations, see ncDataSelectMulti.
+    data_var : str, optional
+        The data variable of the files. The default is 'precip'.
+    bbox : 4-sized collection (minLat,maxLat,minLon,maxLon), optional
+        Only keep this area of the files (and store). The default is None (the whole grid).
+    connections : int, optional
+        The number of FTP connections (and downloads) used in parallel. The default is 4.
+    queueSize : int, optional
+        The number of files that can wait between two stages. The default is 8.
+    checkpoint : str, optional
+        The file listing the files that are completely handled. The default is None (output with '.done' added).
+    stationdata : Pandas DataFrame, optional
+        If given, the station series are aligned with this station data by alignStationsNc. The default is None.
+    resample : str, optional
+        Only used with stationdata. The time step of alignStationsNc. The default is 'm'.
+    stats : boolean, optional
+        If True, the throughput of every stage is returned as well. The default is False.
+    host : str, optional
+        The FTP server. The default is the CHIRPS server.
+    port : int, optional
+        The port of the FTP server. The default is 21.
+    cache : FtpListingCache, optional
+        If given, the directory listing is taken from the cache. The default is None.
+
+    Returns
+    -------
+    dfOut : Pandas DataFrame
+        All station series in output (also those of earlier runs), indexed by time, with one column per station.
+        With stationdata, the tidy table of alignStationsNc instead.
+    statsDf : Pandas DataFrame
+        Only if stats=True. Per stage (download, ingest, extract): the number of workers, files, MB, seconds busy,
+        utilization (busy time as fraction of the run time of its workers), files per second while busy (per worker), and the seconds
+        spent waiting for input (starved) and for room in the next queue (blocked). The stage with the highest utilization is the bottleneck.
+
+    """
+    if local_folder == None:
+        local_folder = os.getcwd()
+    if checkpoint is None:
+        checkpoint = output+'.done'
+    completed = _readCheckpoint(checkpoint)
+
+    pool = _FtpPool(directory,connections,host,port)
+    try:
+        if filenames is None and cache is not None:
+            filenames = fnmatch.filter(cache.listDirectory(directory),pattern)
+        elif filenames is None:
+            with pool.connection() as ftp:
+                filenames = fnmatch.filter(ftp.nlst(),pattern)
+        todo = sorted(filename for filename in filenames if filename not in completed)
+        logger.info('Starting the pipeline for '+str(len(todo))+' files ('+str(len(filenames)-len(todo))+' files were handled before). This might take a while...')
+        stages = _runStages(todo,pool,local_folder,output,checkpoint,store,coords,method,names,data_var,bbox,connections,queueSize)
+    finally:
+        pool.close()
+
+    statsDf = _stageStats(stages)
+    if len(todo) > 0:
+        logger.info('Pipeline finished: '+str(stages['extract'].items)+' of '+str(len(todo))+' files handled in '+f'{statsDf.attrs["seconds"]:.1f}'+' s. '
+                    'Bottleneck: '+statsDf.utilization.idxmax()+' (utilization '+f'{statsDf.utilization.max():.0%}'+').')
+    if not os.path.exists(output):
+        logger.error('ERROR: no station data was extracted.')
+        return (None, statsDf) if stats else None
+
+    dfOut = pd.read_csv(output,index_col=0,parse_dates=True)
+    # A crash between writing rows and the checkpoint makes a file handled twice; its rows are kept once.
+    dfOut = dfOut[~dfOut.index.duplicated(keep='last')].sort_index()
+    if stationdata is not None:
+        dfOut = mixedFileTypes.alignStationsNc(stationdata,dfOut,resample)
+    if stats:
+        return dfOut, statsDf
+    return dfOut
+
+class _Stage:
+    # Counters of one stage; busy, starved and blocked are summed over its workers (seconds).
+    def __init__(self,name,workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self,**amounts):
+        with self._lock:
+            for key, value in amounts.items():
+                setattr(self,key,getattr(self,key)+value)
+
+    def get(self,inbox,stop):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if stop.is_set():
+                    item = _DONE
+                    break
+        self.add(starved=time.perf_counter()-start)
+        return item
+
+    def put(self,outbox,item,stop):
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                outbox.put(item,timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.add(blocked=time.perf_counter()-start)
+
+def _runStages(todo,pool,local_folder,output,checkpoint,store,coords,method,names,data_var,bbox,connections,queueSize):
+    """Run the download, ingest and extract stages on the files todo; returns the stages with their counters, or raises the first error of a stage."""
+    stages = {'download':_Stage('download',connections),'ingest':_Stage('ingest',1),'extract':_Stage('extract',1)}
+    work = queue.Queue()
+    for filename in todo:
+        work.put(filename)
+    downloaded = queue.Queue(queueSize)
+    opened = queue.Queue(queueSize)
+    stop = threading.Event()
+
+    def download():
+        stage = stages['download']
+        while not stop.is_set():
+            try:
+                filename = work.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            local_filename = os.path.join(local_folder,filename)
+            with span('pipeline.download',file=filename) as current:
+                nbytes = _downloadRetry(pool,filename,local_filename)
+                current.set(bytes=nbytes or 0)
+            stage.add(busy=time.perf_counter()-start,items=nbytes is not None,bytes=nbytes or 0)
+            # Failed files are passed on as well (without path), so the ingest stage knows it should not wait for them.
+            stage.put(downloaded,(filename,None if nbytes is None else local_filename),stop)
+
+    def ingest():
+        stage = stages['ingest']
+        spaceChunk = 25
+        if store is not None:
+            length, lastTime, timeChunk, spaceChunk = mixedFileTypes._storeState(store,data_var,365,spaceChunk)
+        # Downloads finish in any order; files are ingested in the order of todo, so the store only grows at its end.
+        pending, nextFile, finished = {}, 0, False
+        while not finished:
+            item = stage.get(downloaded,stop)
+            if item is _DONE:
+                break
+            pending[item[0]] = item[1]
+            # Files that are waiting already are ingested together (about one day per file, up to the next chunk of the store),
+            # so a busy pipeline appends fewer and larger batches.
+            room = timeChunk-length%timeChunk if store is not None else queueSize
+            while len(pending) < room:
+                try:
+                    item = downloaded.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                pending[item[0]] = item[1]
+            ready = []
+            while nextFile < len(todo) and todo[nextFile] in pending:
+                path = pending.pop(todo[nextFile])
+                if path is not None:
+                    ready.append((todo[nextFile],path))
+                nextFile += 1
+            if len(ready) == 0:
+                continue
+
+            start = time.perf_counter()
+            batch = []
+            for filename, path in ready:
+                try:
+                    with span('pipeline.ingest',file=filename):
+                        # Without spaceChunk the file is loaded and closed in this thread.
+                        batch.append((filename,mixedFileTypes._openChirpsFile(path,data_var,bbox,None)))
+                except (OSError,ValueError,KeyError) as error:
+                    logger.error('Ingest of '+filename+' did not succeed: '+str(error))
+            if store is not None:
+                new = [dataset if lastTime is None else dataset.sel(time=dataset['time'] > lastTime) for filename, dataset in batch]
+                new = [dataset for dataset in new if dataset.sizes['time'] > 0]
+                if new:
+                    length, lastTime = mixedFileTypes._appendBatch(new,store,data_var,length,timeChunk,spaceChunk)
+            stage.add(busy=time.perf_counter()-start,items=len(batch))
+            for item in batch:
+                stage.put(opened,item,stop)
+        stage.put(opened,_DONE,stop)
+
+    def extract():
+        stage = stages['extract']
+        index = None
+        finished = False
+        while not finished:
+            item = stage.get(opened,stop)
+            if item is _DONE:
+                return
+            # Files that are waiting already are saved together: one write to output and to the checkpoint for all of them.
+            batch = [item]
+            while len(batch) < queueSize:
+                try:
+                    item = opened.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+            start = time.perf_counter()
+            extracted = []
+            for filename, dataset in batch:
+                with span('pipeline.extract',file=filename):
+                    if index is None or not index.matches(dataset):
+                        try:
+                            index = mixedFileTypes.StationGridIndex.fromDataset(dataset,coords,method,names)
+                        except ValueError as error:
+                            logger.error('ERROR: '+str(error)+' The pipeline is stopped.')
+                            stop.set()
+                            return
+                    extracted.append(index.apply(dataset,data_var))
+            # The rows are saved before the files are marked as completed, so no completed file misses its rows.
+            pd.concat(extracted).to_csv(output,mode='a',header=not os.path.exists(output))
+            _markCompleted(checkpoint,[filename for filename, dataset in batch])
+            stage.add(busy=time.perf_counter()-start,items=len(batch))
+
+    errors = {}
+    def guarded(name,target):
+        # An unexpected error in one stage stops the others, instead of leaving them waiting for each other.
+        # The first error of each stage is kept and raised after all threads are finished.
+        def run():
+            try:
+                target()
+            except BaseException as error:
+                errors.setdefault(name,error)
+                stop.set()
+        return threading.Thread(target=run)
+
+    start = time.perf_counter()
+    threads = [guarded('download',download) for i in range(connections)]
+    threads += [guarded('ingest',ingest),guarded('extract',extract)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads[:connections]:
+            thread.join()
+        stages['download'].put(downloaded,_DONE,stop)
+        for thread in threads[connections:]:
+            thread.join()
+    except BaseException:
+        stop.set()
+        raise
+    if errors:
+        for name, error in errors.items():
+            logger.error('ERROR: the '+name+' stage failed: '+repr(error)+'. The pipeline is stopped.')
+        raise next(iter(errors.values()))
+    for stage in stages.values():
+        stage.seconds = time.perf_counter()-start
+    return stages
+
+def _stageStats(stages):
+    rows = {}
+    for name, stage in stages.items():
+        rows[name] = {'workers':stage.workers,'files':stage.items,'MB':stage.bytes/2**20,'busy':stage.busy,
+                      'utilization':stage.busy/max(stage.seconds*stage.workers,1e-9),
+                      'filesPerSecond':stage.items/stage.busy if stage.busy > 0 else float('nan'),
+                      'starved':stage.starved,'blocked':stage.blocked}
+    statsDf = pd.DataFrame.from_dict(rows,orient='index')
+    statsDf.attrs['seconds'] = stages['download'].seconds
+    return statsDf
+
+def _readCheckpoint(checkpoint):
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as file:
+        return set(line.strip() for line in file if line.strip())
+
+def _markCompleted(checkpoint,filenames):
+    # One line per file, appended and flushed to disk, so the checkpoint does not get slower with the number of files.
+    with open(checkpoint,'a') as file:
+        file.write(''.join(filename+'\n' for filename in filenames))
+        file.flush()
+        os.fsync(file.fileno())
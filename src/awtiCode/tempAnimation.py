@@ -6,16 +6,24 @@ Created on Fri Dec 30 11:01:39 2022
 """
 
 import numpy as np
-from matplotlib import pyplot as plt, animation
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
+import subprocess
+import threading
+from .instrumentation import logger, span
 
-def animateLatLonNC(dataset,data_var='none',lonDim='lon',latDim='lat',timeDim='time',saveAni = False,**kwargs):
+def animateLatLonNC(dataset,data_var='none',lonDim='lon',latDim='lat',timeDim='time',saveAni = False,render='contour',
+                    bbox=None,stride=1,prefetch=4,**kwargs):
     """
     This function returns an animation of an xarray DataSet data variable, over time, for latitudes and longitudes. It is built for temperatures in Kelvin.
 
     Parameters
     ----------
-    dataset : xarray Dataset
+    dataset : xarray Dataset, or str
         A dataset with a data_variable to animate, that has dims time, latitude and longitude.
+        This can also be the path of a netCDF file or of a Zarr store made with awtiCode.mixedFileTypes.ingestChirps; it is then opened lazily, so only the frames that are shown are read.
+        Chunked data (such as a Zarr store) is read a whole chunk of time steps at once, when that chunk (after bbox and stride) is at most 256 MB.
     data_var : str
         The name of the data variable that needs to be plotted. The default is 'none'; keep it 'none' if you provide a dataset of the datavariable itself.
         For example, dataset ds with data_var air can be inserted like 
@@ -30,6 +38,19 @@ def animateLatLonNC(dataset,data_var='none',lonDim='lon',latDim='lat',timeDim='t
         The name of the time dimension in the dataset. The default is 'time'.
     saveAni : boolean, optional
         If True, saves the animation on your laptop as 'animation.mp4'. The default is False.
+        For long animations, exportAnimation is much faster.
+    render : str, optional
+        How frames are drawn. The default is 'contour'.
+        'contour': filled contours (contourf), recalculated for every frame.
+        'fast': one image (imshow for a regular grid, otherwise pcolormesh) that only gets new values every frame, with blitting.
+        Use 'fast' for long animations (for example many years of monthly data); the frames show the grid cells instead of smoothed contours.
+    bbox : 4-sized collection (minLat,maxLat,minLon,maxLon), optional
+        Only show (and read) this area. The default is None (the whole grid).
+    stride : int, optional
+        Only show (and read) every stride-th latitude and longitude, to coarsen large grids. The default is 1 (all grid cells).
+    prefetch : int, optional
+        The number of next frames that a background thread reads while the current frame is shown. Only these frames are kept in memory,
+        so lazily opened (netCDF or dask) data is never loaded completely. Use 0 to read every frame when it is shown. The default is 4.
     **kwargs : other settings
         Other settings that can be supplied are 'cmap', 'vmin', 'vmax' and 'cbar_label'.
         Default cmap is 'coolwarm'. To use for example the cmap 'jet', include cmap='jet'
@@ -39,51 +60,329 @@ def animateLatLonNC(dataset,data_var='none',lonDim='lon',latDim='lat',timeDim='t
     Returns
     -------
     anim : The matplotlib animation
+        Its frame source is available as anim.frameSource. Its background thread stops when the figure is closed, or when anim.frameSource.close() is called.
 
     """
+    from matplotlib import pyplot as plt, animation
     
     
-    if 'cmap' in kwargs.keys():
-        cmap = kwargs['cmap']
-    else:
-        cmap = 'coolwarm'
-    
-    if 'vmin' in kwargs.keys():
-        vmin = kwargs['vmin']
-    else:
-        vmin = 280
+    cmap, vmin, vmax, cbarlabel = _plotSettings(kwargs)
+    if render not in ['fast','contour']:
+        logger.error('ERROR: render '+str(render)+' unknown. Please select "contour" or "fast".')
+        return None
+    dataset = _prepareGrid(dataset,data_var,lonDim,latDim,timeDim,bbox,stride)
+    source = FrameSource(dataset,prefetch=prefetch)
+    labels = _timeLabels(dataset[timeDim])
+    lons = dataset[lonDim].values
+    lats = dataset[latDim].values
     
-    if 'vmax' in kwargs.keys():
-        vmax = kwargs['vmax']
-    else:
-        vmax = 310
+    fig, ax = plt.subplots()
+    if render == 'fast':
+        artist, timeText = _frameArtists(fig,ax,lons,lats,source[0],labels[0],cmap,vmin,vmax,cbarlabel)
         
-    if 'cbar_label' in kwargs.keys():
-        cbarlabel = kwargs['cbar_label']
+        def animate(i):
+            with span('animation.frame'):
+                artist.set_array(np.ma.masked_invalid(source[i]))
+                timeText.set_text(labels[i])
+            return artist, timeText
+        blit = True
     else:
-        cbarlabel = 'Temperature (Kelvin)'
+        contours = [ax.contourf(lons, lats, source[0], cmap=cmap,vmin=vmin,vmax=vmax)]
+        cbar=fig.colorbar(contours[0])
+        cbar.set_label(cbarlabel)
+        
+        def animate(i):
+            with span('animation.frame'):
+                # Also when frame 0 is drawn again (repeat, redraw), the previous contours are removed first.
+                contours[0].remove()
+                contours[0] = ax.contourf(lons, lats, source[i], cmap=cmap,vmin=vmin,vmax=vmax)
+                ax.set_title(labels[i])
+        blit = False
+
+    anim = animation.FuncAnimation(fig, animate, interval=100, frames=len(labels), blit=blit)
+    anim.frameSource = source
+    # Closing the figure stops the read-ahead thread, which otherwise keeps waiting (and holding the data) after the animation is gone.
+    fig.canvas.mpl_connect('close_event', lambda event: source.close())
+    fig.show()
+    
+    if saveAni==True:    
+        anim.save('animation.mp4') 
+    return anim
+
+def exportAnimation(dataset,output='animation.mp4',data_var='none',lonDim='lon',latDim='lat',timeDim='time',
+                    frames=None,size=(960,720),fps=10,processes=None,framesPerTask=16,bbox=None,stride=1,**kwargs):
+    """
+    This function saves an animation of an xarray data variable over time as a video, without showing it.
+    The frames are drawn like animateLatLonNC with render='fast', off-screen and in parallel by several processes.
+    The frames are sent in order, as raw pixels, to one ffmpeg process that encodes the video; no image files are written.
+
+    Parameters
+    ----------
+    dataset : xarray Dataset or DataArray, or str
+        See animateLatLonNC. Data is read per task of framesPerTask frames, or per chunk of time steps for chunked data.
+    output : str, optional
+        The path of the video file. The format follows from the extension (for example .mp4, .avi or .gif). The default is 'animation.mp4'.
+    data_var, lonDim, latDim, timeDim :
+        See animateLatLonNC.
+    frames : tuple of ints, optional
+        The range of time steps to export, as (start, stop) or (start, stop, step), like range(). The default is None (all time steps).
+    size : tuple of ints, optional
+        The size of the video (width, height) in pixels. Odd numbers are rounded down to even numbers, as most video codecs require. The default is (960,720).
+    fps : int, optional
+        The number of frames per second of the video. The default is 10.
+    processes : int, optional
+        The number of processes that draw frames. The default is None (the number of CPUs).
+    framesPerTask : int, optional
+        The number of frames a process draws at once. The default is 16.
+    bbox, stride :
+        See animateLatLonNC.
+    **kwargs : other settings
+        'cmap', 'vmin', 'vmax' and 'cbar_label'; see animateLatLonNC.
+
+    Returns
+    -------
+    output : str
+        The path of the saved video. None if ffmpeg could not be found or encoding failed.
+
+    """
+    import matplotlib
+    ffmpeg = shutil.which(matplotlib.rcParams['animation.ffmpeg_path'])
+    if ffmpeg is None:
+        logger.error('ERROR: ffmpeg not found. Install ffmpeg, or set matplotlib.rcParams["animation.ffmpeg_path"].')
+        return None
     
-    if data_var == 'none':
-        dataset = dataset
+    cmap, vmin, vmax, cbarlabel = _plotSettings(kwargs)
+    dataset = _prepareGrid(dataset,data_var,lonDim,latDim,timeDim,bbox,stride)
+    labels = _timeLabels(dataset[timeDim])
+    if frames is None:
+        frameIdx = np.arange(len(labels))
     else:
-        dataset = dataset[data_var]
+        frameIdx = np.arange(len(labels))[slice(*frames)]
+    if len(frameIdx) == 0:
+        logger.error('ERROR: no time steps in frames '+str(frames)+'.')
+        return None
+    width, height = int(size[0])//2*2, int(size[1])//2*2
     
-    fig, ax = plt.subplots()
-    cax = ax.contourf(dataset[lonDim], dataset[latDim], dataset[0], cmap=cmap,vmin=vmin,vmax=vmax)
-    cbar=fig.colorbar(cax)
-    cbar.set_label(cbarlabel)
+    figure = dict(lons=dataset[lonDim].values,lats=dataset[latDim].values,cmap=cmap,vmin=vmin,vmax=vmax,
+                  cbarlabel=cbarlabel,width=width,height=height)
+    command = [ffmpeg,'-y','-loglevel','error','-f','rawvideo','-pix_fmt','rgb24','-s',str(width)+'x'+str(height),
+               '-r',str(fps),'-i','-','-an']
+    if os.path.splitext(output)[1].lower() in ['.mp4','.mov','.mkv']:
+        command += ['-c:v','libx264','-pix_fmt','yuv420p']
+    command += [output]
+    
+    if processes is None:
+        processes = os.cpu_count() or 1
+    tasks = [frameIdx[i:i+framesPerTask] for i in range(0,len(frameIdx),framesPerTask)]
+    source = FrameSource(dataset,prefetch=0)
+    encoder = subprocess.Popen(command,stdin=subprocess.PIPE)
     
-    def animate(i):
-        global cax
-        if i>0:
-            for c in cax.collections:
-                c.remove()
-        cax = ax.contourf(dataset[lonDim], dataset[latDim], dataset[i], cmap=cmap,vmin=vmin,vmax=vmax)
-        ax.set_title(dataset[timeDim].dt.strftime('%B %Y')[i].values)
+    def write(future):
+        # Waiting for a task measures rendering that the workers did not finish in time; writing measures ffmpeg.
+        with span('animation.wait'):
+            frames = future.result()
+        with span('animation.encode',bytes=len(frames)):
+            encoder.stdin.write(frames)
+    
+    try:
+        with ProcessPoolExecutor(max_workers=processes,initializer=_initFrameWorker,initargs=(figure,)) as executor:
+            # At most two tasks per process are in flight, so finished frames wait in memory only briefly.
+            pending = []
+            for task in tasks:
+                data = np.asarray(dataset[task]) if dataset.chunks is None else np.stack([source[t] for t in task])
+                pending.append(executor.submit(_renderFrames,data,[labels[t] for t in task]))
+                if len(pending) >= 2*processes:
+                    write(pending.pop(0))
+            for future in pending:
+                write(future)
+        encoder.stdin.close()
+    except BrokenPipeError:
+        pass
+    finally:
+        if not encoder.stdin.closed:
+            encoder.stdin.close()
+        returncode = encoder.wait()
+    if returncode != 0:
+        logger.error('ERROR: ffmpeg stopped with exit code '+str(returncode)+'.')
+        return None
+    logger.info(str(len(frameIdx))+' frames saved to '+output+'.')
+    return output
 
-    anim = animation.FuncAnimation(fig, animate, interval=100, frames=len(dataset.time))
-    fig.show()
+def _plotSettings(kwargs):
+    cmap = kwargs.get('cmap','coolwarm')
+    vmin = kwargs.get('vmin',280)
+    vmax = kwargs.get('vmax',310)
+    cbarlabel = kwargs.get('cbar_label','Temperature (Kelvin)')
+    return cmap, vmin, vmax, cbarlabel
+
+def _prepareGrid(dataset,data_var,lonDim,latDim,timeDim,bbox=None,stride=1):
+    """Select the data variable, order the dims as (time, lat, lon), make both axes ascending and crop/coarsen (lazily)."""
+    if isinstance(dataset,str):
+        from .mixedFileTypes import openStore
+        dataset = openStore(dataset)
+    if data_var != 'none':
+        dataset = dataset[data_var]
+    dataset = dataset.transpose(timeDim,latDim,lonDim)
+    for dim in [latDim,lonDim]:
+        values = dataset[dim].values
+        if len(values) > 1 and values[0] > values[-1]:
+            dataset = dataset.isel({dim:slice(None,None,-1)})
+    if bbox is not None:
+        minLat, maxLat, minLon, maxLon = bbox
+        dataset = dataset.sel({latDim:slice(minLat,maxLat),lonDim:slice(minLon,maxLon)})
+    if stride > 1:
+        dataset = dataset.isel({latDim:slice(None,None,stride),lonDim:slice(None,None,stride)})
+    return dataset
+
+class FrameSource:
+    """
+    Frames (2D numpy arrays) of a (time, lat, lon) xarray DataArray, read on demand.
     
-    if saveAni==True:    
-        anim.save('animation.mp4') 
-    return anim
\ No newline at end of file
+    A background thread reads the next prefetch frames into a small buffer while the current frame is shown.
+    Frames outside that window are dropped, so memory use does not depend on the number of time steps.
+    For data that is chunked along time (dask, for example a Zarr store), the whole chunk around a frame is read at once and kept until a frame
+    of another chunk is needed, provided the chunk is at most slabBytes; otherwise every frame would decompress its complete chunk again.
+    Indexes wrap around, like a repeating animation.
+    Call close() (or use the source in a with statement) to stop the background thread.
+    """
+    def __init__(self,dataarray,prefetch=4,slabBytes=2**28):
+        self.data = dataarray
+        self.prefetch = prefetch
+        self._bounds = None
+        if dataarray.chunks is not None:
+            timeChunks = dataarray.chunks[0]
+            if max(timeChunks)*dataarray[0].size*dataarray.dtype.itemsize <= slabBytes:
+                self._bounds = np.cumsum((0,)+tuple(timeChunks))
+        self._slab = (None,None)
+        self._slabLock = threading.Lock()
+        self._buffer = {}
+        self._current = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+        if prefetch > 0:
+            self._thread = threading.Thread(target=self._readAhead,daemon=True)
+            self._thread.start()
+    
+    def __len__(self):
+        return self.data.shape[0]
+    
+    def __getitem__(self,i):
+        i = i % len(self)
+        with self._condition:
+            self._current = i
+            frame = self._buffer.pop(i,None)
+            self._dropOutside()
+            self._condition.notify_all()
+        if frame is None:
+            frame = self._read(i)
+        return frame
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exception):
+        self.close()
+        return False
+    
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._buffer.clear()
+            self._slab = (None,None)
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _read(self,i):
+        if self._bounds is None:
+            return np.asarray(self.data[i].values)
+        k = np.searchsorted(self._bounds,i,side='right')-1
+        start, end = self._bounds[k], self._bounds[k+1]
+        # The lock makes the display and the read-ahead thread share one read of a slab.
+        with self._slabLock:
+            if self._slab[0] != start:
+                self._slab = (start,np.asarray(self.data[start:end].values))
+            return self._slab[1][i-start]
+    
+    def _window(self):
+        return [(self._current+k) % len(self) for k in range(1,self.prefetch+1)]
+    
+    def _dropOutside(self):
+        window = self._window()
+        for i in list(self._buffer):
+            if i not in window:
+                del self._buffer[i]
+    
+    def _readAhead(self):
+        while True:
+            with self._condition:
+                while not self._closed and all(i in self._buffer for i in self._window()):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                i = next(i for i in self._window() if i not in self._buffer)
+            frame = self._read(i)
+            with self._condition:
+                if not self._closed and i in self._window():
+                    self._buffer[i] = frame
+
+def _timeLabels(times,timeFormat='%B %Y'):
+    """Format all time labels once, instead of once per frame."""
+    if np.issubdtype(times.dtype,np.datetime64) or times.dtype == object:
+        try:
+            return list(times.dt.strftime(timeFormat).values)
+        except (AttributeError, TypeError):
+            pass
+    return [str(t) for t in times.values]
+
+def _isRegular(values):
+    if len(values) < 2:
+        return True
+    steps = np.diff(values.astype(float))
+    return np.allclose(steps,steps[0],rtol=1e-3,atol=0)
+
+def _frameArtists(fig,ax,lons,lats,frame,label,cmap,vmin,vmax,cbarlabel):
+    """Draw the first frame with a colorbar; returns the image artist and the time label to update."""
+    artist = _gridArtist(ax,lons,lats,frame,cmap,vmin,vmax)
+    cbar=fig.colorbar(artist,ax=ax)
+    cbar.set_label(cbarlabel)
+    # The time label is placed inside the axes, so it is redrawn together with the image when blitting.
+    timeText = ax.text(0.02,0.95,label,transform=ax.transAxes,va='top',bbox={'facecolor':'white','alpha':0.7})
+    return artist, timeText
+
+def _gridArtist(ax,lons,lats,frame,cmap,vmin,vmax):
+    """Create the single artist that shows a frame: imshow for regular grids, pcolormesh otherwise."""
+    if _isRegular(lons) and _isRegular(lats) and len(lons) > 1 and len(lats) > 1:
+        dLon = (lons[-1]-lons[0])/(len(lons)-1)
+        dLat = (lats[-1]-lats[0])/(len(lats)-1)
+        extent = [lons[0]-dLon/2,lons[-1]+dLon/2,lats[0]-dLat/2,lats[-1]+dLat/2]
+        return ax.imshow(frame,origin='lower',extent=extent,aspect='auto',interpolation='nearest',
+                         cmap=cmap,vmin=vmin,vmax=vmax)
+    return ax.pcolormesh(lons,lats,frame,shading='auto',cmap=cmap,vmin=vmin,vmax=vmax)
+
+_frameWorker = {}
+
+def _initFrameWorker(figure):
+    """Create the off-screen figure of a worker process once; tasks only update its values."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(figure['width']/100,figure['height']/100),dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    empty = np.full((len(figure['lats']),len(figure['lons'])),np.nan)
+    artist, timeText = _frameArtists(fig,ax,figure['lons'],figure['lats'],empty,'',figure['cmap'],
+                                     figure['vmin'],figure['vmax'],figure['cbarlabel'])
+    _frameWorker.update(canvas=canvas,artist=artist,timeText=timeText,width=figure['width'],height=figure['height'])
+
+def _renderFrames(data,labels):
+    """Draw frames and return their RGB pixels, concatenated."""
+    canvas = _frameWorker['canvas']
+    pixels = []
+    for frame, label in zip(data,labels):
+        _frameWorker['artist'].set_array(np.ma.masked_invalid(frame))
+        _frameWorker['timeText'].set_text(label)
+        canvas.draw()
+        rgba = np.asarray(canvas.buffer_rgba())
+        pixels.append(rgba[:_frameWorker['height'],:_frameWorker['width'],:3].tobytes())
+    return b''.join(pixels)
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+The tests run from a checkout: src (awtiCode) and the repository root (benchmarks.generators) are put on the path.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'src'), ROOT]
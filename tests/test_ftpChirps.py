@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour tests of awtiCode.ftpChirps against a local FTP server (benchmarks.generators.FtpServer; run with pytest).
+"""
+
+import asyncio
+import ftplib
+import gzip
+import hashlib
+import os
+import socket
+
+import pytest
+
+pytest.importorskip('pyftpdlib')
+
+from awtiCode import ftpChirps
+from benchmarks import generators
+
+
+@pytest.fixture
+def remote(tmp_path):
+    folder = str(tmp_path/'remote')
+    names = generators.writeFiles(folder, 4, 100000)
+    return folder, names
+
+
+@pytest.fixture
+def server(remote):
+    server = generators.FtpServer(remote[0])
+    yield server
+    server.close()
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def freePort():
+    # A port on which nothing listens.
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_bulkSkipsCompleteFiles(remote, server, tmp_path):
+    folder, names = remote
+    local = str(tmp_path/'local')
+    os.makedirs(local)
+    first = ftpChirps.downloadChirpsBulk('/', names, local_folder=local, host=server.host, port=server.port)
+    assert sorted(first['downloaded']) == names and first['bytes'] == 4*100000
+    second = ftpChirps.downloadChirpsBulk('/', names, local_folder=local, host=server.host, port=server.port)
+    assert sorted(second['skipped']) == names and second['bytes'] == 0
+    for name in names:
+        assert read(os.path.join(local, name)) == read(os.path.join(folder, name))
+
+
+def test_bulkResumesTruncatedFile(remote, server, tmp_path):
+    folder, names = remote
+    local = str(tmp_path/'local')
+    os.makedirs(local)
+    with open(os.path.join(local, names[0]), 'wb') as file:
+        file.write(read(os.path.join(folder, names[0]))[:30000])
+    summary = ftpChirps.downloadChirpsBulk('/', names[:1], local_folder=local, host=server.host, port=server.port)
+    assert summary['downloaded'] == names[:1] and summary['bytes'] == 70000
+    assert read(os.path.join(local, names[0])) == read(os.path.join(folder, names[0]))
+
+
+def test_bulkWithoutSizeDownloadsWholeFile(remote, server, tmp_path, monkeypatch):
+    folder, names = remote
+    local = str(tmp_path/'local')
+    os.makedirs(local)
+    with open(os.path.join(local, names[0]), 'wb') as file:
+        file.write(b'partial')
+    def refuse(ftp, filename):
+        raise ftplib.error_perm('502 SIZE not allowed.')
+    monkeypatch.setattr(ftplib.FTP, 'size', refuse)
+    summary = ftpChirps.downloadChirpsBulk('/', names[:1], local_folder=local, host=server.host, port=server.port)
+    assert summary['downloaded'] == names[:1] and summary['bytes'] == 100000
+    assert read(os.path.join(local, names[0])) == read(os.path.join(folder, names[0]))
+
+
+def test_bulkUnreachableHostFails(remote, tmp_path):
+    folder, names = remote
+    summary = ftpChirps.downloadChirpsBulk('/', names[:2], local_folder=str(tmp_path), host='127.0.0.1', port=freePort())
+    assert sorted(summary['failed']) == names[:2] and summary['downloaded'] == []
+
+
+def test_listingCacheSync(remote, server, tmp_path):
+    folder, names = remote
+    cache = ftpChirps.FtpListingCache(str(tmp_path/'listing.sqlite'), ttl=0, host=server.host, port=server.port)
+    try:
+        local = str(tmp_path/'local')
+        os.makedirs(local)
+        first = ftpChirps.downloadChirpsBulk('/', local_folder=local, cache=cache, sync='nightly', host=server.host, port=server.port)
+        assert sorted(first['downloaded']) == names
+        assert cache.newSince('/', 'nightly') == []
+        # A new file and a changed file on the server; the other files are not downloaded again.
+        new = generators.writeFiles(os.path.join(folder, 'new'), 5, 1000, seed=1)[-1]
+        os.replace(os.path.join(folder, 'new', new), os.path.join(folder, new))
+        with open(os.path.join(folder, names[1]), 'ab') as file:
+            file.write(b'more')
+        second = ftpChirps.downloadChirpsBulk('/', pattern='*.tif', local_folder=local, cache=cache, sync='nightly',
+                                              host=server.host, port=server.port)
+        assert sorted(second['downloaded']) == sorted([names[1], new]) and second['skipped'] == []
+        assert read(os.path.join(local, names[1])) == read(os.path.join(folder, names[1]))
+        assert cache.newSince('/', 'nightly') == []
+    finally:
+        cache.close()
+
+
+def test_streamChirpsDecompressesAndHashes(server, remote, tmp_path):
+    folder = remote[0]
+    data = os.urandom(50000)
+    with gzip.open(os.path.join(folder, 'chirps-v2.0.1991.02.01.tif.gz'), 'wb') as file:
+        file.write(data)
+    checksum = hashlib.sha256(read(os.path.join(folder, 'chirps-v2.0.1991.02.01.tif.gz'))).hexdigest()
+    local = str(tmp_path/'local')
+    os.makedirs(local)
+    result = ftpChirps.streamChirps('/', 'chirps-v2.0.1991.02.01.tif.gz', local_folder=local, expectedHash=checksum,
+                                    host=server.host, port=server.port)
+    assert result['hash'] == checksum and result['path'] == os.path.join(local, 'chirps-v2.0.1991.02.01.tif')
+    assert read(result['path']) == data
+
+
+def test_streamChirpsDiscardsWrongHash(server, remote, tmp_path):
+    local = str(tmp_path/'local')
+    os.makedirs(local)
+    result = ftpChirps.streamChirps('/', remote[1][0], local_folder=local, expectedHash='0'*64,
+                                    host=server.host, port=server.port)
+    assert result is None and os.listdir(local) == []
+
+
+def test_walkReconnectsAfterFailedListing(remote, server, monkeypatch):
+    folder = remote[0]
+    for sub in ['2020', '2021', os.path.join('2021', 'tifs')]:
+        os.makedirs(os.path.join(folder, sub))
+    generators.writeFiles(os.path.join(folder, '2021', 'tifs'), 2, 10)
+    mlsd, broken = ftpChirps.AsyncFtp.mlsd, []
+    async def failOnce(ftp, directory=None):
+        # The first listing times out; that connection must not be used again.
+        if not broken:
+            broken.append(ftp)
+            raise asyncio.TimeoutError()
+        assert ftp not in broken
+        return await mlsd(ftp, directory)
+    monkeypatch.setattr(ftpChirps.AsyncFtp, 'mlsd', failOnce)
+    async def walk():
+        return [result async for result in ftpChirps.walkChirpsAsync('/', concurrency=2, host=server.host, port=server.port)]
+    walked = sorted(asyncio.run(asyncio.wait_for(walk(), 30)))
+    assert [path for path, dirnames, filenames in walked] == ['/', '/2020/', '/2021/', '/2021/tifs/']
+    assert walked[-1][2] == ['chirps-v2.0.1991.01.01.tif', 'chirps-v2.0.1991.01.02.tif']
+    assert broken[0].writer is None
+
+
+def test_downloadManyAsyncReplacesBrokenConnection(remote, server, tmp_path, monkeypatch):
+    folder, names = remote
+    retrbinary, broken = ftpChirps.AsyncFtp.retrbinary, []
+    async def failOnce(ftp, filename, callback, rest=None, blocksize=2**16):
+        # The first transfer times out; the retry and the next files must use a new connection.
+        if not broken:
+            broken.append(ftp)
+            raise asyncio.TimeoutError()
+        assert ftp not in broken
+        return await retrbinary(ftp, filename, callback, rest, blocksize)
+    monkeypatch.setattr(ftpChirps.AsyncFtp, 'retrbinary', failOnce)
+    local = str(tmp_path/'local')
+    os.makedirs(local)
+    summary = asyncio.run(asyncio.wait_for(ftpChirps.downloadManyAsync('/', names, local_folder=local, concurrency=1,
+                                                                       host=server.host, port=server.port), 30))
+    assert sorted(summary['downloaded']) == names and summary['failed'] == []
+    assert broken[0].writer is None
+    for name in names:
+        assert read(os.path.join(local, name)) == read(os.path.join(folder, name))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Import regression tests: a plain "import awtiCode" must be fast and must not load any heavy package (run with pytest).
+"""
+
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+# Seconds; a generous bound, so a slow machine does not fail the test but importing pandas or xarray does.
+MAXIMPORTTIME = 0.5
+
+HEAVY = ['pandas', 'xarray', 'dask', 'numpy', 'scipy', 'matplotlib', 'ortools', 'netCDF4', 'zarr', 'aioftp', 'geopandas']
+
+
+def runPython(*arguments):
+    # Run a fresh interpreter; the checkout's src comes first, so the tests also run without installing the package.
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC, os.environ.get('PYTHONPATH')])))
+    return subprocess.run([sys.executable]+list(arguments), capture_output=True, text=True, check=True, env=env)
+
+
+def loadedModules(code):
+    # Names of the top-level modules in sys.modules after running code in a fresh interpreter.
+    result = runPython('-c', code+'\nimport sys\nprint("\\n".join(sys.modules))')
+    return {name.split('.')[0] for name in result.stdout.split()}
+
+
+def test_importLoadsNoHeavyModules():
+    loaded = loadedModules('import awtiCode')
+    assert 'awtiCode' in loaded
+    heavy = sorted(set(HEAVY) & loaded)
+    assert heavy == [], 'import awtiCode loads '+', '.join(heavy)
+
+
+def test_importTime():
+    # The import tree of python -X importtime: lines 'import time: self [us] | cumulative | (indented) module'.
+    tree = {}
+    for line in runPython('-X', 'importtime', '-c', 'import awtiCode').stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[1].isdigit():
+            tree[parts[2]] = int(parts[1])/1e6
+    assert 'awtiCode' in tree
+    heavy = sorted({name.split('.')[0] for name in tree} & {'pandas', 'xarray', 'ortools', 'matplotlib'})
+    assert heavy == [], 'import awtiCode imports '+', '.join(heavy)
+    # Importing the heavy packages takes seconds; the package itself should take milliseconds.
+    assert tree['awtiCode'] < MAXIMPORTTIME, 'import awtiCode took '+f'{tree["awtiCode"]:.3f}'+' s'
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour tests of awtiCode.mixedFileTypes (run with pytest).
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip('xarray')
+
+from awtiCode import mixedFileTypes
+from benchmarks import generators
+
+COORD = (generators.LAT0+0.32, generators.LON0+0.41)
+
+
+@pytest.fixture
+def ncFile(tmp_path):
+    path = str(tmp_path/'grid.nc')
+    generators.chirpsGrid(20, nlat=10, nlon=10).to_netcdf(path)
+    return path
+
+
+def test_cacheHitsUnchangedFile(ncFile, tmp_path):
+    cache = mixedFileTypes.ResultCache(str(tmp_path/'cache'))
+    with xr.open_dataset(ncFile) as dataset:
+        first = mixedFileTypes.ncDataSelect(dataset, COORD, cache=cache)
+        second = mixedFileTypes.ncDataSelect(dataset, COORD, cache=cache)
+    assert cache.hits == 1
+    pd.testing.assert_frame_equal(first, second)
+
+
+@pytest.mark.parametrize('change', ['reassign', 'arithmetic'])
+def test_cacheMissesDataChangedInMemory(ncFile, tmp_path, change):
+    cache = mixedFileTypes.ResultCache(str(tmp_path/'cache'))
+    with xr.open_dataset(ncFile) as dataset:
+        before = mixedFileTypes.ncDataSelect(dataset, COORD, cache=cache)
+        if change == 'reassign':
+            changed = dataset.copy()
+            changed['precip'] = dataset.precip*10
+        else:
+            changed = dataset*10
+        after = mixedFileTypes.ncDataSelect(changed, COORD, cache=cache)
+    assert cache.hits == 0
+    np.testing.assert_allclose(after.values, before.values*10, rtol=1e-6)
+
+
+def test_memoryLimitSplitsLargeChunks(ncFile):
+    pytest.importorskip('dask')
+    with xr.open_dataset(ncFile) as dataset:
+        chunked = dataset.chunk({'time': 20, 'latitude': 5, 'longitude': 5})
+        # Room for 4 time steps of a 5x5 float32 chunk per worker: the time chunks are split, the spatial chunks stay.
+        limit = 4*5*5*4*(os.cpu_count() or 1)
+        lazy = mixedFileTypes._lazyChunk(chunked, 'precip', limit)
+        assert lazy.precip.chunks == ((4,)*5, (5, 5), (5, 5))
+        assert mixedFileTypes._lazyChunk(chunked, 'precip', None).precip.chunks == chunked.precip.chunks
+        expected = mixedFileTypes.ncDataSelect(dataset, COORD, data_var='precip')
+        result = mixedFileTypes.ncDataSelect(chunked, COORD, data_var='precip', lazy=True, memoryLimit=limit)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize('method', ['closest', 'average', 'idw'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_stationGridIndexEqualsNcDataSelectMulti(tmp_path, method, descending):
+    grid = generators.chirpsGrid(15, nlat=20, nlon=25)
+    if descending:
+        grid = grid.isel(latitude=slice(None, None, -1))
+    coords = generators.stationCoords(6, 20, 25)
+    expected = mixedFileTypes.ncDataSelectMulti(grid, coords, method, data_var='precip')
+    index = mixedFileTypes.StationGridIndex.fromDataset(grid, coords, method)
+    pd.testing.assert_frame_equal(index.apply(grid, 'precip'), expected, check_dtype=False, check_freq=False)
+    index.save(str(tmp_path/'index.npz'))
+    loaded = mixedFileTypes.StationGridIndex.load(str(tmp_path/'index.npz'))
+    assert loaded.matches(grid)
+    pd.testing.assert_frame_equal(loaded.apply(grid.chunk({'time': 4}), 'precip'), expected, check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize('resample', ['m', 'W'])
+def test_alignStationsNcEqualsAlignStationNc(resample):
+    grid = generators.chirpsGrid(120, nlat=20, nlon=25)
+    coords = generators.stationCoords(5, 20, 25)
+    ncdata = mixedFileTypes.ncDataSelectMulti(grid, coords, 'idw', data_var='precip')
+    stationdata = generators.stationPanel(5, 120)
+    aligned = mixedFileTypes.alignStationsNc(stationdata, ncdata, resample)
+    for station in stationdata.columns:
+        expected = mixedFileTypes.alignStationNc(stationdata[[station]], ncdata[[station]], resample)
+        rows = aligned[aligned['station'] == station].set_index('time')
+        np.testing.assert_array_equal(rows.index.values, expected.index.values)
+        np.testing.assert_allclose(rows['stationdata'].values, expected[station].values, rtol=1e-6)
+        np.testing.assert_allclose(rows['ncdata'].values, expected['ncdata'].values, rtol=1e-6)
+    # A lazy DataArray of the same data gives the same table.
+    lazy = xr.DataArray(ncdata.values, dims=('time', 'station'), coords={'time': ncdata.index.values, 'station': ncdata.columns}).chunk({'time': 30})
+    pd.testing.assert_frame_equal(mixedFileTypes.alignStationsNc(stationdata, lazy, resample), aligned)
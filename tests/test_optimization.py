@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour tests of awtiCode.optimization (run with pytest).
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('ortools')
+
+from awtiCode import optimization
+
+PROFIT = [75000, 60000, 100000, 150000]
+
+
+def fieldProfits(fieldsDf):
+    crop = fieldsDf['crop'].map({name: i for i, name in enumerate(sorted(fieldsDf['crop'].unique()))}).values
+    profit = fieldsDf['sown'].values*np.array(PROFIT)[crop]
+    return fieldsDf.assign(profit=profit).groupby('field')['profit'].sum()
+
+
+def test_symmetryBreakingOrdersIdenticalFieldsThatAreNotAdjacent():
+    settings = dict(noYears=1, fieldAreas=[200, 400, 200, 400, 200], waterAvailable=90000, cropProfit=PROFIT, relativeGap=0, maxTime=30)
+    broken = optimization.cropScheduleFields(symmetryBreaking=True, **settings)
+    free = optimization.cropScheduleFields(symmetryBreaking=False, **settings)
+    assert broken.attrs['status'] == free.attrs['status'] == 'OPTIMAL'
+    assert broken.attrs['objective'] == free.attrs['objective']
+    profits = fieldProfits(broken)
+    assert profits.sum() == broken.attrs['objective']
+    assert profits[1] >= profits[3] >= profits[5] and profits[2] >= profits[4]
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour tests of awtiCode.pipeline against a local FTP server (benchmarks.generators.FtpServer; run with pytest).
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyftpdlib')
+xr = pytest.importorskip('xarray')
+pytest.importorskip('zarr')
+
+from awtiCode import mixedFileTypes, pipeline
+from benchmarks import generators
+
+DAYS = 16
+
+
+@pytest.fixture
+def server(tmp_path):
+    remote = str(tmp_path/'remote')
+    filenames = generators.writeChirpsFiles(remote, DAYS, nlat=20, nlon=25)
+    server = generators.FtpServer(remote)
+    yield server, filenames
+    server.close()
+
+
+def run(server, filenames, folder, **settings):
+    os.makedirs(folder, exist_ok=True)
+    return pipeline.runPipeline('/', generators.stationCoords(4, 20, 25), os.path.join(folder, 'stations.csv'), filenames=filenames,
+                                local_folder=folder, store=os.path.join(folder, 'store.zarr'), host=server.host, port=server.port,
+                                queueSize=2, **settings)
+
+
+def test_killedRunResumesFromCheckpoint(server, tmp_path, monkeypatch):
+    server, filenames = server
+    folder = str(tmp_path/'local')
+    # The run stops with an error in the middle, like a killed process.
+    apply, calls = mixedFileTypes.StationGridIndex.apply, []
+    def crash(index, dataset, data_var='precip'):
+        calls.append(1)
+        if len(calls) == 7:
+            raise KeyboardInterrupt()
+        return apply(index, dataset, data_var)
+    monkeypatch.setattr(mixedFileTypes.StationGridIndex, 'apply', crash)
+    with pytest.raises(KeyboardInterrupt):
+        run(server, filenames, folder)
+    monkeypatch.setattr(mixedFileTypes.StationGridIndex, 'apply', apply)
+    with open(os.path.join(folder, 'stations.csv.done')) as file:
+        completed = file.read().split()
+    assert 0 < len(completed) < DAYS and completed == filenames[:len(completed)]
+
+    resumed, statsDf = run(server, filenames, folder, stats=True)
+    assert statsDf.loc['extract', 'files'] == DAYS-len(completed)
+    clean = run(server, filenames, str(tmp_path/'clean'))
+    pd.testing.assert_frame_equal(resumed, clean)
+    grid = generators.chirpsGrid(DAYS, nlat=20, nlon=25)
+    with xr.open_zarr(os.path.join(folder, 'store.zarr')) as store:
+        np.testing.assert_array_equal(store['time'].values, grid['time'].values)
+        np.testing.assert_array_equal(store['precip'].values, grid['precip'].values)
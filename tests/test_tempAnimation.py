@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour tests of awtiCode.tempAnimation (run with pytest).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+xr = pytest.importorskip('xarray')
+
+from matplotlib import pyplot as plt
+from matplotlib.backend_bases import CloseEvent
+
+from awtiCode import tempAnimation
+
+
+def grid():
+    return xr.DataArray(290+np.random.default_rng(0).random((6, 4, 5)), dims=('time', 'lat', 'lon'),
+                        coords={'time': pd.date_range('2020-01-01', periods=6, freq='MS'), 'lat': np.arange(4.), 'lon': np.arange(5.)})
+
+
+@pytest.mark.parametrize('render', ['contour', 'fast'])
+def test_closingFigureStopsReadAhead(render):
+    anim = tempAnimation.animateLatLonNC(grid(), render=render)
+    anim._fig.canvas.draw()
+    thread = anim.frameSource._thread
+    assert thread.is_alive()
+    anim._fig.canvas.callbacks.process('close_event', CloseEvent('close_event', anim._fig.canvas))
+    assert not thread.is_alive()
+    plt.close(anim._fig)
+
+
+def test_frameSourceContextManager():
+    data = grid()
+    with tempAnimation.FrameSource(data, prefetch=2) as source:
+        frames = [source[i] for i in range(8)]
+    assert not source._thread.is_alive()
+    np.testing.assert_array_equal(frames[7], data[1].values)